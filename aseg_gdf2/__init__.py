@@ -1,3 +1,5 @@
 from aseg_gdf2.gdf2 import read, GDF2
+from aseg_gdf2.writer import write
+from aseg_gdf2.catalogue import scan
 
 __version__ = "0.8.0"
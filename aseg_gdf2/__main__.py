@@ -0,0 +1,5 @@
+import sys
+
+from aseg_gdf2.cli import main
+
+sys.exit(main())
@@ -0,0 +1,211 @@
+"""Columnar sidecar cache for parsed .dat files.
+
+The first full read of a data table is written to a directory of .npy
+files, one per column, next to the .dat file. Later reads load the columns
+straight from those files instead of parsing the ASCII table again.
+
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+CACHE_VERSION = 1
+
+
+def file_signature(filename):
+    """Return the size and modification time of a file."""
+    stat = os.stat(filename)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def file_hash(filename, blocksize=2 ** 20):
+    """Return the SHA-1 hex digest of a file's contents."""
+    h = hashlib.sha1()
+    with open(filename, "rb") as f:
+        while True:
+            b = f.read(blocksize)
+            if not b:
+                break
+            h.update(b)
+    return h.hexdigest()
+
+
+class ColumnCache(object):
+    """Directory of .npy files caching the columns of a data table.
+
+    Arguments:
+        dat_filename (str): the .dat file being cached
+        path (str): directory to hold the cache
+        schema (dict): JSON-serialisable description of how the table is
+            parsed (column names, dtypes, nulls, method). The cache is
+            rebuilt if this changes.
+
+    The cache is valid while the .dat file has the same size and mtime as
+    when it was written. If only the mtime has changed the file is hashed
+    and the cache is kept if the contents are the same, with the new mtime
+    saved so that the file is not hashed again.
+
+    """
+
+    def __init__(self, dat_filename, path, schema):
+        self.dat_filename = dat_filename
+        self.path = path
+        self.schema = schema
+        self._manifest = None
+
+    def __repr__(self):
+        return "<{}.{} {}>".format(
+            self.__class__.__module__, self.__class__.__name__, self.path
+        )
+
+    @property
+    def manifest(self):
+        if self._manifest is None:
+            try:
+                with open(os.path.join(self.path, MANIFEST), "r") as f:
+                    self._manifest = json.load(f)
+            except (OSError, ValueError):
+                return None
+        return self._manifest
+
+    def is_valid(self):
+        """Check whether the cache matches the current .dat file and schema."""
+        manifest = self.manifest
+        if manifest is None:
+            return False
+        if manifest.get("version") != CACHE_VERSION:
+            return False
+        if manifest["schema"] != self.schema:
+            logger.info("Cache {} has a different schema".format(self.path))
+            return False
+        signature = file_signature(self.dat_filename)
+        if signature["size"] != manifest["size"]:
+            return False
+        if signature["mtime_ns"] != manifest["mtime_ns"]:
+            if file_hash(self.dat_filename) != manifest["sha1"]:
+                return False
+            logger.debug("{} was touched but has not changed".format(self.dat_filename))
+            manifest = dict(manifest, mtime_ns=signature["mtime_ns"])
+            try:
+                self._write_manifest(manifest)
+            except OSError as e:
+                logger.warning("Unable to update cache {}: {}".format(self.path, e))
+        return True
+
+    def clear(self):
+        """Delete the cache directory."""
+        self._manifest = None
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+
+    def write(self, df):
+        """Write a DataFrame to the cache, replacing anything already there.
+
+        Args:
+            df (pandas.DataFrame): the complete data table
+
+        """
+        signature = file_signature(self.dat_filename)
+        sha1 = file_hash(self.dat_filename)
+        self.clear()
+        os.makedirs(self.path)
+        columns = []
+        for i, name in enumerate(df.columns):
+            filename = "c{:05d}.npy".format(i)
+            column = {"name": name, "file": filename, "mask": None}
+            series = df[name]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                column["category"] = True
+                series = series.astype(object)
+            if series.dtype == object:
+                mask = series.isna().to_numpy()
+                values = np.asarray(series.where(~mask, "").astype(str), dtype=str)
+                if mask.any():
+                    column["mask"] = "c{:05d}.mask.npy".format(i)
+                    np.save(os.path.join(self.path, column["mask"]), mask)
+            else:
+                values = series.to_numpy()
+            np.save(os.path.join(self.path, filename), values)
+            columns.append(column)
+        manifest = {
+            "version": CACHE_VERSION,
+            "schema": self.schema,
+            "nrecords": len(df),
+            "columns": columns,
+            "sha1": sha1,
+        }
+        manifest.update(signature)
+        # Writing the manifest last means an interrupted write leaves an
+        # invalid cache rather than a corrupt one.
+        self._write_manifest(manifest)
+        logger.info("Wrote {} columns to cache {}".format(len(columns), self.path))
+
+    def _write_manifest(self, manifest):
+        tmp = os.path.join(self.path, MANIFEST + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, os.path.join(self.path, MANIFEST))
+        self._manifest = manifest
+
+    def _load_column(self, column, start=0, stop=None):
+        values = np.load(os.path.join(self.path, column["file"]), mmap_mode="r")
+        values = values[start:stop]
+        if values.dtype.kind == "U":
+            values = values.astype(object)
+            if column["mask"]:
+                mask = np.load(os.path.join(self.path, column["mask"]), mmap_mode="r")
+                values[mask[start:stop]] = np.nan
+            if column.get("category", False):
+                values = pd.Categorical(values)
+        else:
+            values = np.array(values)
+        return values
+
+    def _frame(self, usecols=None, start=0, stop=None):
+        columns = {
+            c["name"]: self._load_column(c, start, stop)
+            for c in self.manifest["columns"]
+            if usecols is None or c["name"] in usecols
+        }
+        stop = self.manifest["nrecords"] if stop is None else stop
+        stop = min(stop, self.manifest["nrecords"])
+        return pd.DataFrame(
+            columns, index=pd.RangeIndex(start, stop), columns=list(columns)
+        )
+
+    def rows(self, start, stop, usecols=None):
+        """Read records start to stop from the cache as a DataFrame."""
+        if usecols is not None:
+            usecols = set(usecols)
+        return self._frame(usecols, start, stop)
+
+    def read(self, usecols=None, chunksize=None, nrows=None):
+        """Read the cached table.
+
+        Args:
+            usecols (list): column names to load, or None for all
+            chunksize (int): if given, return an iterator of DataFrames
+            nrows (int): number of records to read from the start
+
+        Returns: pandas.DataFrame, or an iterator of them if chunksize is set.
+
+        """
+        if usecols is not None:
+            usecols = set(usecols)
+        nrecords = self.manifest["nrecords"]
+        if not nrows is None:
+            nrecords = min(nrows, nrecords)
+        if chunksize:
+            return (
+                self._frame(usecols, i, min(i + chunksize, nrecords))
+                for i in range(0, nrecords, chunksize)
+            )
+        return self._frame(usecols, 0, nrecords)
@@ -0,0 +1,499 @@
+"""Catalogue directory trees of GDF2 data packages in an SQLite database.
+
+:func:`scan` walks a directory tree, pairs up the .dfn, .dat, .des and .met
+files of each data package and records its field definitions, record count,
+the range of each numeric field and its bounding box. Packages whose files
+have not changed since the last scan are skipped, so re-scanning an archive
+only reads the new and modified packages.
+
+The catalogue has two tables, ``packages`` (one row per .dfn file) and
+``fields`` (one row per field of each package), which can be queried
+directly with SQL or through :class:`Catalogue`.
+
+"""
+from concurrent.futures import ProcessPoolExecutor
+import datetime
+from itertools import repeat
+import logging
+import os
+import re
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from aseg_gdf2 import compression
+from aseg_gdf2.gdf2 import GDF2
+
+logger = logging.getLogger(__name__)
+
+CATALOGUE_FILENAME = "aseg_gdf2_catalogue.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS packages (
+    id INTEGER PRIMARY KEY,
+    dfn TEXT UNIQUE NOT NULL,
+    dat TEXT,
+    des TEXT,
+    met TEXT,
+    dfn_mtime_ns INTEGER,
+    dfn_size INTEGER,
+    dat_mtime_ns INTEGER,
+    dat_size INTEGER,
+    nrecords INTEGER,
+    nfields INTEGER,
+    ncolumns INTEGER,
+    lon_field TEXT,
+    lat_field TEXT,
+    lon_min REAL,
+    lon_max REAL,
+    lat_min REAL,
+    lat_max REAL,
+    x_field TEXT,
+    y_field TEXT,
+    x_min REAL,
+    x_max REAL,
+    y_min REAL,
+    y_max REAL,
+    error TEXT,
+    scanned TEXT
+);
+CREATE TABLE IF NOT EXISTS fields (
+    package_id INTEGER NOT NULL REFERENCES packages(id) ON DELETE CASCADE,
+    position INTEGER,
+    name TEXT,
+    format TEXT,
+    cols INTEGER,
+    unit TEXT,
+    null_value TEXT,
+    long_name TEXT,
+    comment TEXT,
+    min REAL,
+    max REAL,
+    count INTEGER
+);
+CREATE INDEX IF NOT EXISTS fields_package_id ON fields(package_id);
+CREATE INDEX IF NOT EXISTS fields_name ON fields(name);
+"""
+
+PACKAGE_COLUMNS = (
+    "dfn",
+    "dat",
+    "des",
+    "met",
+    "dfn_mtime_ns",
+    "dfn_size",
+    "dat_mtime_ns",
+    "dat_size",
+    "nrecords",
+    "nfields",
+    "ncolumns",
+    "lon_field",
+    "lat_field",
+    "lon_min",
+    "lon_max",
+    "lat_min",
+    "lat_max",
+    "x_field",
+    "y_field",
+    "x_min",
+    "x_max",
+    "y_min",
+    "y_max",
+    "error",
+    "scanned",
+)
+
+FIELD_COLUMNS = (
+    "position",
+    "name",
+    "format",
+    "cols",
+    "unit",
+    "null_value",
+    "long_name",
+    "comment",
+    "min",
+    "max",
+    "count",
+)
+
+# Field names used for bounding boxes, e.g. GDA94LAT, LAT_GDA94, Latitude,
+# GDA94LONG, GDA94LLG, LONGGDA94 for geographic coordinates and EAST,
+# Easting, EAST_MGA, AMG84EAST, MGA_E, X for projected coordinates.
+LATITUDE_RE = re.compile(r"(^|_|\d)LAT", re.IGNORECASE)
+LONGITUDE_RE = re.compile(r"(^|_|\d)(LONG?|LLG)", re.IGNORECASE)
+EASTING_RE = re.compile(r"((^|_|\d)(EAST|X($|_))|(^|_)E$)", re.IGNORECASE)
+NORTHING_RE = re.compile(r"((^|_|\d)(NORTH|Y($|_))|(^|_)N$)", re.IGNORECASE)
+
+NUMERIC_CODES = ("I", "F", "E", "D", "G")
+
+
+def find_packages(root):
+    """Find the data packages in a directory tree.
+
+    Each .dfn file is a data package. Its .dat, .des and .met files are the
+    files with the same name and one of those extensions, as for
+    :func:`aseg_gdf2.read`. The .dat file may be compressed (e.g.
+    ``.dat.gz``).
+
+    Returns: a list of dicts with "dfn", "dat", "des" and "met" filenames
+        (None where there is no such file), sorted by .dfn filename.
+
+    """
+    packages = []
+    for dirpath, dirnames, filenames in os.walk(str(root)):
+        dirnames.sort()
+        names = set(filenames)
+        for filename in sorted(filenames):
+            stem, ext = os.path.splitext(filename)
+            if not ext.lower() == ".dfn":
+                continue
+            package = {"dfn": os.path.join(dirpath, filename)}
+            for kind in ("dat", "des", "met"):
+                package[kind] = None
+                candidates = [stem + "." + ext for ext in (kind, kind.upper())]
+                if kind == "dat":
+                    candidates += [
+                        name
+                        for candidate in candidates
+                        for name in compression.compressed_filenames(candidate)
+                    ]
+                for name in candidates:
+                    if name in names:
+                        package[kind] = os.path.join(dirpath, name)
+                        break
+            packages.append(package)
+    return packages
+
+
+def _signature(package):
+    """File sizes and modification times used to detect changed packages."""
+    signature = {}
+    for kind in ("dfn", "dat"):
+        if package[kind] is None:
+            signature[kind + "_mtime_ns"] = None
+            signature[kind + "_size"] = None
+        else:
+            stat = os.stat(package[kind])
+            signature[kind + "_mtime_ns"] = stat.st_mtime_ns
+            signature[kind + "_size"] = stat.st_size
+    return signature
+
+
+def _numeric_values(values):
+    if values.dtype.kind in "iuf":
+        return values
+    return pd.to_numeric(pd.Series(values.ravel()), errors="coerce").to_numpy(
+        dtype=float
+    )
+
+
+def _format_code(field):
+    m = re.match(r"[0-9]*([A-Za-z])", field["format"].strip())
+    return m.group(1).upper() if m else ""
+
+
+def _coordinate_field(fields, regex):
+    for field in fields:
+        if field["cols"] == 1 and regex.search(field["name"]):
+            return field["name"]
+    return None
+
+
+def extract_package(package, chunksize=100000, **kwargs):
+    """Extract the catalogue information for one data package.
+
+    Args:
+        package (dict): filenames, as from ``find_packages``
+        chunksize (int): number of records to read at a time
+        kwargs: passed to :class:`aseg_gdf2.GDF2`, e.g. ``method``
+
+    Returns: a tuple of a dict of the "packages" columns and a list of
+        dicts of the "fields" columns. If the package cannot be read the
+        error message is in the "error" column.
+
+    """
+    row = dict(package)
+    row.update(_signature(package))
+    row["scanned"] = datetime.datetime.now().isoformat(timespec="seconds")
+    field_rows = []
+    try:
+        gdf = GDF2(package["dfn"], **kwargs)
+        if not gdf.dat_filename:
+            raise OSError("No .dat file for {}".format(package["dfn"]))
+        fields = gdf.record_types[""]["fields"]
+        numeric = [
+            f["name"]
+            for f in fields
+            if _format_code(f) in NUMERIC_CODES and not f["name"] == "RT"
+        ]
+        ranges = {name: [np.inf, -np.inf, 0] for name in numeric}
+        nrecords = 0
+        for chunk in gdf.iterchunks(chunksize=chunksize, fields=numeric or None):
+            if numeric:
+                nrecords += len(chunk[numeric[0]])
+            else:
+                nrecords += len(next(iter(chunk.values())))
+            for name in numeric:
+                values = _numeric_values(chunk[name])
+                values = values[~np.isnan(values)] if values.dtype.kind == "f" else values
+                if len(values):
+                    ranges[name][0] = min(ranges[name][0], float(values.min()))
+                    ranges[name][1] = max(ranges[name][1], float(values.max()))
+                    ranges[name][2] += int(values.size)
+        row["nrecords"] = nrecords
+        row["nfields"] = len(fields)
+        row["ncolumns"] = len(gdf.column_names())
+
+        numeric_fields = [f for f in fields if f["name"] in ranges and ranges[f["name"]][2]]
+        for prefix, x_re, y_re in (
+            ("lon", LONGITUDE_RE, LATITUDE_RE),
+            ("x", EASTING_RE, NORTHING_RE),
+        ):
+            x_field = _coordinate_field(numeric_fields, x_re)
+            y_field = _coordinate_field(numeric_fields, y_re)
+            if x_field is None or y_field is None:
+                continue
+            y_prefix = "lat" if prefix == "lon" else "y"
+            row[prefix + "_field"] = x_field
+            row[y_prefix + "_field"] = y_field
+            row[prefix + "_min"], row[prefix + "_max"] = ranges[x_field][:2]
+            row[y_prefix + "_min"], row[y_prefix + "_max"] = ranges[y_field][:2]
+
+        for i, field in enumerate(fields):
+            vmin, vmax, count = ranges.get(field["name"], (None, None, None))
+            if not count:
+                vmin, vmax = None, None
+            field_rows.append(
+                {
+                    "position": i,
+                    "name": field["name"],
+                    "format": field["format"],
+                    "cols": field.get("cols", None),
+                    "unit": field["unit"],
+                    "null_value": field["null"],
+                    "long_name": field["long_name"],
+                    "comment": field["comment"],
+                    "min": vmin,
+                    "max": vmax,
+                    "count": count,
+                }
+            )
+    except Exception as e:
+        logger.warning("Unable to catalogue {}: {}".format(package["dfn"], e))
+        row["error"] = "{}: {}".format(e.__class__.__name__, e)
+        field_rows = []
+    return row, field_rows
+
+
+def _extract(package, chunksize, kwargs):
+    return extract_package(package, chunksize=chunksize, **kwargs)
+
+
+class Catalogue(object):
+    """An SQLite catalogue of GDF2 data packages.
+
+    Arguments:
+        filename (str): the SQLite database, created if necessary
+
+    Use :func:`aseg_gdf2.scan` to create or update a catalogue. The
+    ``connection`` attribute is the :class:`sqlite3.Connection`, for
+    running your own queries.
+
+    """
+
+    def __init__(self, filename):
+        self.filename = str(filename)
+        self.connection = sqlite3.connect(self.filename)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+
+    def __repr__(self):
+        return "<Catalogue {} packages={}>".format(self.filename, len(self))
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM packages").fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def update(self, root, workers=None, chunksize=100000, **kwargs):
+        """Scan a directory tree, cataloguing new and changed packages.
+
+        Packages under root which have been deleted are removed from the
+        catalogue. See :func:`aseg_gdf2.scan` for the arguments.
+
+        Returns: a dict with the number of packages "scanned", "unchanged"
+            and "removed".
+
+        """
+        root = os.path.abspath(str(root))
+        found = find_packages(root)
+        known = {
+            dfn: (package_id, signature)
+            for package_id, dfn, *signature in self.connection.execute(
+                "SELECT id, dfn, dat, des, met, dfn_mtime_ns, dfn_size, "
+                "dat_mtime_ns, dat_size FROM packages"
+            )
+        }
+        pending = []
+        for package in found:
+            if package["dfn"] in known:
+                signature = _signature(package)
+                current = [package[k] for k in ("dat", "des", "met")] + [
+                    signature[k]
+                    for k in ("dfn_mtime_ns", "dfn_size", "dat_mtime_ns", "dat_size")
+                ]
+                if list(known[package["dfn"]][1]) == current:
+                    continue
+            pending.append(package)
+
+        found_dfns = set(p["dfn"] for p in found)
+        removed = [
+            package_id
+            for dfn, (package_id, signature) in known.items()
+            if dfn.startswith(root + os.sep) and not dfn in found_dfns
+        ]
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM packages WHERE id = ?", [(i,) for i in removed]
+            )
+
+        logger.info(
+            "Scanning {} of {} packages under {}".format(len(pending), len(found), root)
+        )
+        if workers is not None and workers > 1 and len(pending) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = pool.map(
+                    _extract, pending, repeat(chunksize), repeat(kwargs)
+                )
+                for row, field_rows in results:
+                    self._store(row, field_rows)
+        else:
+            for package in pending:
+                self._store(*extract_package(package, chunksize=chunksize, **kwargs))
+        return {
+            "scanned": len(pending),
+            "unchanged": len(found) - len(pending),
+            "removed": len(removed),
+        }
+
+    def _store(self, row, field_rows):
+        values = [row.get(c, None) for c in PACKAGE_COLUMNS]
+        with self.connection:
+            self.connection.execute("DELETE FROM packages WHERE dfn = ?", (row["dfn"],))
+            cursor = self.connection.execute(
+                "INSERT INTO packages ({}) VALUES ({})".format(
+                    ", ".join(PACKAGE_COLUMNS), ", ".join("?" * len(PACKAGE_COLUMNS))
+                ),
+                values,
+            )
+            self.connection.executemany(
+                "INSERT INTO fields (package_id, {}) VALUES (?, {})".format(
+                    ", ".join(FIELD_COLUMNS), ", ".join("?" * len(FIELD_COLUMNS))
+                ),
+                [
+                    [cursor.lastrowid] + [f[c] for c in FIELD_COLUMNS]
+                    for f in field_rows
+                ],
+            )
+
+    def packages(self):
+        """Return the packages table as a pandas.DataFrame."""
+        return pd.read_sql_query(
+            "SELECT * FROM packages ORDER BY dfn", self.connection, index_col="id"
+        )
+
+    def fields(self, dfn=None):
+        """Return the fields table as a pandas.DataFrame.
+
+        Args:
+            dfn (str): only the fields of the package with this .dfn file
+
+        """
+        query = (
+            "SELECT packages.dfn, fields.* FROM fields "
+            "JOIN packages ON packages.id = fields.package_id"
+        )
+        params = ()
+        if not dfn is None:
+            query += " WHERE packages.dfn = ?"
+            params = (os.path.abspath(str(dfn)),)
+        query += " ORDER BY packages.dfn, fields.position"
+        return pd.read_sql_query(query, self.connection, params=params)
+
+    def find(self, bbox=None, fields=None, projected=False):
+        """Find the packages which overlap an area and/or have some fields.
+
+        Args:
+            bbox (tuple): ``(xmin, ymin, xmax, ymax)`` - longitude and
+                latitude, or easting and northing if projected is True
+            fields (list): field names which the package must all have
+            projected (bool): compare bbox with the range of the easting
+                and northing fields rather than longitude and latitude
+
+        Returns: a pandas.DataFrame of rows from the packages table.
+
+        """
+        query = "SELECT * FROM packages WHERE error IS NULL"
+        params = []
+        if not bbox is None:
+            x, y = ("x", "y") if projected else ("lon", "lat")
+            query += (
+                " AND {x}_min <= ? AND {x}_max >= ? AND {y}_min <= ? AND {y}_max >= ?"
+            ).format(x=x, y=y)
+            xmin, ymin, xmax, ymax = bbox
+            params += [xmax, xmin, ymax, ymin]
+        for name in fields or []:
+            query += (
+                " AND EXISTS (SELECT 1 FROM fields WHERE "
+                "fields.package_id = packages.id AND fields.name = ?)"
+            )
+            params.append(name)
+        query += " ORDER BY dfn"
+        return pd.read_sql_query(query, self.connection, params=params, index_col="id")
+
+
+def scan(root, catalogue=None, workers=None, chunksize=100000, **kwargs):
+    """Catalogue the GDF2 data packages in a directory tree.
+
+    Every package is read once to find its record count and the range of
+    each numeric field. The results are kept in an SQLite database, and
+    on later scans only packages whose files have been added, changed or
+    removed since are read again.
+
+    Args:
+        root (str): directory to search
+        catalogue (str): SQLite database filename - by default
+            ``aseg_gdf2_catalogue.sqlite`` in root
+        workers (int): read this many packages at a time in separate
+            processes
+        chunksize (int): number of records to read at a time
+        kwargs: passed to :func:`aseg_gdf2.read` for each package, e.g.
+            ``method='fixed-widths', engine='numpy'``
+
+    Returns: :class:`aseg_gdf2.catalogue.Catalogue` object.
+
+    Example::
+
+        >>> cat = aseg_gdf2.scan("/data/surveys", workers=8)
+        >>> cat.find(bbox=(129.0, -27.0, 130.0, -26.0))
+
+    """
+    if catalogue is None:
+        catalogue = os.path.join(str(root), CATALOGUE_FILENAME)
+    cat = Catalogue(catalogue)
+    counts = cat.update(root, workers=workers, chunksize=chunksize, **kwargs)
+    logger.info(
+        "Catalogue {}: {scanned} scanned, {unchanged} unchanged, {removed} removed".format(
+            catalogue, **counts
+        )
+    )
+    return cat
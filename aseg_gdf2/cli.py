@@ -0,0 +1,158 @@
+"""Command line interface, installed as ``aseg-gdf2``.
+
+Example::
+
+    $ aseg-gdf2 convert survey.dfn survey.parquet --workers 4
+    $ aseg-gdf2 convert survey.dfn survey.zarr --fields LINE,X,Y,Con
+    $ aseg-gdf2 convert survey.dfn survey.arrow
+    $ aseg-gdf2 scan /data/surveys --workers 8
+
+"""
+import argparse
+import logging
+import sys
+
+from aseg_gdf2 import catalogue, columnar
+from aseg_gdf2.gdf2 import read
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog="aseg-gdf2", description="Work with ASEG GDF2 data packages."
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="log progress messages"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    convert = subparsers.add_parser(
+        "convert",
+        help="convert a data package to Parquet, Zarr, HDF5 or Arrow",
+        description=(
+            "Convert a data package to Parquet, Zarr, HDF5 or an Arrow IPC "
+            "file, streaming the .dat file in chunks. The output format is "
+            "taken from the extension of OUTPUT (.parquet, .zarr, .h5, "
+            ".arrow) unless --format is given."
+        ),
+    )
+    convert.add_argument("input", help=".dfn or .dat file of the data package")
+    convert.add_argument("output", help="output file (or directory for Zarr)")
+    convert.add_argument(
+        "--format", choices=["parquet", "zarr", "hdf5", "arrow"], help="output format"
+    )
+    convert.add_argument(
+        "-f",
+        "--fields",
+        help="comma-separated list of fields to convert (default: all)",
+    )
+    convert.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="number of processes to parse the .dat file with",
+    )
+    convert.add_argument(
+        "--chunksize",
+        type=int,
+        default=100000,
+        help="number of records to read and write at a time (default: 100000)",
+    )
+    convert.add_argument(
+        "--method",
+        choices=["whitespace", "fixed-widths"],
+        default="whitespace",
+        help="how to read the .dat file (default: whitespace)",
+    )
+    convert.add_argument(
+        "--engine",
+        choices=["pandas", "numpy"],
+        default="pandas",
+        help="engine to read the .dat file with (default: pandas)",
+    )
+    convert.add_argument(
+        "--dtypes",
+        choices=["compact"],
+        default=None,
+        help="use the smallest dtypes allowed by the format codes",
+    )
+
+    scan = subparsers.add_parser(
+        "scan",
+        help="catalogue the data packages in a directory tree",
+        description=(
+            "Record the fields, record counts, field ranges and bounding boxes "
+            "of the data packages under ROOT in an SQLite catalogue. Packages "
+            "which have not changed since the last scan are skipped."
+        ),
+    )
+    scan.add_argument("root", help="directory to search")
+    scan.add_argument(
+        "-c",
+        "--catalogue",
+        help="SQLite file (default: ROOT/{})".format(catalogue.CATALOGUE_FILENAME),
+    )
+    scan.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="number of packages to read at a time in separate processes",
+    )
+    scan.add_argument(
+        "--method",
+        choices=["whitespace", "fixed-widths"],
+        default="whitespace",
+        help="how to read the .dat files (default: whitespace)",
+    )
+    return parser
+
+
+def scan(args):
+    cat = catalogue.scan(
+        args.root, catalogue=args.catalogue, workers=args.workers, method=args.method
+    )
+    packages = cat.packages()
+    errors = packages[packages["error"].notna()]
+    print("{} packages in {}".format(len(packages), cat.filename))
+    for dfn, error in zip(errors["dfn"], errors["error"]):
+        print("  {}: {}".format(dfn, error))
+    cat.close()
+
+
+def convert(args):
+    gdf = read(args.input, method=args.method, engine=args.engine, dtypes=args.dtypes)
+    fields = None
+    if args.fields:
+        fields = [f.strip() for f in args.fields.split(",") if f.strip()]
+        unknown = [f for f in fields if not f in gdf.field_names()]
+        if unknown:
+            raise ValueError("Unknown fields: {}".format(", ".join(unknown)))
+    nrecords = columnar.convert(
+        gdf,
+        args.output,
+        format=args.format,
+        fields=fields,
+        chunksize=args.chunksize,
+        workers=args.workers,
+    )
+    print("Wrote {} records to {}".format(nrecords, args.output))
+
+
+def main(argv=None):
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+    try:
+        if args.command == "convert":
+            convert(args)
+        elif args.command == "scan":
+            scan(args)
+    except (OSError, ValueError, ImportError) as e:
+        parser.exit(1, "aseg-gdf2: error: {}\n".format(e))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,430 @@
+"""Convert GDF2 data packages to columnar formats.
+
+The data table is streamed from ``GDF2.iterchunks`` a block of records at a
+time, so memory use is bounded by the chunksize whatever the size of the
+.dat file. Parquet files have one column per column of the data table (as
+in ``GDF2.df``), while Zarr and HDF5 files have one array per field, with
+2D fields such as ``Con`` stored as arrays of shape (nrecords, cols).
+Arrow record batches (``iter_batches``) and Arrow IPC files also have one
+column per field, with 2D fields as ``FixedSizeList`` columns.
+
+The units, names, NULL values and format codes from the .dfn file are kept
+as column metadata (Parquet and Arrow) or array attributes (Zarr and HDF5).
+
+Writing Parquet and Arrow needs pyarrow, Zarr needs zarr and HDF5 needs
+h5py.
+
+"""
+import importlib
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".zarr": "zarr",
+    ".h5": "hdf5",
+    ".hdf5": "hdf5",
+    ".hdf": "hdf5",
+    ".arrow": "arrow",
+    ".feather": "arrow",
+}
+
+
+def output_format(path):
+    """Work out the output format from a filename extension."""
+    ext = os.path.splitext(str(path).rstrip("/\\"))[1].lower()
+    if not ext in FORMATS:
+        raise ValueError(
+            "Unable to tell the output format from {} - use one of {}".format(
+                path, ", ".join(sorted(FORMATS))
+            )
+        )
+    return FORMATS[ext]
+
+
+def _import(module, format):
+    try:
+        return importlib.import_module(module)
+    except ImportError:
+        raise ImportError(
+            "{} is required for {} output".format(module.split(".")[0], format)
+        )
+
+
+def convert(gdf, path, format=None, fields=None, chunksize=100000, workers=None):
+    """Convert a data package to Parquet, Zarr, HDF5 or an Arrow IPC file.
+
+    Args:
+        gdf (aseg_gdf2.GDF2): the data package
+        path (str): output filename or (for Zarr) directory
+        format (str): ``'parquet'``, ``'zarr'``, ``'hdf5'`` or ``'arrow'`` -
+            by default worked out from the extension of path
+        fields (list): only convert these fields - all of them by default
+        chunksize (int): number of records to read and write at a time
+        workers (int): parse the .dat file in this many processes, see
+            ``GDF2.iterchunks``
+
+    Returns: the number of records written.
+
+    """
+    if format is None:
+        format = output_format(path)
+    if format == "parquet":
+        func = to_parquet
+    elif format == "zarr":
+        func = to_zarr
+    elif format == "hdf5":
+        func = to_hdf5
+    elif format == "arrow":
+        func = to_arrow_file
+    else:
+        raise ValueError("format must be 'parquet', 'zarr', 'hdf5' or 'arrow'")
+    nrecords = func(gdf, path, fields=fields, chunksize=chunksize, workers=workers)
+    logger.info("Wrote {} records to {}".format(nrecords, path))
+    return nrecords
+
+
+def field_metadata(gdf, fields=None, record_type=""):
+    """Collect the .dfn information for each field.
+
+    Args:
+        gdf (aseg_gdf2.GDF2): the data package
+        fields (list): field names - all fields by default
+        record_type (str): record type - NULL by default
+
+    Returns: dict of field name to a dict with "unit", "long_name",
+        "null", "format", "comment" and "columns" (the names of its
+        columns in ``GDF2.df``).
+
+    """
+    metadata = {}
+    for column in gdf.get_column_definitions(record_type):
+        name = column["field_name"]
+        if not fields is None and not name in fields:
+            continue
+        if not name in metadata:
+            metadata[name] = {
+                "unit": column["unit"],
+                "long_name": column["field_long_name"],
+                "null": column["null"],
+                "format": column["field_format"],
+                "comment": column["field_comment"],
+                "columns": [],
+            }
+        metadata[name]["columns"].append(column["name"])
+    return metadata
+
+
+def _text_values(values):
+    """Convert an object array of text (and missing values) to str."""
+    values = np.where(pd.isna(values), "", values)
+    return values.astype(str)
+
+
+def to_parquet(gdf, path, fields=None, chunksize=100000, workers=None):
+    """Write the data table to a Parquet file. See ``convert``.
+
+    Each column's metadata holds the "unit", "long_name", "null",
+    "format" and "field" (field name) from the .dfn file.
+
+    """
+    pa = _import("pyarrow", "Parquet")
+    pq = _import("pyarrow.parquet", "Parquet")
+    columns = {}
+    for name, field in field_metadata(gdf, fields).items():
+        for column in field["columns"]:
+            columns[column] = {
+                "unit": field["unit"] or "",
+                "long_name": field["long_name"] or "",
+                "null": field["null"] or "",
+                "format": field["format"],
+                "field": name,
+            }
+
+    parquet_writer = None
+    schema = None
+    nrecords = 0
+    chunks = gdf.iterchunks(
+        chunksize=chunksize, fields=fields, kind="dataframe", workers=workers
+    )
+    try:
+        for chunk in chunks:
+            if parquet_writer is None:
+                inferred = pa.Schema.from_pandas(chunk, preserve_index=False)
+                schema = pa.schema(
+                    [f.with_metadata(columns.get(f.name, {})) for f in inferred],
+                    metadata=inferred.metadata,
+                )
+                parquet_writer = pq.ParquetWriter(str(path), schema)
+            table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+            parquet_writer.write_table(table)
+            nrecords += len(chunk)
+        if parquet_writer is None:
+            empty = pd.DataFrame({c: [] for c in columns})
+            pq.write_table(pa.Table.from_pandas(empty, preserve_index=False), str(path))
+    finally:
+        if not parquet_writer is None:
+            parquet_writer.close()
+    return nrecords
+
+
+def to_zarr(gdf, path, fields=None, chunksize=100000, workers=None):
+    """Write the data table to a Zarr group with one array per field.
+
+    See ``convert``. Text fields are stored as variable-length strings
+    with zarr 3, or as fixed-width unicode as wide as the field's format
+    code with zarr 2. Each array's attributes hold the field's "unit",
+    "long_name", "null", "format", "comment" and "columns".
+
+    """
+    zarr = _import("zarr", "Zarr")
+    metadata = field_metadata(gdf, fields)
+    group = zarr.open_group(str(path), mode="w")
+    # zarr 3 replaced Group.create_dataset with Group.create_array.
+    create = getattr(group, "create_array", None)
+    arrays = {}
+    nrecords = 0
+    for chunk in gdf.iterchunks(
+        chunksize=chunksize, fields=fields, kind="dict", workers=workers
+    ):
+        n = len(next(iter(chunk.values())))
+        for name, values in chunk.items():
+            if values.dtype.kind == "O":
+                values = _text_values(values)
+            if not name in arrays:
+                dtype = values.dtype
+                if dtype.kind == "U":
+                    width = gdf.get_field_definition(name)["width"]
+                    dtype = str if create else "U{:d}".format(width)
+                arrays[name] = (create or group.create_dataset)(
+                    name,
+                    shape=(0,) + values.shape[1:],
+                    chunks=(chunksize,) + values.shape[1:],
+                    dtype=dtype,
+                )
+                arrays[name].attrs.update(metadata[name])
+            arrays[name].append(values)
+        nrecords += n
+    return nrecords
+
+
+def to_hdf5(gdf, path, fields=None, chunksize=100000, workers=None):
+    """Write the data table to an HDF5 file with one dataset per field.
+
+    See ``convert``. Text fields are stored as variable-length UTF-8
+    strings. Each dataset's attributes hold the field's "unit",
+    "long_name", "null", "format", "comment" and "columns".
+
+    """
+    h5py = _import("h5py", "HDF5")
+    metadata = field_metadata(gdf, fields)
+    nrecords = 0
+    with h5py.File(str(path), "w") as f:
+        for chunk in gdf.iterchunks(
+            chunksize=chunksize, fields=fields, kind="dict", workers=workers
+        ):
+            n = len(next(iter(chunk.values())))
+            dtypes = {}
+            for name, values in chunk.items():
+                if values.dtype.kind == "O":
+                    chunk[name] = _text_values(values).astype(object)
+                    dtypes[name] = h5py.string_dtype()
+                else:
+                    dtypes[name] = values.dtype
+            for name, values in chunk.items():
+                if not name in f:
+                    dataset = f.create_dataset(
+                        name,
+                        shape=(0,) + values.shape[1:],
+                        maxshape=(None,) + values.shape[1:],
+                        chunks=True,
+                        dtype=dtypes[name],
+                    )
+                    for key, value in metadata[name].items():
+                        if not value is None:
+                            dataset.attrs[key] = value
+                dataset = f[name]
+                dataset.resize(nrecords + n, axis=0)
+                dataset[nrecords:] = values
+            nrecords += n
+    return nrecords
+
+
+def _arrow_type(pa, dtype):
+    if dtype is str or dtype is object:
+        return pa.string()
+    if isinstance(dtype, str) and dtype == "category":
+        return pa.dictionary(pa.int32(), pa.string())
+    return pa.from_numpy_dtype(np.dtype(dtype))
+
+
+def arrow_schema(gdf, fields=None, record_type=""):
+    """Return the Arrow schema of the data table.
+
+    There is one Arrow field per field of the .dfn file, and 2D fields
+    such as ``Con`` are ``FixedSizeList`` fields with one item per column.
+    The type of each field follows ``GDF2.column_dtypes``: ``A`` fields
+    are strings (or dictionary-encoded strings with ``dtypes='compact'``).
+    Each field's metadata holds the "unit", "long_name", "null", "format"
+    and "comment" from the .dfn file, and "columns", a JSON list of the
+    names of its columns in ``GDF2.df``.
+
+    Args:
+        gdf (aseg_gdf2.GDF2): the data package
+        fields (list): field names - all fields by default
+        record_type (str): record type - NULL by default
+
+    Returns: pyarrow.Schema
+
+    """
+    pa = _import("pyarrow", "Arrow")
+    if fields is None:
+        fields = gdf.field_names(record_type)
+    metadata = field_metadata(gdf, fields, record_type)
+    schema = gdf.schema(record_type)
+    dtypes = {}
+    for column, dtype in zip(schema.column_definitions, schema.dtypes):
+        dtypes.setdefault(column["field_name"], dtype)
+    arrow_fields = []
+    for name in fields:
+        field = metadata[name]
+        type = _arrow_type(pa, dtypes[name])
+        if len(field["columns"]) > 1:
+            type = pa.list_(type, len(field["columns"]))
+        arrow_metadata = {
+            key: ("" if value is None else value)
+            for key, value in field.items()
+            if key != "columns"
+        }
+        arrow_metadata["columns"] = json.dumps(field["columns"])
+        arrow_fields.append(pa.field(name, type, metadata=arrow_metadata))
+    return pa.schema(arrow_fields)
+
+
+def _arrow_array(pa, values, type):
+    """Convert the values of a field from ``GDF2.iterchunks`` to Arrow.
+
+    NaN and None are nulls. Numeric arrays are not copied unless they have
+    to be cast, e.g. integer fields with NULL values, which are decoded as
+    floats.
+
+    """
+    if pa.types.is_fixed_size_list(type):
+        values = np.ascontiguousarray(values).reshape(-1)
+        items = _arrow_array(pa, values, type.value_type)
+        return pa.FixedSizeListArray.from_arrays(items, type.list_size)
+    if pa.types.is_dictionary(type):
+        return pa.array(values, type=pa.string(), from_pandas=True).dictionary_encode()
+    if values.dtype.kind == "O":
+        return pa.array(values, type=type, from_pandas=True)
+    array = pa.array(values, from_pandas=True)
+    if array.type != type:
+        array = array.cast(type)
+    return array
+
+
+def iter_batches(
+    gdf, chunksize=100000, fields=None, record_type="", workers=None, schema=None
+):
+    """Stream the data table as Arrow record batches.
+
+    The arrays of each block of records from ``GDF2.iterchunks`` are
+    handed to Arrow as they are parsed, without building a DataFrame, so
+    memory use is bounded by chunksize. See ``arrow_schema`` for the
+    columns.
+
+    Args:
+        gdf (aseg_gdf2.GDF2): the data package
+        chunksize (int): number of records per batch
+        fields (list): field names - all fields by default
+        record_type (str): record type - NULL by default
+        workers (int): parse the .dat file in this many processes, see
+            ``GDF2.iterchunks``
+        schema (pyarrow.Schema): from ``arrow_schema``, if you have it
+
+    Yields: pyarrow.RecordBatch
+
+    """
+    pa = _import("pyarrow", "Arrow")
+    if fields is None:
+        fields = gdf.field_names(record_type)
+    if schema is None:
+        schema = arrow_schema(gdf, fields, record_type)
+    chunks = gdf.iterchunks(
+        chunksize=chunksize,
+        fields=fields,
+        record_type=record_type,
+        kind="dict",
+        workers=workers,
+    )
+    for chunk in chunks:
+        arrays = [_arrow_array(pa, chunk[f.name], f.type) for f in schema]
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def to_arrow(gdf, fields=None, record_type="", chunksize=100000, workers=None):
+    """Read the data table into an Arrow table. See ``iter_batches``.
+
+    Returns: pyarrow.Table with one record batch per chunk.
+
+    """
+    pa = _import("pyarrow", "Arrow")
+    schema = arrow_schema(gdf, fields, record_type)
+    batches = iter_batches(
+        gdf,
+        chunksize=chunksize,
+        fields=fields,
+        record_type=record_type,
+        workers=workers,
+        schema=schema,
+    )
+    return pa.Table.from_batches(list(batches), schema=schema)
+
+
+def to_arrow_file(gdf, path, fields=None, chunksize=100000, workers=None):
+    """Write the data table to an Arrow IPC (Feather version 2) file.
+
+    See ``convert``. The columns are as for ``iter_batches``, except that
+    ``'category'`` fields are written as plain strings, as each batch has
+    its own dictionary and the IPC file format only allows one.
+
+    """
+    pa = _import("pyarrow", "Arrow")
+    schema = arrow_schema(gdf, fields)
+    for i, field in enumerate(schema):
+        type = field.type
+        if pa.types.is_fixed_size_list(type):
+            if pa.types.is_dictionary(type.value_type):
+                type = pa.list_(type.value_type.value_type, type.list_size)
+        elif pa.types.is_dictionary(type):
+            type = type.value_type
+        schema = schema.set(i, field.with_type(type))
+    nrecords = 0
+    with pa.OSFile(str(path), "wb") as sink:
+        with pa.ipc.new_file(sink, schema) as ipc_writer:
+            batches = iter_batches(
+                gdf, chunksize=chunksize, fields=fields, workers=workers, schema=schema
+            )
+            for batch in batches:
+                ipc_writer.write_batch(batch)
+                nrecords += batch.num_rows
+    return nrecords
+
+
+def arrow_dtypes(df):
+    """Return a DataFrame with the same columns backed by Arrow arrays.
+
+    Numeric columns are wrapped rather than copied, text columns become
+    Arrow strings, and NaN values become nulls (``pd.NA``).
+
+    """
+    pa = _import("pyarrow", "Arrow")
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
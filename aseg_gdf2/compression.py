@@ -0,0 +1,283 @@
+"""Reading .dat files compressed with gzip, bzip2 or Zstandard.
+
+A data package can have a compressed .dat file, e.g. ``survey.dat.gz``
+next to ``survey.dfn``. It is decompressed as it is read, so it is never
+written out in full. Zstandard (``.zst``) needs the ``zstandard`` package.
+
+A compressed file can only be read from the start of one of its
+independently compressed members: gzip members as written by ``bgzip``,
+bzip2 streams as written by ``pbzip2``, or Zstandard frames as written by
+``pzstd``. The first scan of the file, which builds the record index (see
+:class:`aseg_gdf2.index.RecordIndex`), also records where each member
+starts in a :class:`BlockIndex`. After that, reading a range of records
+only decompresses from the start of the member which holds the first of
+them. A file compressed as a single member (e.g. by plain ``gzip``) is
+read the same way, but has to be decompressed from the start every time.
+
+"""
+import bz2
+import io
+import logging
+import os
+import zlib
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {".gz": "gzip", ".bz2": "bz2", ".zst": "zstd"}
+
+# Number of compressed bytes to decompress at a time.
+READ_SIZE = 2 ** 20
+
+
+def compression_of(filename):
+    """Return ``'gzip'``, ``'bz2'`` or ``'zstd'`` from the extension of a
+    filename, or None if it is not compressed."""
+    if not isinstance(filename, (str, os.PathLike)):
+        return None
+    ext = os.path.splitext(str(filename))[1].lower()
+    return EXTENSIONS.get(ext, None)
+
+
+def compressed_filenames(filename):
+    """Return the filenames a compressed copy of a file could have."""
+    return [filename + ext for ext in EXTENSIONS]
+
+
+def decompressor(compression):
+    """Return a decompressor for one member of a compressed file.
+
+    It has the ``decompress``, ``eof`` and ``unused_data`` of
+    ``zlib.decompressobj``.
+
+    """
+    if compression == "gzip":
+        return zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    elif compression == "bz2":
+        return bz2.BZ2Decompressor()
+    elif compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("zstandard is required to read .zst files")
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError("Unknown compression {}".format(compression))
+
+
+def iter_decompressed(filename, start=0, offset=0, members=None):
+    """Decompress a file from the start of a member, a block at a time.
+
+    Args:
+        filename (str): the compressed file
+        start (int): byte offset in the file of the member to start from
+        offset (int): decompressed byte offset of that member
+        members (list): if given, a tuple of the byte offset in the file
+            and the decompressed byte offset of each member is appended to
+            it as the member is reached, and then a tuple of the size of
+            the file and of its decompressed contents at the end
+
+    Yields: blocks of decompressed bytes.
+
+    """
+    compression = compression_of(filename)
+    with open(filename, "rb") as f:
+        f.seek(start)
+        position = start
+        member = None
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                break
+            while data:
+                if member is None:
+                    member = decompressor(compression)
+                    if not members is None:
+                        members.append((position, offset))
+                block = member.decompress(data)
+                used = len(data)
+                if member.eof:
+                    used -= len(member.unused_data)
+                    data = member.unused_data
+                    member = None
+                else:
+                    data = b""
+                position += used
+                if block:
+                    offset += len(block)
+                    yield block
+    if not member is None:
+        raise EOFError("{} ends in the middle of a compressed member".format(filename))
+    if not members is None:
+        members.append((position, offset))
+
+
+class BlockIndex(object):
+    """Where each independently compressed member of a file starts.
+
+    Arguments:
+        starts (ndarray): byte offset in the file of each member, followed
+            by the size of the file
+        offsets (ndarray): decompressed byte offset of each member,
+            followed by the size of the decompressed contents
+
+    """
+
+    def __init__(self, starts, offsets):
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.starts) - 1
+
+    @property
+    def size(self):
+        """Size of the decompressed contents."""
+        return int(self.offsets[-1])
+
+    def __repr__(self):
+        return "<{}.{} members={}>".format(
+            self.__class__.__module__, self.__class__.__name__, len(self)
+        )
+
+    @classmethod
+    def from_members(cls, members):
+        """Create a BlockIndex from the list filled by ``iter_decompressed``."""
+        if len(members) < 2:
+            members = [(0, 0)] + list(members[-1:] or [(0, 0)])
+        starts, offsets = zip(*members)
+        return cls(starts, offsets)
+
+    def find(self, offset):
+        """Return the file and decompressed byte offsets of the member
+        holding a decompressed byte offset."""
+        i = np.searchsorted(self.offsets[:-1], offset, side="right") - 1
+        i = max(int(i), 0)
+        return int(self.starts[i]), int(self.offsets[i])
+
+
+class DecompressedReader(io.RawIOBase):
+    """Read-only stream of the decompressed contents of a file.
+
+    Arguments:
+        filename (str): the compressed file
+        offset (int): decompressed byte offset to start reading from
+        blocks (BlockIndex): start from the nearest member before offset,
+            rather than from the start of the file
+
+    """
+
+    def __init__(self, filename, offset=0, blocks=None):
+        super().__init__()
+        start, position = (0, 0) if blocks is None else blocks.find(offset)
+        self._blocks = iter_decompressed(filename, start, position)
+        # A view of the rest of the last block, so reading part of it
+        # does not copy the remainder.
+        self._buffer = memoryview(b"")
+        skip = offset - position
+        while skip > 0 and self._fill():
+            n = min(skip, len(self._buffer))
+            self._buffer = self._buffer[n:]
+            skip -= n
+
+    def _fill(self):
+        if not len(self._buffer):
+            self._buffer = memoryview(next(self._blocks, b""))
+        return bool(len(self._buffer))
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if not self._fill():
+            return 0
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+    def close(self):
+        self._blocks.close()
+        super().close()
+
+
+def open_file(filename, offset=0, blocks=None):
+    """Open a file, compressed or not, for reading bytes.
+
+    Args:
+        filename (str): path to the file
+        offset (int): (decompressed) byte offset to start reading from
+        blocks (BlockIndex): see :class:`DecompressedReader`
+
+    Returns: a binary file object.
+
+    """
+    if compression_of(filename) is None:
+        f = open(filename, "rb")
+        f.seek(offset)
+        return f
+    return io.BufferedReader(
+        DecompressedReader(filename, offset=offset, blocks=blocks),
+        buffer_size=READ_SIZE,
+    )
+
+
+def read_range(filename, begin, end, blocks=None):
+    """Return bytes begin to end of the (decompressed) contents of a file.
+
+    Args:
+        filename (str): path to the file
+        begin (int): first byte offset
+        end (int): stop before this byte offset
+        blocks (BlockIndex): see :class:`DecompressedReader`
+
+    """
+    with open_file(filename, offset=begin, blocks=blocks) as f:
+        return f.read(max(end - begin, 0))
+
+
+def read_ranges(filename, ranges, blocks=None):
+    """Read sorted byte ranges of the (decompressed) contents of a file.
+
+    The ranges are read in one pass through a compressed file, only
+    starting again from a member when it begins after the last range.
+
+    Args:
+        filename (str): path to the file
+        ranges (list): ``(begin, end)`` byte offsets, in order
+        blocks (BlockIndex): see :class:`DecompressedReader`
+
+    Yields: the bytes of each range.
+
+    """
+    compressed = not compression_of(filename) is None
+    f = None
+    position = 0
+    try:
+        for begin, end in ranges:
+            if f is None or (
+                compressed
+                and (
+                    begin < position
+                    or (not blocks is None and blocks.find(begin)[1] > position)
+                )
+            ):
+                if not f is None:
+                    f.close()
+                f = open_file(filename, offset=begin, blocks=blocks)
+                position = begin
+            if not compressed:
+                f.seek(begin)
+                position = begin
+            while position < begin:
+                skipped = f.read(min(begin - position, READ_SIZE))
+                if not skipped:
+                    # The range starts after the end of the file.
+                    break
+                position += len(skipped)
+            data = f.read(max(end - begin, 0))
+            position = begin + len(data)
+            yield data
+    finally:
+        if not f is None:
+            f.close()
@@ -0,0 +1,708 @@
+"""Decode fixed-width GDF2 data files directly into NumPy arrays.
+
+The .dfn file gives the width of every column, so each record of a
+fixed-width .dat file can be sliced into columns by byte offset without
+tokenizing it first. This is what ``NumpyEngine`` uses instead of
+``pd.read_fwf``.
+
+"""
+import io
+import itertools
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from aseg_gdf2 import compression
+
+logger = logging.getLogger(__name__)
+
+# Strings treated as missing when keep_default_na=True, matching pandas.
+DEFAULT_NA_VALUES = (
+    b"",
+    b"#N/A",
+    b"#N/A N/A",
+    b"#NA",
+    b"-1.#IND",
+    b"-1.#QNAN",
+    b"-NaN",
+    b"-nan",
+    b"1.#IND",
+    b"1.#QNAN",
+    b"<NA>",
+    b"N/A",
+    b"NA",
+    b"NULL",
+    b"NaN",
+    b"None",
+    b"n/a",
+    b"nan",
+    b"null",
+)
+
+SPACE = ord(b" ")
+NEWLINE = ord(b"\n")
+
+
+def open_binary(source):
+    """Open a path for reading bytes, or wrap an in-memory bytes buffer.
+
+    Compressed files are decompressed as they are read.
+
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    return compression.open_file(source)
+
+
+def source_size(source):
+    """Return the size in bytes of a path or in-memory bytes buffer."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return len(source)
+    return os.path.getsize(source)
+
+
+def detect_record_length(filename, min_length=0, samples=64, verified=None):
+    """Work out whether a data file consists of fixed-length records.
+
+    Args:
+        filename (str or bytes): path to the .dat file, or its contents
+        min_length (int): the minimum number of bytes each record must
+            hold, excluding the line terminator (normally the sum of the
+            column widths)
+        samples (int): number of record boundaries to check for a line
+            terminator first, spread evenly through the file, before
+            checking every one
+        verified (tuple): ``(record_length, size)`` if the first size bytes
+            of the file are already known to be records of that length,
+            e.g. from the sidecar record index of a file which has grown
+            since. Only the boundaries after them are checked.
+
+    A file is only treated as fixed-length if there is a line terminator
+    at every record boundary. Checking them all reads the whole file, so
+    the result is remembered until the file changes, and if it has only
+    grown just the appended records are checked.
+
+    Returns: a tuple ``(record_length, eol)`` where record_length includes
+        the line terminator ``eol``. record_length is None if the file
+        does not consist of fixed-length records.
+
+    """
+    if compression.compression_of(filename):
+        # Compressed files can't be seeked in, so are read line by line.
+        return None, b"\n"
+    in_memory = isinstance(filename, (bytes, bytearray, memoryview))
+    if in_memory:
+        size = len(filename)
+    else:
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        size = stat.st_size
+    with open_binary(filename) as f:
+        line = f.readline()
+        eol = b"\r\n" if line.endswith(b"\r\n") else b"\n"
+        if not line.endswith(eol):
+            # A single record without a line terminator.
+            line += eol
+        record_length = len(line)
+        if record_length - len(eol) < min_length:
+            return None, eol
+        remainder = size % record_length
+        if remainder and remainder != record_length - len(eol):
+            return None, eol
+        nfull = size // record_length
+        for i in np.unique(np.linspace(0, max(nfull - 1, 0), samples).astype(int)):
+            if i >= nfull:
+                break
+            f.seek(i * record_length + record_length - len(eol))
+            if f.read(len(eol)) != eol:
+                return None, eol
+        if in_memory:
+            fixed = _is_terminated(f, 0, nfull, record_length, eol)
+            return (record_length if fixed else None), eol
+    key = (stat.st_size, stat.st_mtime_ns, record_length, eol)
+    checked = _checked.get(path, None)
+    if not checked is None and checked[:4] == key:
+        return (record_length if checked[4] else None), eol
+    start = 0
+    if not verified is None and verified[0] == record_length and verified[1] <= size:
+        start = verified[1] // record_length
+    if not checked is None and checked[4] and checked[2:4] == key[2:4]:
+        if checked[0] <= size:
+            # The file has grown since it was checked.
+            start = max(start, checked[0] // record_length)
+    fixed = True
+    if start < nfull:
+        with open(path, "rb") as f:
+            fixed = _is_terminated(f, start, nfull, record_length, eol)
+    _checked.pop(path, None)
+    if len(_checked) >= MAX_CHECKED:
+        _checked.pop(next(iter(_checked)))
+    _checked[path] = key + (fixed,)
+    return (record_length if fixed else None), eol
+
+
+# Maps the absolute path of each file checked by detect_record_length to
+# its size, mtime, record length and line terminator then, and whether
+# every record boundary held the line terminator.
+_checked = {}
+MAX_CHECKED = 128
+
+
+def _is_terminated(f, start, stop, record_length, eol, blocksize=2 ** 24):
+    """Check records start to stop of a file all end with eol."""
+    eol = np.frombuffer(eol, dtype=np.uint8)
+    chunksize = max(blocksize // record_length, 1)
+    buf = np.empty((chunksize, record_length), dtype=np.uint8)
+    f.seek(start * record_length)
+    for i in range(start, stop, chunksize):
+        records = buf[: min(chunksize, stop - i)]
+        if f.readinto(records) < records.size:
+            return False
+        if not (records[:, -len(eol) :] == eol).all():
+            logger.info("Record boundaries are not all line terminators")
+            return False
+    return True
+
+
+def is_text(dtype):
+    """Check whether a column dtype is decoded as text."""
+    return dtype is str or dtype is object or dtype == "category"
+
+
+def is_integer(dtype):
+    return dtype is int or (
+        isinstance(dtype, type) and issubclass(dtype, np.integer)
+    )
+
+
+class FixedWidthReader(object):
+    """Read a fixed-width .dat file into NumPy arrays.
+
+    Arguments:
+        filename (str, bytes or file-like): path to the .dat file, or
+            the contents of (part of) it
+        names (list): column names, in file order
+        widths (list): width in bytes of each column
+        dtype (dict): maps column name to ``float``, ``int`` or ``str``,
+            a NumPy scalar type or ``'category'`` (see
+            ``GDF2.column_dtypes``). Columns not listed are ``str``.
+        na_values (dict): maps column name to the NULL value for that column
+        keep_default_na (bool): also treat pandas' default missing value
+            strings (e.g. "NA", "nan") as missing
+        verified (tuple): ``(record_length, size)`` of the start of the file
+            already known to be fixed-length records - see
+            :func:`detect_record_length`
+
+    Records of equal byte length are read straight into a 2D uint8 buffer.
+    Files with ragged records (e.g. trailing whitespace trimmed) are padded
+    line by line, which is slower but gives the same result.
+
+    """
+
+    def __init__(
+        self,
+        filename,
+        names,
+        widths,
+        dtype=None,
+        na_values=None,
+        keep_default_na=True,
+        verified=None,
+    ):
+        if hasattr(filename, "read"):
+            filename = filename.read()
+        self.filename = filename
+        self.names = list(names)
+        self.widths = [int(w) for w in widths]
+        if len(self.names) != len(self.widths):
+            raise ValueError(
+                "{} column names but {} widths".format(len(self.names), len(self.widths))
+            )
+        self.starts = list(itertools.accumulate([0] + self.widths[:-1]))
+        self._index = {name: i for i, name in enumerate(self.names)}
+        dtype = dtype or {}
+        self.dtypes = [dtype.get(name, str) for name in self.names]
+        self.na_values = na_values or {}
+        self.keep_default_na = keep_default_na
+        self.record_length, self.eol = detect_record_length(
+            filename, min_length=sum(self.widths), verified=verified
+        )
+        if self.record_length is None:
+            logger.info("Records are not fixed-length; padding each line")
+
+    @property
+    def is_fixed(self):
+        """True if every record in the file has the same byte length."""
+        return self.record_length is not None
+
+    @property
+    def is_file(self):
+        """True if reading from a file rather than an in-memory buffer."""
+        return not isinstance(self.filename, (bytes, bytearray, memoryview))
+
+    @property
+    def nrecords(self):
+        if self.is_fixed:
+            return -(-source_size(self.filename) // self.record_length)
+        with open_binary(self.filename) as f:
+            return sum(1 for line in f if line.strip())
+
+    def records(self, start=0, stop=None):
+        """Return records as a 2D uint8 array of shape (n, record_length)."""
+        if not self.is_fixed:
+            with open_binary(self.filename) as f:
+                lines = (line for line in f if line.strip())
+                return self._pad_lines(list(itertools.islice(lines, start, stop)))
+
+        nrecords = self.nrecords
+        stop = nrecords if stop is None else min(stop, nrecords)
+        start = min(start, stop)
+        buf = np.empty((stop - start, self.record_length), dtype=np.uint8)
+        with open_binary(self.filename) as f:
+            f.seek(start * self.record_length)
+            nread = f.readinto(buf)
+        flat = buf.reshape(-1)
+        if nread < flat.size:
+            # Last record without a line terminator.
+            flat[nread:] = SPACE
+            flat[-len(self.eol):] = np.frombuffer(self.eol, dtype=np.uint8)
+        bad = np.flatnonzero(buf[:, -1] != NEWLINE)
+        if bad.size:
+            raise ValueError(
+                "Not fixed-width: record {} is not {} bytes long".format(
+                    start + bad[0], self.record_length
+                )
+            )
+        return buf
+
+    def iterrecords(self, chunksize, start=0, stop=None):
+        """Yield ``(first_record_number, records)`` in blocks of chunksize."""
+        if self.is_fixed:
+            stop = self.nrecords if stop is None else min(stop, self.nrecords)
+            for i in range(start, stop, chunksize):
+                yield i, self.records(i, min(i + chunksize, stop))
+        else:
+            with open_binary(self.filename) as f:
+                lines = itertools.islice((line for line in f if line.strip()), start, stop)
+                i = start
+                while True:
+                    chunk = list(itertools.islice(lines, chunksize))
+                    if not chunk:
+                        break
+                    yield i, self._pad_lines(chunk)
+                    i += len(chunk)
+
+    def lines_to_records(self, lines):
+        """Pad lines of bytes into a 2D uint8 array of records.
+
+        Blank lines are skipped, as they are by pandas.
+
+        """
+        return self._pad_lines([line for line in lines if line.strip()])
+
+    def _pad_lines(self, lines):
+        lines = [line.rstrip(b"\r\n") for line in lines]
+        length = max([sum(self.widths)] + [len(line) for line in lines])
+        if not lines:
+            return np.empty((0, length), dtype=np.uint8)
+        buf = np.array(lines, dtype="S{:d}".format(max(length, 1)))
+        buf = buf.view(np.uint8).reshape(len(lines), -1).copy()
+        buf[buf == 0] = SPACE
+        return buf
+
+    def decode(self, records, usecols=None):
+        """Decode the columns of a records buffer.
+
+        Args:
+            records (ndarray): 2D uint8 array from ``records()``
+            usecols (list): column names to decode, or None for all
+
+        Returns: dict of column name to 1D ndarray, in file order.
+
+        """
+        columns = {}
+        for name, start, width, dtype in zip(
+            self.names, self.starts, self.widths, self.dtypes
+        ):
+            if usecols is not None and not name in usecols:
+                continue
+            columns[name] = self.decode_column(
+                records[:, start : start + width], name, dtype
+            )
+        return columns
+
+    def decode_column(self, block, name, dtype=float):
+        """Decode one column from a 2D uint8 block of shape (n, width)."""
+        width = block.shape[1]
+        raw = np.ascontiguousarray(block).view("S{:d}".format(width)).ravel()
+        missing = (block == SPACE).all(axis=1)
+        null = self.na_values.get(name, None)
+
+        if is_text(dtype):
+            values = np.char.strip(raw)
+            if self.keep_default_na:
+                missing |= np.isin(values, DEFAULT_NA_VALUES)
+            if not null is None:
+                missing |= values == str(null).strip().encode()
+            out = np.char.decode(values, "utf-8", "replace").astype(object)
+            out[missing] = np.nan
+            return out
+
+        values = raw.astype("S{:d}".format(max(width, 3)))
+        values[missing] = b"nan"
+        try:
+            if is_integer(dtype) and not missing.any():
+                out = values.astype(np.int64)
+            else:
+                out = values.astype(np.float64)
+        except ValueError:
+            if self.keep_default_na:
+                na = np.isin(np.char.strip(values), DEFAULT_NA_VALUES)
+            else:
+                na = np.zeros(len(values), dtype=bool)
+            values[na] = b"nan"
+            missing |= na
+            try:
+                out = values.astype(np.float64)
+            except ValueError as err:
+                raise ValueError(
+                    "Unable to convert column {} to type {}: {}".format(
+                        name, np.dtype(dtype).name, err
+                    )
+                )
+
+        if not null is None:
+            try:
+                missing |= out == float(null)
+            except ValueError:
+                missing |= np.char.strip(raw) == str(null).strip().encode()
+        if missing.any():
+            out = out.astype(np.float64)
+            out[missing] = np.nan
+        if not dtype in (int, float) and out.dtype.kind == np.dtype(dtype).kind:
+            out = out.astype(dtype)
+        return out
+
+    def decode_field(self, records, names):
+        """Decode adjacent columns of a 2D field into a single 2D array.
+
+        The columns must be consecutive and share a width and dtype, as the
+        columns of a field like ``Con[0..29]`` do, so the whole byte range is
+        decoded in one pass rather than column by column.
+
+        Args:
+            records (ndarray): 2D uint8 array from ``records()``
+            names (list): column names making up the field, in file order
+
+        Returns: ndarray of shape (n, len(names)).
+
+        """
+        i = self._index[names[0]]
+        width = self.widths[i]
+        start = self.starts[i]
+        stop = start + width * len(names)
+        block = np.ascontiguousarray(records[:, start:stop])
+        values = self.decode_column(
+            block.reshape(-1, width), names[0], self.dtypes[i]
+        )
+        return values.reshape(len(records), len(names))
+
+    def frame(self, records, usecols=None, index=None):
+        """Decode a records buffer into a DataFrame."""
+        columns = self.decode(records, usecols=usecols)
+        for name, values in columns.items():
+            if self.dtypes[self._index[name]] == "category":
+                columns[name] = pd.Categorical(values)
+        if index is None:
+            index = pd.RangeIndex(len(records))
+        return pd.DataFrame(columns, index=index, columns=list(columns))
+
+    def read(self, usecols=None, nrows=None):
+        """Read the whole file (or the first nrows records) as a DataFrame."""
+        return self.frame(self.records(0, nrows), usecols=usecols)
+
+    def iterchunks(self, chunksize, usecols=None, nrows=None):
+        """Yield DataFrames of at most chunksize records."""
+        for i, records in self.iterrecords(chunksize, stop=nrows):
+            index = pd.RangeIndex(i, i + len(records))
+            yield self.frame(records, usecols=usecols, index=index)
+
+
+class MemmapTable(object):
+    """Memory-mapped view of a fixed-width .dat file.
+
+    Arguments:
+        reader (FixedWidthReader): reader for a file with fixed-length records
+        fields (dict): maps the name of each 2D field to its column names
+
+    Nothing is decoded until it is indexed: ``table[n]`` decodes record n
+    into a dict, ``table[a:b]`` decodes a range of records into a
+    DataFrame, and ``table["Con"]`` returns a :class:`MemmapColumn`.
+
+    Attributes:
+        records (numpy.memmap): structured array with one ``S{width}``
+            field per column. The last record is excluded if it is missing
+            its line terminator.
+
+    """
+
+    def __init__(self, reader, fields=None):
+        if not reader.is_file:
+            raise ValueError("Only files can be memory-mapped")
+        if compression.compression_of(reader.filename):
+            raise ValueError("Compressed files cannot be memory-mapped")
+        if not reader.is_fixed:
+            raise ValueError(
+                "{} does not have fixed-length records and cannot be "
+                "memory-mapped".format(reader.filename)
+            )
+        self.reader = reader
+        self.fields = dict(fields or {})
+        size = os.path.getsize(reader.filename)
+        nfull = size // reader.record_length
+        if nfull:
+            self._raw = np.memmap(
+                reader.filename,
+                dtype=np.uint8,
+                mode="r",
+                shape=(nfull, reader.record_length),
+            )
+        else:
+            self._raw = np.empty((0, reader.record_length), dtype=np.uint8)
+        self._tail = None
+        if size % reader.record_length:
+            self._tail = reader.records(nfull, nfull + 1)
+
+    def __len__(self):
+        return len(self._raw) + (0 if self._tail is None else 1)
+
+    def __repr__(self):
+        return "<{}.{} {} nrecords={}>".format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            self.reader.filename,
+            len(self),
+        )
+
+    @property
+    def dtype(self):
+        """Structured dtype of one record."""
+        return np.dtype(
+            {
+                "names": self.reader.names,
+                "formats": ["S{:d}".format(w) for w in self.reader.widths],
+                "offsets": self.reader.starts,
+                "itemsize": self.reader.record_length,
+            }
+        )
+
+    @property
+    def records(self):
+        return self._raw.view(self.dtype)[:, 0]
+
+    def names(self):
+        """Return the names which can be used to index the table."""
+        return list(self.reader.names) + list(self.fields)
+
+    def column(self, name):
+        """Return a lazily decoded view of a column or 2D field."""
+        if name in self.fields:
+            return MemmapColumn(self, self.fields[name])
+        if not name in self.reader._index:
+            raise KeyError(name)
+        return MemmapColumn(self, [name])
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.column(key)
+        if isinstance(key, (int, np.integer)):
+            block = self.block(key)[None, :]
+            return {k: v[0] for k, v in self.reader.decode(block).items()}
+        return self.frame(key)
+
+    def frame(self, key, usecols=None):
+        """Decode the indexed records into a DataFrame."""
+        blocks = self.blocks(key)
+        if len(blocks) == 1:
+            return self.reader.frame(
+                blocks[0], usecols=usecols, index=self._positions(key)
+            )
+        decoded = [self.reader.decode(b, usecols=usecols) for b in blocks]
+        columns = {k: np.concatenate([d[k] for d in decoded]) for k in decoded[0]}
+        return pd.DataFrame(columns, index=self._positions(key), columns=list(columns))
+
+    def _positions(self, key):
+        if isinstance(key, slice):
+            return pd.RangeIndex(len(self))[key]
+        return pd.Index(np.arange(len(self))[key])
+
+    def block(self, key):
+        """Return the raw bytes of the indexed records as a uint8 array.
+
+        Args:
+            key (int, slice or array): record number(s)
+
+        Returns: 1D array of one record for an int key, otherwise a 2D
+            array of shape (n, record_length).
+
+        """
+        nfull = len(self._raw)
+        if self._tail is None:
+            return self._raw[key]
+        if isinstance(key, (int, np.integer)):
+            i = range(len(self))[key]
+            return self._tail[0] if i == nfull else self._raw[i]
+        if isinstance(key, slice):
+            r = range(len(self))[key]
+            if not len(r) or max(r[0], r[-1]) < nfull:
+                stop = r.stop if r.stop >= 0 else None
+                return self._raw[r.start : stop : r.step]
+            rows = np.asarray(r)
+        else:
+            rows = np.arange(len(self))[key]
+        out = np.empty((len(rows), self.reader.record_length), dtype=np.uint8)
+        is_tail = rows == nfull
+        out[~is_tail] = self._raw[rows[~is_tail]]
+        out[is_tail] = self._tail[0]
+        return out
+
+    def blocks(self, key):
+        """Return the indexed records as a list of uint8 arrays.
+
+        Unlike ``block()``, a slice which includes a last record missing its
+        line terminator is not copied into one array: the memory-mapped
+        records and the last record are returned separately, in order.
+
+        """
+        nfull = len(self._raw)
+        if self._tail is None or not isinstance(key, slice):
+            return [self.block(key)]
+        r = range(len(self))[key]
+        if not len(r) or max(r[0], r[-1]) < nfull:
+            return [self.block(key)]
+        rest = r[:-1] if r.step > 0 else r[1:]
+        stop = rest.stop if rest.stop >= 0 else None
+        part = self._raw[rest.start : stop : rest.step]
+        if r.step > 0:
+            return [part, self._tail]
+        return [self._tail, part]
+
+    def iterchunks(self, chunksize=100000, usecols=None):
+        """Yield DataFrames of at most chunksize records.
+
+        Only one chunk is decoded at a time, so memory use is constant
+        regardless of the size of the file.
+
+        """
+        for i in range(0, len(self), chunksize):
+            yield self.frame(slice(i, min(i + chunksize, len(self))), usecols=usecols)
+
+
+class MemmapColumn(object):
+    """Lazily decoded view of one column or 2D field of a MemmapTable.
+
+    Indexing by record number decodes only the bytes of the indexed
+    records; ``numpy.asarray(column)`` decodes the whole column.
+
+    """
+
+    def __init__(self, table, names):
+        self.table = table
+        self.names = list(names)
+
+    def __len__(self):
+        return len(self.table)
+
+    def __repr__(self):
+        name = self.names[0]
+        if len(self.names) > 1:
+            name += ".." + self.names[-1]
+        return "<{}.{} {} shape={}>".format(
+            self.__class__.__module__, self.__class__.__name__, name, self.shape
+        )
+
+    @property
+    def shape(self):
+        if len(self.names) == 1:
+            return (len(self),)
+        return (len(self), len(self.names))
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def _decode(self, block):
+        if len(self.names) == 1:
+            return self.table.reader.decode(block, usecols=self.names)[self.names[0]]
+        return self.table.reader.decode_field(block, self.names)
+
+    def __getitem__(self, key):
+        col_key = None
+        if isinstance(key, tuple):
+            key, col_key = key
+        if isinstance(key, (int, np.integer)):
+            values = self._decode(self.table.block(key)[None, :])[0]
+        else:
+            blocks = self.table.blocks(key)
+            values = np.concatenate([self._decode(b) for b in blocks])
+        if col_key is not None:
+            values = values[..., col_key]
+        return values
+
+    def __array__(self, dtype=None, copy=None):
+        values = self[:]
+        if dtype is not None:
+            values = values.astype(dtype)
+        return values
+
+    def iterchunks(self, chunksize=100000):
+        """Yield arrays of at most chunksize records."""
+        for i in range(0, len(self), chunksize):
+            yield self[i : i + chunksize]
+
+
+def read_fwf(
+    filename,
+    names,
+    widths,
+    dtype=None,
+    na_values=None,
+    usecols=None,
+    keep_default_na=True,
+    chunksize=None,
+    nrows=None,
+    header=None,
+    index_col=False,
+):
+    """Read a fixed-width .dat file into a pandas DataFrame using NumPy.
+
+    The keyword arguments are the subset of ``pd.read_fwf`` that
+    ``GDF2._read_dat`` uses. If chunksize is given, an iterator of
+    DataFrames is returned instead.
+
+    """
+    if not header is None:
+        raise ValueError("header rows are not supported: use header=None")
+    if not index_col is False and not index_col is None:
+        raise ValueError("index_col is not supported: use index_col=False")
+    reader = FixedWidthReader(
+        filename,
+        names,
+        widths,
+        dtype=dtype,
+        na_values=na_values,
+        keep_default_na=keep_default_na,
+    )
+    if usecols is not None:
+        usecols = set(usecols)
+        missing = usecols.difference(names)
+        if missing:
+            raise ValueError(
+                "Usecols do not match columns, columns expected but not found: "
+                "{}".format(sorted(missing))
+            )
+    if chunksize:
+        return reader.iterchunks(chunksize, usecols=usecols, nrows=nrows)
+    return reader.read(usecols=usecols, nrows=nrows)
@@ -0,0 +1,194 @@
+"""Read the records appended to a .dat file while it is being written.
+
+During acquisition the .dat file of a survey grows as records are logged.
+A :class:`Follower` remembers the byte offset after the last complete
+record it has read, so each call to ``read()`` only reads and parses the
+bytes appended since::
+
+    >>> follower = gdf.follow()
+    >>> df = follower.read()     # every complete record so far
+    >>> df = follower.read()     # only the records appended since
+
+A last line without a line terminator is still being written, so it is
+left for the next call. Records of tagged record types (e.g. ``COMM``)
+are routed by their RT tag as for ``GDF2.read_record_types``.
+
+"""
+import logging
+import os
+import time
+
+from aseg_gdf2 import compression
+from aseg_gdf2 import instrument
+
+logger = logging.getLogger(__name__)
+
+# Number of bytes to read at a time when skipping records.
+BLOCKSIZE = 2 ** 24
+
+
+class Follower(object):
+    """Read the complete records appended to a .dat file since the last read.
+
+    Use ``GDF2.follow()`` rather than creating one directly.
+
+    Arguments:
+        gdf (aseg_gdf2.GDF2): the data package
+        record_type (str): record type - NULL by default
+        start (int): record number to start from, or None to start from
+            the end of the file, so that only records appended from now on
+            are read
+        kwargs: passed on to the parser as for ``GDF2.df``, e.g. ``usecols``
+
+    Attributes:
+        offset (int): byte offset in the .dat file after the last complete
+            record which has been read (or skipped)
+        nrecords (int): number of records of the record type before
+            offset, i.e. the record number of the next record
+
+    """
+
+    def __init__(self, gdf, record_type="", start=0, **kwargs):
+        if compression.compression_of(gdf.dat_filename):
+            raise ValueError("Compressed .dat files cannot be followed")
+        if record_type and not record_type in gdf.record_type_tags:
+            raise KeyError("No record type {}".format(record_type))
+        self.gdf = gdf
+        self.record_type = record_type
+        self.kwargs = kwargs
+        self.offset = 0
+        self.nrecords = 0
+        self._tags = gdf._tag_bytes()
+        if start is None or start:
+            self._skip(start)
+
+    def __repr__(self):
+        return "<{}.{} {} offset={} nrecords={}>".format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            self.gdf.dat_filename,
+            self.offset,
+            self.nrecords,
+        )
+
+    def _skip(self, stop=None):
+        """Move past complete records, up to record stop or the end."""
+        if not self._tags:
+            index = self.gdf.record_index
+            n = index.nrecords
+            if n and not self._is_terminated(index.offset(n - 1), index.size):
+                # The last record is still being written.
+                n -= 1
+            if not stop is None:
+                if stop > n:
+                    raise IndexError("record {} out of range".format(stop))
+                n = stop
+            self.offset = index.offset(n)
+            self.nrecords = n
+            return
+        with open(self.gdf.dat_filename, "rb") as f:
+            while stop is None or self.nrecords < stop:
+                f.seek(self.offset)
+                block = f.read(BLOCKSIZE)
+                block = block[: block.rfind(b"\n") + 1]
+                if not block:
+                    break
+                for line in block.splitlines(True):
+                    if stop is not None and self.nrecords == stop:
+                        break
+                    self.offset += len(line)
+                    # Blank lines are skipped, as they are by GDF2.df().
+                    if line.strip() and self._record_type_of(line) == self.record_type:
+                        self.nrecords += 1
+        if stop is not None and self.nrecords < stop:
+            raise IndexError("record {} out of range".format(stop))
+
+    def _is_terminated(self, begin, end):
+        """Check there is a line terminator between two byte offsets."""
+        with open(self.gdf.dat_filename, "rb") as f:
+            f.seek(begin)
+            return b"\n" in f.read(end - begin)
+
+    def _record_type_of(self, line):
+        for tag, width, rt in self._tags:
+            if line[:width].strip() == tag:
+                return rt
+        return ""
+
+    def read(self):
+        """Return the complete records appended since the last read.
+
+        The first call returns every complete record from the start
+        record, so it costs as much as ``GDF2.df()``. After that only the
+        new bytes are read. If the file has been truncated (e.g. replaced
+        by a new survey), it is followed again from the start.
+
+        Returns: a DataFrame indexed by record number, which is empty if
+        there are no new records.
+
+        """
+        filename = self.gdf.dat_filename
+        size = os.path.getsize(filename)
+        if size < self.offset:
+            logger.warning(
+                "{} has been truncated, following it from the start".format(filename)
+            )
+            self.offset = 0
+            self.nrecords = 0
+        with instrument.stage("read") as stage:
+            with open(filename, "rb") as f:
+                f.seek(self.offset)
+                data = f.read(size - self.offset)
+            data = data[: data.rfind(b"\n") + 1]
+            stage.bytes = len(data)
+        self.offset += len(data)
+        tagged = any(
+            data.startswith(tag) or b"\n" + tag in data for tag, width, rt in self._tags
+        )
+        if tagged:
+            buffers = {rt: [] for tag, width, rt in self._tags}
+            with instrument.stage("demux", bytes=len(data)):
+                data = self.gdf._demux_lines(data, self._tags, buffers)
+            if self.record_type:
+                data = b"".join(buffers[self.record_type])
+        elif self.record_type:
+            data = b""
+        df = self._parse(data)
+        self.nrecords += len(df)
+        return df
+
+    def _parse(self, data):
+        engine = self.gdf.engine
+        if not self.record_type:
+            rt, kws = engine._parse_kwargs(**self.kwargs)
+            df = engine._parse_bytes(rt, kws, data, self.nrecords)
+            return engine._from_pandas(df)
+        rt, kws = engine.expand_field_names(record_type=self.record_type, **self.kwargs)
+        df = self.gdf._record_type_frame(self.record_type, data)
+        if "usecols" in kws:
+            df = df[[c for c in kws["names"] if c in kws["usecols"]]]
+        df.index = df.index + self.nrecords
+        return engine._from_pandas(df)
+
+    def poll(self, interval=1.0, timeout=None):
+        """Wait for records to be appended, and yield them as they are.
+
+        Args:
+            interval (float): seconds to wait between reads
+            timeout (float): stop once no records have been appended for
+                this many seconds - by default keep waiting
+
+        Yields: a DataFrame of the new records after each read which
+        found some, as for ``read()``.
+
+        """
+        last = time.monotonic()
+        while True:
+            df = self.read()
+            if len(df):
+                last = time.monotonic()
+                yield df
+            elif not timeout is None and time.monotonic() - last >= timeout:
+                return
+            else:
+                time.sleep(interval)
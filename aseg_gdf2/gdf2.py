@@ -1,14 +1,36 @@
 from abc import abstractmethod, ABC
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 import glob
+import io
+from itertools import repeat
 import logging
 import os
 import re
 import pprint
+import sys
 
+import numpy as np
 import pandas as pd
-from dask.array import Array
 from pandas import json_normalize
-from dask import dataframe as dd
+from pandas.api.types import union_categoricals
+
+from aseg_gdf2 import cache as column_cache
+from aseg_gdf2 import columnar
+from aseg_gdf2 import compression
+from aseg_gdf2 import fixed_width
+from aseg_gdf2 import instrument
+from aseg_gdf2.follow import Follower
+from aseg_gdf2 import stats as column_stats
+from aseg_gdf2 import writer
+from aseg_gdf2.index import (
+    FieldIndex,
+    RecordIndex,
+    SpatialIndex,
+    intersect_ranges,
+    scan_line_prefixes,
+)
+from aseg_gdf2.stats import ColumnStats, TableStats
 
 logger = logging.getLogger(__name__)
 
@@ -25,21 +47,57 @@ def read(filename, **kwargs):
             `'pandas'`, if you are reading small files and/or have a lot
             of RAM, or `'dask'` if you are reading huge files which will
             not fit in RAM. Both are equivalent in terms of functionality
-            but you should use `'pandas'` if you can.
+            but you should use `'pandas'` if you can. `'numpy'` is the
+            same as `'pandas'` except that with ``method='fixed-widths'``
+            the .dat file is sliced into columns by byte offset, which
+            is much faster than ``pd.read_fwf``.
         clean_column_names (bool): when enabled, column names are cleaned
             to prevent invalid names from being replaced with positional
             ones in iterrows results. Array columns are suffixed with
             `column_n` instead of `column[n]`.
+        cache (bool or str): keep a columnar copy of the data table in
+            a sidecar directory of .npy files, so that ``df()``,
+            ``get_fields_data()`` and ``iterrows()`` only parse the .dat
+            file once. Pass a directory to store the cache somewhere other
+            than next to the .dat file. Not used by the dask engine.
+        dtypes (str): ``'compact'`` to use the smallest dtype which holds
+            every value allowed by each format code exactly - float32 for
+            F and E fields with at most 6 significant digits, float64 for
+            other E fields, the smallest integer type for I fields and
+            ``category`` for A fields. See ``compact_dtype``. By default F
+            fields are float64, I fields int64 and A and E fields text.
+        lazy (bool): don't read the .dfn file until the field definitions
+            are first needed, e.g. by ``field_names()`` or ``nrecords``.
+            Errors in the .dfn file are then raised at that point instead.
 
     Returns: :class:`aseg_gdf2.GDF2` object.
 
     Attributes:
-        engine (either PandasEngine or DaskEngine): the object which
+        engine (PandasEngine, DaskEngine or NumpyEngine): the object which
             is used to read data. You can change it by setting it to
-            either `'pandas'` or `'dask'`.
+            `'pandas'`, `'dask'` or `'numpy'`.
+        last_read_stats (aseg_gdf2.instrument.ReadStats): timings and
+            counters for each stage of the last call to a reading method,
+            e.g. ``gdf.last_read_stats.to_frame()``. See
+            :mod:`aseg_gdf2.instrument`.
 
     """
     filename = str(filename)
+    exists = os.path.isfile(filename)
+    if compression.compression_of(filename):
+        # e.g. survey.dat.gz
+        filename = os.path.splitext(filename)[0]
+    # Try the usual filenames before globbing, which lists the whole
+    # directory and is slow in directories with many data packages.
+    base, ext = os.path.splitext(filename)
+    candidates = [filename + ".dfn", filename + ".DFN"]
+    if ext.lower() == ".dfn":
+        candidates = [filename]
+    elif ext.lower() in (".dat", ".ddf", ".des", ".met") and exists:
+        candidates = [base + ".DFN", base + ".dfn"]
+    for fn in candidates:
+        if os.path.isfile(fn):
+            return GDF2(fn, **kwargs)
     for fn in glob.glob(filename + "*"):
         if fn.lower().endswith("dfn"):
             return GDF2(fn, **kwargs)
@@ -76,6 +134,134 @@ class RecordTypesDict(dict):
         return df[cols]
 
 
+class RecordSchema(object):
+    """Column layout of one record type, compiled from its field definitions.
+
+    Use :meth:`GDF2.schema` rather than creating one directly. It is built
+    once and shared by every read, so that looking up fields and columns
+    and building the reader arguments costs nothing per call. Treat the
+    attributes as read-only.
+
+    Attributes:
+        fields (tuple): field definitions, in .dfn order
+        field_names (tuple): see ``GDF2.field_names``
+        field_map (dict): field name to definition (the first one, if the
+            name is duplicated)
+        column_names (tuple): see ``GDF2.column_names``
+        names_dict (dict): see ``GDF2.column_names(retdict=True)``
+        field_columns (dict): field name to a tuple of its column names,
+            see ``GDF2.get_field_columns``
+        column_fields (dict): column name to field name
+        column_definitions (tuple): see ``GDF2.get_column_definitions``
+        dtypes (tuple): dtype of each column, see ``GDF2.column_dtypes``
+        dtypes_dict (dict): see ``GDF2.column_dtypes(retdict=True)``
+        na_values (dict): column name to NULL value
+        widths (tuple): width in characters of each column
+        offsets (tuple): character offset of each column within a record
+
+    """
+
+    def __init__(self, fields, clean_column_names=False, dtypes=None):
+        self.fields = tuple(fields)
+        self.field_names = tuple(f["name"] for f in self.fields)
+        self.field_map = {}
+        for field in self.fields:
+            self.field_map.setdefault(field["name"], field)
+        self.column_names = ()
+        self.names_dict = {}
+        self.field_columns = {}
+        self.column_fields = {}
+        self.column_definitions = ()
+        self.dtypes = ()
+        self.dtypes_dict = {}
+        self.na_values = {}
+        self.widths = ()
+        self.offsets = ()
+        if self.fields and all("width" in f for f in self.fields):
+            self._compile(clean_column_names, dtypes)
+
+    def _compile(self, clean_column_names, dtypes):
+        names = []
+        column_dtypes = []
+        definitions = []
+        for field in self.fields:
+            name = field["name"]
+            if clean_column_names:
+                name = clean_column_name(name)
+            if field["cols"] == 1:
+                self.names_dict[name] = name
+                field_names = [name]
+            else:
+                self.names_dict[name] = []
+                field_names = []
+                for i in range(field["cols"]):
+                    if clean_column_names:
+                        colname = "{}_{:d}".format(name, i)
+                    else:
+                        colname = "{}[{:d}]".format(name, i)
+                    self.names_dict[colname] = name
+                    self.names_dict[name].append(colname)
+                    field_names.append(colname)
+            names.extend(field_names)
+            if not field["null"] is None:
+                for colname in field_names:
+                    self.na_values[colname] = field["null"]
+
+            if dtypes == "compact":
+                dtype = compact_dtype(field)
+            else:
+                dtype = field["inferred_dtype"]
+            self.dtypes_dict[dtype] = dtype
+            column_dtypes.extend([dtype] * field["cols"])
+
+            # get_field_columns names the columns of a field after the
+            # field itself, without cleaning 1D field names.
+            if field["cols"] == 1:
+                columns = (field["name"],)
+            elif clean_column_names:
+                columns = tuple(
+                    "{}_{:d}".format(field["name"], i) for i in range(field["cols"])
+                )
+            else:
+                columns = tuple(
+                    "{}[{:d}]".format(field["name"], i) for i in range(field["cols"])
+                )
+            self.field_columns.setdefault(field["name"], columns)
+            m = re.match("([0-9]*)([a-zA-Z]{1})([0-9]+)(.*)", field["format"])
+            if m:
+                column_format = m.group(2) + m.group(3) + m.group(4)
+            else:
+                column_format = field["format"]
+            for column_name in self.field_columns[field["name"]]:
+                definitions.append(
+                    {
+                        "name": column_name,
+                        "unit": field["unit"],
+                        "null": field["null"],
+                        "width": field["width"],
+                        "column_format": column_format,
+                        "field_name": field["name"],
+                        "field_comment": field["comment"],
+                        "field_format": field["format"],
+                        "field_long_name": field["long_name"],
+                        "field_cols": field["cols"],
+                    }
+                )
+        self.column_names = tuple(names)
+        self.column_fields = {
+            c: f["name"]
+            for f in self.fields
+            for c in self.field_columns[f["name"]]
+        }
+        self.column_definitions = tuple(definitions)
+        self.dtypes = tuple(column_dtypes)
+        self.widths = tuple(c["width"] for c in definitions)
+        offsets = [0]
+        for width in self.widths[:-1]:
+            offsets.append(offsets[-1] + width)
+        self.offsets = tuple(offsets) if self.widths else ()
+
+
 class GDF2(object):
     """Load GDF2 data package.
 
@@ -88,26 +274,52 @@ class GDF2(object):
             `'pandas'`, if you are reading small files and/or have a lot
             of RAM, or `'dask'` if you are reading huge files which will
             not fit in RAM. Both are equivalent in terms of functionality
-            but you should use `'pandas'` if you can.
+            but you should use `'pandas'` if you can. `'numpy'` is the
+            same as `'pandas'` except that with ``method='fixed-widths'``
+            the .dat file is sliced into columns by byte offset, which
+            is much faster than ``pd.read_fwf``.
+        cache (bool or str): keep a columnar copy of the data table in
+            a sidecar directory, see :func:`aseg_gdf2.read`.
+        dtypes (str): ``'compact'`` for the smallest dtypes allowed by the
+            format codes, see :func:`aseg_gdf2.read`.
+        lazy (bool): defer reading the .dfn file, see :func:`aseg_gdf2.read`.
 
     Attributes:
-        engine (either PandasEngine or DaskEngine): the object which
+        engine (PandasEngine, DaskEngine or NumpyEngine): the object which
             is used to read data. You can change it by setting it to
-            either `'pandas'` or `'dask'`.
+            `'pandas'`, `'dask'` or `'numpy'`.
+        last_read_stats (aseg_gdf2.instrument.ReadStats): timings and
+            counters for each stage of the last call to a reading method,
+            e.g. ``gdf.last_read_stats.to_frame()``. See
+            :mod:`aseg_gdf2.instrument`.
 
     """
 
-    def __init__(self, dfn_filename, method="whitespace", engine="pandas", clean_column_names=False, **kwargs):
+    def __init__(self, dfn_filename, method="whitespace", engine="pandas", clean_column_names=False, cache=False, dtypes=None, lazy=False, **kwargs):
+        if not dtypes in (None, "compact"):
+            raise ValueError("dtypes must be None or 'compact'")
         self.clean_column_names = clean_column_names
+        self.cache = cache
+        self.dtypes = dtypes
         self._nrecords = None
+        self._column_cache_obj = None
+        self._record_index = None
+        self._field_indexes = {}
+        self._spatial_index = None
+        self._tagged_record_types = None
+        self.last_read_stats = None
+        self._record_type_frames = {}
+        self._schemas = {}
+        self._readers = {}
         self._engine = engine
-        self._parse_dfn(dfn_filename)
+        self._engines = {}
+        self._record_types = None
+        self._dfn_contents = None
+        self.dfn_filename = dfn_filename
+        if not lazy:
+            self._parse_dfn(dfn_filename)
         self.dat_filename = self._find_dat_file()
         self.method = method
-        self._engines = {
-            "pandas": PandasEngine(parent=self),
-            "dask": DaskEngine(parent=self),
-        }
 
     def __repr__(self):
         r = super().__repr__()
@@ -120,7 +332,33 @@ class GDF2(object):
 
     @property
     def engine(self):
-        return self._engines[self._engine]
+        return self._get_engine(self._engine)
+
+    def _get_engine(self, name):
+        engine = self._engines.get(name, None)
+        if engine is None:
+            cls = {"pandas": PandasEngine, "dask": DaskEngine, "numpy": NumpyEngine}[name]
+            engine = cls(parent=self)
+            self._engines[name] = engine
+        return engine
+
+    @property
+    def record_types(self):
+        """Field definitions for each record type, from the .dfn file."""
+        if self._record_types is None:
+            self._parse_dfn(self.dfn_filename)
+        return self._record_types
+
+    @record_types.setter
+    def record_types(self, value):
+        self._record_types = value
+        self._invalidate_schema()
+
+    @property
+    def dfn_contents(self):
+        if self._dfn_contents is None:
+            self._parse_dfn(self.dfn_filename)
+        return self._dfn_contents
 
     @engine.setter
     def engine(self, value):
@@ -128,32 +366,723 @@ class GDF2(object):
             self._engine = "pandas"
         elif value == "dask" or value == DaskEngine:
             self._engine = "dask"
-
-    def df(self, *args, **kwargs):
+        elif value == "numpy" or value == NumpyEngine:
+            self._engine = "numpy"
+
+    @instrument.read_operation
+    def df(
+        self,
+        *args,
+        rows=None,
+        where=None,
+        bbox=None,
+        workers=None,
+        dtype_backend=None,
+        **kwargs
+    ):
         """Return the data table as a pandas.DataFrame.
 
-        The actual function called is either ``PandasEngine.df`` or
-        ``DaskEngine.df``.
+        Args:
+            workers (int): parse the .dat file in this many processes. The
+                file is split into byte ranges on line boundaries, each
+                range is parsed with the same arguments as a normal read,
+                and the results are concatenated in order. Ignored by the
+                dask engine, which has its own scheduler.
+            rows (slice): only read these records, e.g.
+                ``rows=slice(10000000, 10001000)``. See ``GDF2.rows``.
+            where (dict): only read the records where each field has the
+                given value (or one of a list of values), e.g.
+                ``where={"LINE": 10230}``. See ``GDF2.build_index``.
+            bbox (tuple): only read the records with coordinates inside
+                ``(xmin, ymin, xmax, ymax)``. See
+                ``GDF2.build_spatial_index``.
+            dtype_backend (str): ``'pyarrow'`` for columns backed by Arrow
+                arrays (``pd.ArrowDtype``), with NULL values as ``pd.NA``
+                and text as Arrow strings rather than Python objects.
+                Needs pyarrow. See also ``GDF2.to_arrow``.
+
+        The actual function called is ``PandasEngine.df``,
+        ``DaskEngine.df`` or ``NumpyEngine.df``.
+
+        """
+        if not dtype_backend in (None, "pyarrow"):
+            raise ValueError("dtype_backend must be None or 'pyarrow'")
+        if not dtype_backend is None and not kwargs.get("chunksize", None) is None:
+            raise ValueError(
+                "dtype_backend cannot be used with chunksize - use iter_batches()"
+            )
+        if where is not None or bbox is not None:
+            df = self.engine.select(where, rows=rows, bbox=bbox, **kwargs)
+        elif rows is not None:
+            start, stop, step = rows.indices(self.nrecords)
+            if step != 1:
+                raise ValueError("rows must be a slice with a step of 1")
+            df = self.rows(start, stop, **kwargs)
+        elif workers is not None and workers > 1:
+            df = self.engine.parallel_df(workers, **kwargs)
+        else:
+            df = self.engine.df(*args, **kwargs)
+        if dtype_backend == "pyarrow":
+            df = self.engine.arrow_dtypes(df)
+        return df
+
+    @instrument.read_operation
+    def rows(self, start=0, stop=None, record_type="", **kwargs):
+        """Return a range of records from the data table.
+
+        Only the bytes of the requested records are read, using the
+        line-offset index from ``GDF2.record_index``, so this takes about
+        the same time wherever the records are in the file.
+
+        Args:
+            start (int): first record number
+            stop (int): stop before this record number - to the end of the
+                file by default
+            record_type (str): record type - NULL by default
+
+        start and stop are interpreted as for slicing a list, so negative
+        numbers count back from the end of the file and out of range
+        numbers are clipped to it.
+
+        Other keyword arguments (e.g. ``usecols``) are passed on as for
+        ``df()``. The returned DataFrame is indexed by record number.
+
+        The actual function called is ``PandasEngine.rows``,
+        ``DaskEngine.rows`` or ``NumpyEngine.rows``.
 
         """
-        return self.engine.df(*args, **kwargs)
+        if record_type or self.tagged_record_types:
+            raise ValueError(
+                "rows() cannot be used on .dat files with more than one record type"
+            )
+        start, stop, _ = slice(start, stop).indices(self.nrecords)
+        stop = max(start, stop)
+        return self.engine.rows(start, stop, record_type=record_type, **kwargs)
+
+    @instrument.read_operation
+    def build_index(self, field="LINE", record_type=""):
+        """Index the records of the data table by the value of a field.
+
+        The data for the field is read once and the range of records for
+        each run of a value (e.g. each survey line) is saved to a sidecar
+        file next to the .dat file. After that, ``df(where=...)`` and
+        ``get_fields_data(..., where=...)`` only read the matching records.
 
-    def iterrows(self, *args, **kwargs):
+        Args:
+            field (str): name of a field with one column, e.g. a line or
+                flight number
+            record_type (str): record type - NULL by default
+
+        Returns: :class:`aseg_gdf2.index.FieldIndex`
+
+        """
+        field_def = self.get_field_definition(field, record_type)
+        if field_def is None:
+            raise KeyError("No field named {}".format(field))
+        if field_def["cols"] != 1:
+            raise ValueError("Cannot index 2D field {}".format(field))
+        column = self.column_names(record_type)[self.field_names(record_type).index(field)]
+        engine = self._get_engine("numpy" if self.method == "fixed-widths" else "pandas")
+        chunks = engine.df(record_type=record_type, usecols=[column], chunksize=100000)
+        chunks = engine._timed_chunks(chunks, record_type)
+        index = FieldIndex.build(
+            self.dat_filename, field, (chunk[column].to_numpy() for chunk in chunks)
+        )
+        try:
+            index.save()
+        except OSError as e:
+            logger.warning("Unable to save index for {}: {}".format(field, e))
+        self._field_indexes[(record_type, field)] = index
+        return index
+
+    def field_index(self, field="LINE", record_type=""):
+        """Return the index of a field, loading or building it if necessary.
+
+        See ``GDF2.build_index``.
+
+        """
+        index = self._field_indexes.get((record_type, field), None)
+        if index is None or not index.is_current():
+            index = FieldIndex.load(self.dat_filename, field)
+            if index is None:
+                logger.info("Building index for field {}".format(field))
+                return self.build_index(field, record_type)
+            self._field_indexes[(record_type, field)] = index
+        return index
+
+    @instrument.read_operation
+    def build_spatial_index(self, x, y, ncells=256, record_type=""):
+        """Index the records of the data table by their coordinates.
+
+        The extent of the coordinates (from ``GDF2.stats``) is divided into
+        a grid of square cells, and the range of records in each cell is
+        saved to a sidecar file next to the .dat file. After that,
+        ``df(bbox=...)`` and ``get_fields_data(..., bbox=...)`` only read
+        the records in the cells which overlap the bounding box.
+
+        Args:
+            x (str): name of the field with the x coordinate, e.g. an
+                easting or longitude
+            y (str): name of the field with the y coordinate, e.g. a
+                northing or latitude
+            ncells (int): number of cells along the longer side of the
+                grid
+            record_type (str): record type - NULL by default
+
+        Returns: :class:`aseg_gdf2.index.SpatialIndex`
+
+        """
+        for field in (x, y):
+            field_def = self.get_field_definition(field, record_type)
+            if field_def is None:
+                raise KeyError("No field named {}".format(field))
+            if field_def["cols"] != 1:
+                raise ValueError("Cannot index 2D field {}".format(field))
+        stats = self.stats(fields=[x, y], record_type=record_type)
+        x_stats = stats[self.get_field_columns(x, record_type)[0]]
+        y_stats = stats[self.get_field_columns(y, record_type)[0]]
+        if not x_stats.count or not y_stats.count:
+            extent = (0.0, 0.0, 0.0, 0.0)
+        else:
+            extent = (x_stats.min, y_stats.min, x_stats.max, y_stats.max)
+        engine = self._get_engine("numpy" if self.method == "fixed-widths" else "pandas")
+        chunks = engine.iterchunks(fields=[x, y], record_type=record_type)
+        index = SpatialIndex.build(
+            self.dat_filename,
+            x,
+            y,
+            extent,
+            ((chunk[x], chunk[y]) for chunk in chunks),
+            ncells=ncells,
+        )
+        try:
+            index.save()
+        except OSError as e:
+            logger.warning("Unable to save spatial index: {}".format(e))
+        self._spatial_index = index
+        return index
+
+    def spatial_index(self):
+        """Return the spatial index, loading it from its sidecar file if needed.
+
+        See ``GDF2.build_spatial_index``, which must have been called
+        first, in this or an earlier session.
+
+        """
+        index = self._spatial_index
+        if not index is None and index.is_current():
+            return index
+        if index is None:
+            # Sidecar files are named <dat>.<x>.<y>.grid.npz, with any
+            # non-word characters in the field names replaced by "_".
+            names = {re.sub(r"\W", "_", f): f for f in self.field_names()}
+            pattern = glob.escape(self.dat_filename) + ".*.*.grid.npz"
+            for filename in sorted(glob.glob(pattern)):
+                key = filename[len(self.dat_filename) + 1 : -len(".grid.npz")]
+                x, y = [names.get(k, None) for k in key.split(".")]
+                if not x is None and not y is None:
+                    index = SpatialIndex.load(self.dat_filename, x, y)
+                    if not index is None:
+                        self._spatial_index = index
+                        return index
+            raise ValueError(
+                "There is no spatial index: call build_spatial_index(x, y) first"
+            )
+        logger.info("Rebuilding out of date spatial index")
+        return self.build_spatial_index(
+            index.x_field, index.y_field, ncells=max(index.shape)
+        )
+
+    @instrument.timed("index")
+    def _where_ranges(self, where, rows=None, record_type="", bbox=None):
+        ranges = None
+        if bbox is not None:
+            ranges = self.spatial_index().ranges(bbox)
+        for field, values in (where or {}).items():
+            field_ranges = self.field_index(field, record_type).ranges(values)
+            if ranges is None:
+                ranges = field_ranges
+            else:
+                ranges = intersect_ranges(ranges, field_ranges)
+        if rows is not None:
+            start, stop, step = rows.indices(self.nrecords)
+            if step != 1:
+                raise ValueError("rows must be a slice with a step of 1")
+            if ranges is None:
+                return [(start, stop)]
+            ranges = intersect_ranges(ranges, [(start, stop)])
+        return ranges
+
+    def _line_field(self, record_type=""):
+        for name in self.field_names(record_type):
+            if name.lower() == "line":
+                return name
+        raise ValueError(
+            "There is no LINE field: use where={field_name: value} instead"
+        )
+
+    def _byte_ranges(self, nparts):
+        """Split the .dat file into about nparts ranges of whole lines."""
+        if compression.compression_of(self.dat_filename):
+            # Use the record index, as compressed files can't be seeked in.
+            index = self.record_index
+            bounds = sorted(
+                set(index.offset(index.nrecords * i // nparts) for i in range(nparts))
+            )
+            bounds.append(index.offset(index.nrecords))
+            return list(zip(bounds[:-1], bounds[1:]))
+        size = os.path.getsize(self.dat_filename)
+        bounds = [0]
+        with open(self.dat_filename, "rb") as f:
+            for i in range(1, nparts):
+                pos = size * i // nparts
+                if pos <= bounds[-1]:
+                    continue
+                # Start from the previous byte in case pos begins a line.
+                f.seek(pos - 1)
+                end = pos - 1 + len(f.readline())
+                if bounds[-1] < end < size:
+                    bounds.append(end)
+        bounds.append(size)
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def _read_record_bytes(self, start, stop):
+        index = self.record_index
+        begin = index.offset(start)
+        end = index.offset(stop)
+        with instrument.stage("read", bytes=end - begin):
+            return compression.read_range(self.dat_filename, begin, end, index.blocks)
+
+    @instrument.read_operation
+    def iterrows(self, *args, kind="dict", **kwargs):
         """Iterate over rows in the data table.
 
-        The actual function called is either `PandasEngine.iterrows`
-        or `DaskEngine.iterrows`.
+        Args:
+            kind (str): type of each row. ``'dict'`` (the default) is a
+                dict of column name to value. ``'tuple'`` is a namedtuple,
+                which also allows ``row["Con[0]"]`` for column names which
+                are not valid identifiers, and ``'record'`` is a row of
+                a NumPy structured array (``row["Con[0]"]``). Both are
+                much faster than ``'dict'``. The first item of each row is
+                the row number, ``Index``.
+
+        The actual function called is `PandasEngine.iterrows`,
+        `DaskEngine.iterrows` or `NumpyEngine.iterrows`.
+
+        """
+        if not kind in ROW_KINDS:
+            raise ValueError("kind must be one of {}".format(ROW_KINDS))
+        return self.engine.iterrows(*args, kind=kind, **kwargs)
+
+    @instrument.read_operation
+    def iterchunks(
+        self, chunksize=100000, fields=None, record_type="", kind="dict", workers=None
+    ):
+        """Iterate over the data table in blocks of records.
+
+        This is much faster than ``iterrows`` for streaming through large
+        files, as each block is processed as arrays, and memory use is
+        bounded by chunksize.
+
+        Args:
+            chunksize (int): number of records per block
+            fields (list): field names to read - all fields by default
+            record_type (str): record type - NULL by default
+            kind (str): ``'dict'`` to yield a dict of field name to ndarray,
+                with 2D fields stacked into arrays of shape (n, cols) as
+                in ``get_fields_data``, or ``'dataframe'`` to yield
+                pandas.DataFrames with one column per column of the data
+                table.
+            workers (int): parse the blocks in this many processes. Blocks
+                are still yielded in order, and at most two per worker are
+                held in memory at once. Ignored by the dask engine.
+
+        The actual function called is ``PandasEngine.iterchunks``,
+        ``DaskEngine.iterchunks`` or ``NumpyEngine.iterchunks``.
+
+        """
+        if not kind in ("dict", "dataframe"):
+            raise ValueError("kind must be 'dict' or 'dataframe'")
+        if workers is not None and workers > 1:
+            return self.engine.parallel_iterchunks(
+                workers,
+                chunksize=chunksize,
+                fields=fields,
+                record_type=record_type,
+                kind=kind,
+            )
+        return self.engine.iterchunks(
+            chunksize=chunksize, fields=fields, record_type=record_type, kind=kind
+        )
+
+    def follow(self, record_type="", start=0, **kwargs):
+        """Follow a .dat file which is still being written.
+
+        The returned object remembers the byte offset after the last
+        complete record it has read, and each call to its ``read()``
+        method returns only the complete records appended since, e.g. to
+        refresh a dashboard during acquisition without parsing the whole
+        file again. A last line with no line terminator yet is left for
+        the next call. ``gdf.nrecords`` also counts the appended records,
+        scanning only the new lines.
+
+        Args:
+            record_type (str): record type - NULL by default
+            start (int): record number to start from, or None to only read
+                records appended from now on
+
+        Other keyword arguments (e.g. ``usecols``) are passed on as for
+        ``df()``.
+
+        Returns: :class:`aseg_gdf2.follow.Follower`
+
+        """
+        return Follower(self, record_type=record_type, start=start, **kwargs)
+
+    @instrument.read_operation
+    def stats(
+        self,
+        fields=None,
+        record_type="",
+        workers=None,
+        chunksize=100000,
+        bins=column_stats.DEFAULT_BINS,
+        cache=True,
+    ):
+        """Compute summary statistics of each column of the data table.
+
+        The data table is read in one pass with ``iterchunks``, so memory
+        use is bounded by chunksize, and the statistics of each block are
+        merged. NULL values from the .dfn file are counted separately and
+        left out of everything else, and 2D fields have statistics for
+        each column (channel). ``A`` format fields only have counts.
+
+        The results are saved to a ``<dat>.stats.json`` sidecar file and
+        returned from there, without reading the .dat file, until it
+        changes. Columns which are not in the sidecar file yet, or were
+        read with a different dtype or method, are read and added to it.
+
+        Args:
+            fields (list): field names - all fields by default
+            record_type (str): record type - NULL by default
+            workers (int): parse the .dat file in this many processes
+            chunksize (int): number of records to read at a time
+            bins (int): maximum number of histogram bins per column
+            cache (bool): load and save the sidecar file
+
+        Returns: :class:`aseg_gdf2.stats.TableStats`, a mapping of column
+        name to :class:`aseg_gdf2.stats.ColumnStats`. Use ``to_frame()``
+        for a DataFrame of the count, NULL count, min, max, mean and
+        standard deviation of every column, and e.g.
+        ``stats["Con[3]"].histogram()`` for a histogram.
+
+        """
+        schema = self.schema(record_type)
+        if fields is None:
+            fields = schema.field_names
+        fields = list(dict.fromkeys(fields))
+        columns = [c for f in fields for c in self.get_field_columns(f, record_type)]
+        column_fields = {c: schema.column_fields.get(c, c) for c in columns}
+        numeric = {}
+        for column in columns:
+            field = schema.field_map.get(column_fields[column], {"format": ""})
+            m = re.match(r"[0-9]*([A-Za-z])", field["format"].strip())
+            numeric[column] = not (m and m.group(1).upper() == "A")
+        dtypes = {
+            c: str(getattr(d, "__name__", d))
+            for c, d in zip(schema.column_names, schema.dtypes)
+        }
+
+        stored = column_stats.load(self.dat_filename, bins) if cache else {}
+        known = stored.setdefault(record_type, {})
+        results = {}
+        for column in columns:
+            entry = known.get(column, None)
+            if (
+                not entry is None
+                and entry["null"] == schema.na_values.get(column, None)
+                and entry.get("dtype", None) == dtypes.get(column, None)
+                and entry.get("method", None) == self.method
+                and entry["stats"]["numeric"] == numeric[column]
+            ):
+                results[column] = ColumnStats.from_dict(entry["stats"])
+        missing = [
+            f
+            for f in fields
+            if not set(self.get_field_columns(f, record_type)) <= set(results)
+        ]
+
+        if missing:
+            logger.info("Computing statistics for {}".format(", ".join(missing)))
+            computed = TableStats(
+                {
+                    c: ColumnStats(numeric=numeric[c], bins=bins)
+                    for f in missing
+                    for c in self.get_field_columns(f, record_type)
+                }
+            )
+            chunks = self.iterchunks(
+                chunksize=chunksize,
+                fields=missing,
+                record_type=record_type,
+                kind="dataframe",
+                workers=workers,
+            )
+            for chunk in chunks:
+                computed.merge(TableStats.from_frame(chunk, {}, numeric, bins=bins))
+            for column, result in computed.items():
+                results[column] = result
+                known[column] = {
+                    "null": schema.na_values.get(column, None),
+                    "dtype": dtypes.get(column, None),
+                    "method": self.method,
+                    "stats": result.to_dict(),
+                }
+            if cache:
+                try:
+                    column_stats.save(self.dat_filename, stored, bins=bins)
+                except OSError as e:
+                    logger.warning("Unable to save statistics: {}".format(e))
+        return TableStats({c: results[c] for c in columns}, column_fields)
+
+    def to_gdf2(self, path, chunksize=100000, fields=None):
+        """Write the data package to a new .dfn and .dat file.
+
+        The field definitions (formats, NULL values, units and names) are
+        copied from this package, and the data table is streamed from
+        ``iterchunks`` so memory use is bounded by chunksize. Records of
+        other record types (e.g. ``COMM``) are written before the data.
+
+        Args:
+            path (str): filename for the new .dat or .dfn file
+            chunksize (int): number of records to read and write at a time
+            fields (list): only write these fields - all of them by default
+
+        Returns: a tuple of the .dfn and .dat filenames.
+
+        """
+        if fields is None:
+            fields = self.field_names()
+        definitions = [self.get_field_definition(f) for f in fields]
+        data = {"": self.iterchunks(chunksize=chunksize, fields=fields)}
+        record_types = {"": {"fields": definitions}}
+        for record_type, df in self.read_record_types(self.tagged_record_types).items():
+            if is_dask_dataframe(df):
+                df = df.compute()
+            data[record_type] = df
+            record_types[record_type] = self.record_types[record_type]
+        return writer.write(path, data, record_types=record_types)
+
+    @instrument.read_operation
+    def iter_batches(self, chunksize=100000, fields=None, record_type="", workers=None):
+        """Iterate over the data table as Arrow record batches.
+
+        Each block of records from ``iterchunks`` is handed to Arrow as
+        arrays, without building a DataFrame first. There is one column
+        per field, with 2D fields such as ``Con`` as ``FixedSizeList``
+        columns, NULL values as nulls, and the units, names and NULL values
+        from the .dfn file as field metadata - see
+        :func:`aseg_gdf2.columnar.arrow_schema`. Needs pyarrow.
+
+        Args:
+            chunksize (int): number of records per batch
+            fields (list): field names to read - all fields by default
+            record_type (str): record type - NULL by default
+            workers (int): parse the blocks in this many processes
+
+        Yields: pyarrow.RecordBatch
+
+        """
+        return columnar.iter_batches(
+            self,
+            chunksize=chunksize,
+            fields=fields,
+            record_type=record_type,
+            workers=workers,
+        )
+
+    @instrument.read_operation
+    def to_arrow(self, fields=None, record_type="", chunksize=100000, workers=None):
+        """Return the data table as a pyarrow.Table.
+
+        The table is built from the batches of ``iter_batches``, so the
+        data is only copied once, from the parser into Arrow arrays. Use
+        it with Arrow-native tools such as DuckDB or Polars, e.g.
+        ``polars.from_arrow(gdf.to_arrow())``.
+
+        Args:
+            fields (list): field names to read - all fields by default
+            record_type (str): record type - NULL by default
+            chunksize (int): number of records per record batch
+            workers (int): parse the .dat file in this many processes
+
+        """
+        return columnar.to_arrow(
+            self,
+            fields=fields,
+            record_type=record_type,
+            chunksize=chunksize,
+            workers=workers,
+        )
+
+    @instrument.read_operation
+    def read_record_types(self, record_types=None, **kwargs):
+        """Read several record types from the .dat file in a single pass.
+
+        Each line of the .dat file is routed by its RT tag (e.g. ``COMM``)
+        to the record type with that name, and lines without a tag belong
+        to the data record type ``""``. After this, ``df(record_type=...)``
+        for any of the tagged record types is answered without reading the
+        file again.
+
+        Args:
+            record_types (list): record types to read - all of them by
+                default
+
+        Other keyword arguments (e.g. ``usecols``) are passed on as for
+        ``df()`` when parsing the data record type. Tagged record types are
+        always decoded using the field widths from the .dfn file.
+
+        Returns: dict of DataFrames, keyed by record type.
+
+        The actual function called is ``PandasEngine.read_record_types``,
+        ``DaskEngine.read_record_types`` or ``NumpyEngine.read_record_types``.
+
+        """
+        return self.engine.read_record_types(record_types, **kwargs)
+
+    @property
+    def record_type_tags(self):
+        """Map each tagged record type to the width of its RT tag.
+
+        These are the record types other than the data record type which
+        have field definitions in the .dfn file.
+
+        """
+        tags = {}
+        for record_type in self.record_types:
+            if record_type == "" or not self._has_columns(record_type):
+                continue
+            width = len(record_type)
+            for field in self.record_types[record_type]["fields"]:
+                if field["name"] == "RT":
+                    width = max(width, field["width"])
+            tags[record_type] = width
+        return tags
+
+    @property
+    def tagged_record_types(self):
+        """Return the tagged record types which occur in the .dat file.
+
+        The file is only scanned the first time this is used.
 
         """
-        return self.engine.iterrows(*args, **kwargs)
+        if self._tagged_record_types is None:
+            tags = {rt.encode("ascii"): rt for rt in self.record_type_tags}
+            found = set()
+            if tags:
+                size = os.path.getsize(self.dat_filename)
+                with instrument.stage("demux", bytes=size):
+                    found = scan_line_prefixes(self.dat_filename, list(tags))
+            self._tagged_record_types = sorted(tags[t] for t in found)
+            if self._tagged_record_types:
+                logger.info(
+                    "{} has records of type {}".format(
+                        self.dat_filename, self._tagged_record_types
+                    )
+                )
+        return self._tagged_record_types
+
+    def _iter_record_type_blocks(self, record_types, blocksize=2 ** 24):
+        """Stream the .dat file once, routing lines to their record type.
+
+        Yields ``(record_type, bytes)`` tuples. Lines of the data record
+        type are yielded a block at a time as they are read, and lines of
+        the other requested record types are yielded together at the end.
+
+        """
+        tags = self._tag_bytes()
+        buffers = {rt: [] for tag, width, rt in tags}
+        with compression.open_file(self.dat_filename) as f:
+            previous = b"\n"
+            while True:
+                with instrument.stage("read") as stage:
+                    block = f.read(blocksize)
+                    if block:
+                        block += f.readline()
+                    stage.bytes = len(block)
+                if not block:
+                    break
+                with instrument.stage("demux", bytes=len(block)):
+                    joined = previous + block
+                    tagged = any(b"\n" + tag in joined for tag, width, rt in tags)
+                if not tagged:
+                    if "" in record_types:
+                        yield "", block
+                    previous = block[-1:]
+                    continue
+                with instrument.stage("demux"):
+                    data = self._demux_lines(block, tags, buffers)
+                if "" in record_types and data:
+                    yield "", data
+                previous = block[-1:]
+        for record_type in record_types:
+            if record_type:
+                yield record_type, b"".join(buffers[record_type])
+
+    def _tag_bytes(self):
+        """Return ``(tag, width, record_type)`` for each tagged record type."""
+        return [
+            (rt.encode("ascii"), width, rt)
+            for rt, width in self.record_type_tags.items()
+        ]
+
+    @staticmethod
+    def _demux_lines(block, tags, buffers):
+        """Route the lines of a block of whole lines by their RT tag.
+
+        Args:
+            block (bytes): lines from the .dat file
+            tags (list): from ``_tag_bytes``
+            buffers (dict): record type to a list which its lines are
+                appended to
 
+        Returns: the lines of the data record type, as bytes.
+
+        """
+        firsts = set(tag[:1] for tag, width, rt in tags)
+        data = []
+        for line in block.splitlines(True):
+            if line[:1] in firsts:
+                for tag, width, rt in tags:
+                    if line[:width].strip() == tag:
+                        buffers[rt].append(line)
+                        break
+                else:
+                    data.append(line)
+            else:
+                data.append(line)
+        return b"".join(data)
+
+    def _record_type_frame(self, record_type, data):
+        """Decode the lines of a tagged record type using its field widths."""
+        with instrument.stage("parse", bytes=len(data)) as stage:
+            reader = self._fixed_width_reader(record_type, source=data)
+            df = reader.frame(reader.lines_to_records(data.splitlines()))
+            stage.rows = len(df)
+        return df
+
+    @instrument.timed("dfn")
     def _parse_dfn(self, dfn_filename, join_null_data_rts=True, **kwargs):
-        self.record_types = RecordTypesDict()
         with open(dfn_filename, "r") as f:
             self.dfn_filename = dfn_filename
-            self.dfn_contents = f.read()
+            self._dfn_contents = f.read()
+        instrument.count(bytes=len(self._dfn_contents))
+        self._record_types = RecordTypesDict()
+        # Formatting every field definition is slow for large .dfn files.
+        log_fields = logger.isEnabledFor(logging.INFO)
 
-        for i, line in enumerate(self.dfn_contents.splitlines()):
+        for i, line in enumerate(self._dfn_contents.splitlines()):
             if not line.startswith("DEFN"):
                 logger.warning("line {} does not begin with DEFN: {}".format(i, line))
                 continue
@@ -249,11 +1178,12 @@ class GDF2(object):
                         dtype = int
                     f["inferred_dtype"] = dtype
 
-                    logger.info(
-                        "line {}: adding field {} to record type RT={}".format(
-                            i, str(f), rt
+                    if log_fields:
+                        logger.info(
+                            "line {}: adding field {} to record type RT={}".format(
+                                i, str(f), rt
+                            )
                         )
-                    )
                     self.record_types[rt]["fields"].append(f)
                     if f["name"] == "RT":
                         self.record_types[rt]["format"] = f["format"]
@@ -266,87 +1196,225 @@ class GDF2(object):
             filename = self.dfn_filename[:-3] + ext
             if os.path.isfile(filename):
                 return filename
+        for ext in ("dat", "DAT"):
+            for filename in compression.compressed_filenames(self.dfn_filename[:-3] + ext):
+                if os.path.isfile(filename):
+                    return filename
         logger.error("No data file located.")
         return ""
 
+    def schema(self, record_type=""):
+        """Return the compiled column layout of a record type.
+
+        The :class:`RecordSchema` is built the first time it is needed and
+        then reused, so repeated reads do no work on the definitions. It
+        is rebuilt when ``clean_column_names`` or ``dtypes`` is changed,
+        or after ``fix_duplicate_field_names``.
+
+        Args:
+            record_type (str): record type - NULL by default
+
+        Returns: :class:`aseg_gdf2.gdf2.RecordSchema` object.
+
+        """
+        key = (record_type, self.clean_column_names, self.dtypes)
+        schema = self._schemas.get(key, None)
+        if schema is None:
+            schema = RecordSchema(
+                self.record_types[record_type]["fields"],
+                clean_column_names=self.clean_column_names,
+                dtypes=self.dtypes,
+            )
+            self._schemas[key] = schema
+        return schema
+
+    def _invalidate_schema(self):
+        self._schemas.clear()
+        self._readers.clear()
+
     # def _parse_dat(self):
     @property
     def _read_dat(self):
-        na_values = {}
-        colnames, colnamesdict = self.column_names("", retdict=True)
-        for colname in colnames:
-            field_name = colnamesdict[colname]
-            null = self.get_field_definition(field_name)["null"]
-            if not null is None:
-                na_values[colname] = null
+        return {
+            record_type: self._readers_for(record_type)
+            for record_type in self.record_types
+            if self._has_columns(record_type)
+        }
+
+    def _readers_for(self, record_type=""):
+        """Return the cached reader functions and arguments for each engine."""
+        key = (
+            record_type,
+            self.clean_column_names,
+            self.dtypes,
+            self.method,
+            self.dat_filename,
+        )
+        readers = self._readers.get(key, None)
+        if readers is None:
+            readers = self._record_type_readers(record_type)
+            self._readers[key] = readers
+        return readers
+
+    def _has_columns(self, record_type):
+        return bool(self.schema(record_type).column_names)
+
+    def _record_type_readers(self, record_type):
+        schema = self.schema(record_type)
+        colnames = list(schema.column_names)
+        na_values = self._column_na_values(record_type)
         logger.debug("_parse_dat: na_values = {}".format(na_values))
 
-        column_dtypes = self.column_dtypes()
+        column_dtypes = schema.dtypes
 
         value = {
-            "": {
-                PandasEngine: {
-                    "func": None,
-                    "args": [self.dat_filename],
-                    "kwargs": {
-                        "names": colnames,
-                        "index_col": False,
-                        "header": None,
-                        "keep_default_na": True,
-                        "na_values": na_values,
-                        "dtype": dict(zip(colnames, column_dtypes)),
-                    },
+            PandasEngine: {
+                "func": None,
+                "args": [self.dat_filename],
+                "kwargs": {
+                    "names": colnames,
+                    "index_col": False,
+                    "header": None,
+                    "keep_default_na": True,
+                    "na_values": na_values,
+                    "dtype": dict(zip(colnames, column_dtypes)),
                 },
-                DaskEngine: {
-                    "func": None,
-                    "args": [self.dat_filename],
-                    "kwargs": {
-                        "names": colnames,
-                        "header": None,
-                        "keep_default_na": True,
-                        "na_values": na_values,
-                        "dtype": dict(zip(colnames, column_dtypes)),
-                    },
+            },
+            DaskEngine: {
+                "func": None,
+                "args": [self.dat_filename],
+                "kwargs": {
+                    "names": colnames,
+                    "header": None,
+                    "keep_default_na": True,
+                    "na_values": na_values,
+                    "dtype": dict(zip(colnames, column_dtypes)),
                 },
-            }
+            },
+            NumpyEngine: {
+                "func": None,
+                "args": [self.dat_filename],
+                "kwargs": {
+                    "names": colnames,
+                    "index_col": False,
+                    "header": None,
+                    "keep_default_na": True,
+                    "na_values": na_values,
+                    "dtype": dict(zip(colnames, column_dtypes)),
+                },
+            },
         }
         if self.method == "fixed-widths":
-            for engine in (PandasEngine, DaskEngine):
-                value[""][engine]["func"] = engine.read_fwf
-                value[""][engine]["func_name"] = "read_fwf"
-                value[""][engine]["kwargs"].update(
-                    {"widths": [c["width"] for c in self.get_column_definitions("")]}
-                )
+            for engine in (PandasEngine, DaskEngine, NumpyEngine):
+                value[engine]["func"] = engine.read_fwf
+                value[engine]["func_name"] = "read_fwf"
+                value[engine]["kwargs"].update({"widths": list(schema.widths)})
         elif self.method == "whitespace":
-            for engine in (PandasEngine, DaskEngine):
-                value[""][engine]["func"] = engine.read_table
-                value[""][engine]["func_name"] = "read_table"
-                value[""][engine]["kwargs"].update({"delimiter": r"\s+"})
+            for engine in (PandasEngine, DaskEngine, NumpyEngine):
+                value[engine]["func"] = engine.read_table
+                value[engine]["func_name"] = "read_table"
+                value[engine]["kwargs"].update({"delimiter": r"\s+"})
         return value
 
+    def _column_na_values(self, record_type=""):
+        return dict(self.schema(record_type).na_values)
+
+    def _fixed_width_reader(self, record_type="", source=None):
+        schema = self.schema(record_type)
+        verified = None
+        if source is None and not compression.compression_of(self.dat_filename):
+            # The record index has already checked the record boundaries.
+            index = self.record_index
+            if index.is_fixed:
+                verified = (index.record_length, index.size)
+        return fixed_width.FixedWidthReader(
+            self.dat_filename if source is None else source,
+            schema.column_names,
+            schema.widths,
+            dtype=dict(zip(schema.column_names, schema.dtypes)),
+            na_values=schema.na_values,
+            verified=verified,
+        )
+
+    def memmap(self, record_type=""):
+        """Memory-map the .dat file for random access without reading it.
+
+        Only works for files where every record has the same byte length,
+        which is worked out from the field widths in the .dfn file. The
+        first time a file is used every record boundary is checked for a
+        line terminator, which reads the whole file once; the result is
+        kept in the sidecar file of ``GDF2.record_index``.
+
+        Args:
+            record_type (str): record type - NULL by default
+
+        Returns: :class:`aseg_gdf2.fixed_width.MemmapTable`. Index it with a
+            record number to get a dict, a slice to get a DataFrame, or a
+            column or field name to get a lazily decoded column, e.g.
+            ``gdf.memmap()["Con"][1000:2000]`` decodes a 2D array for just
+            those 1000 records.
+
+        """
+        names, namesdict = self.column_names(record_type, retdict=True)
+        fields = {k: v for k, v in namesdict.items() if isinstance(v, list)}
+        return fixed_width.MemmapTable(
+            self._fixed_width_reader(record_type), fields=fields
+        )
+
+    @property
+    def _column_cache(self):
+        if isinstance(self.cache, (str, os.PathLike)):
+            path = os.path.join(
+                str(self.cache), os.path.basename(self.dat_filename) + ".npycache"
+            )
+        else:
+            path = self.dat_filename + ".npycache"
+        schema = {
+            "method": self.method,
+            "columns": self.column_names(""),
+            "dtypes": [getattr(d, "__name__", d) for d in self.column_dtypes("")],
+            "na_values": self._column_na_values(""),
+        }
+        cache = self._column_cache_obj
+        if cache is None or cache.path != path or cache.schema != schema:
+            cache = column_cache.ColumnCache(self.dat_filename, path, schema)
+            self._column_cache_obj = cache
+        return cache
+
+    def clear_cache(self):
+        """Delete the sidecar cache of the data table, if there is one."""
+        self._column_cache.clear()
+
+    @property
+    def record_index(self):
+        """Record count and line-offset index of the .dat file.
+
+        For files with fixed-length records this is computed from the file
+        size. Otherwise the file is scanned once and the index is saved to
+        a small sidecar file (``<dat>.index.npz``) which is reused until the
+        .dat file changes. If the file has grown since (e.g. it is still
+        being written), only the appended lines are scanned.
+        ``gdf.record_index.offset(n)`` gives the byte offset of record n.
+
+        Returns: :class:`aseg_gdf2.index.RecordIndex`
+
+        """
+        index = self._record_index
+        if index is None or not index.is_current():
+            with instrument.stage("index") as stage:
+                index = RecordIndex.open(self.dat_filename, previous=index)
+                stage.rows = index.nrecords
+            self._record_index = index
+        return index
+
     @property
     def nrecords(self):
-        if not self._nrecords:
-            # Count the number of rows
-            def blocks(files, size=65536):
-                while True:
-                    b = files.read(size)
-                    if not b:
-                        break
-                    yield b
+        """Number of records (lines) in the .dat file.
 
-            with open(self.dat_filename, "r", errors="ignore") as f:
-                newlines = sum(bl.count("\n") for bl in blocks(f))
+        This is updated if the file grows, see ``GDF2.record_index``.
 
-            with open(self.dat_filename, "rb") as f:
-                f.seek(-1, os.SEEK_END)
-                last_byte = f.read(1)
-                if last_byte in (b"\r", b"\n"):
-                    self._nrecords = newlines
-                else:
-                    # If the last line contains non-EOL chars, it should be counted
-                    # as a record... ?
-                    self._nrecords = newlines + 1
+        """
+        self._nrecords = self.record_index.nrecords
         return self._nrecords
 
     @nrecords.setter
@@ -389,6 +1457,7 @@ class GDF2(object):
                     new_name = f"{dup_name}" + suffix.format(n=dup_count)
                     self.record_types[""]["fields"][i]["name"] = new_name
                     dup_count += 1
+        self._invalidate_schema()
 
     def field_names(self, record_type=""):
         """Return field names from the .dfn file.
@@ -398,7 +1467,7 @@ class GDF2(object):
         for each record (== "row"). See column_names() for an alternative.
 
         """
-        return [f["name"] for f in self.record_types[record_type]["fields"]]
+        return list(self.schema(record_type).field_names)
 
     def column_names(self, record_type="", retdict=False):
         """Provide a name for each column of the data table / pd.DataFrame
@@ -412,22 +1481,13 @@ class GDF2(object):
         names, "Con[0]", "Con[1]", and so on.
 
         """
-        namesdict = {}
-        names = []
-        for field in self.record_types[record_type]["fields"]:
-            name = self._clean_column_name(field["name"]) if self.clean_column_names else field["name"]
-            if field["cols"] == 1:
-                namesdict[name] = name
-                names.append(name)
-            else:
-                namesdict[name] = []
-                for i in range(field["cols"]):
-                    colname = "{}_{:d}".format(name, i) if self.clean_column_names else "{}[{:d}]".format(name, i)
-                    namesdict[colname] = name
-                    namesdict[name].append(colname)
-                    names.append(colname)
-
+        schema = self.schema(record_type)
+        names = list(schema.column_names)
         if retdict:
+            namesdict = {
+                k: list(v) if isinstance(v, list) else v
+                for k, v in schema.names_dict.items()
+            }
             return names, namesdict
         else:
             return names
@@ -437,11 +1497,7 @@ class GDF2(object):
          Clean the column name into an identifier-friendly form to avoid
          pandas/dask itertuples falling back to positional naming.
          """
-
-        new_name = re.sub(r"\W+", "_", name)
-        new_name = re.sub(r"^[\d_]+", "", new_name)
-
-        return new_name
+        return clean_column_name(name)
 
     def column_dtypes(self, record_type="", retdict=False):
         """Provide a dtype for each column of the data table / pd.DataFrame
@@ -451,18 +1507,14 @@ class GDF2(object):
         single field "Con" in the .dfn file may account for 30 columns in the
         .dat file with a format code of say 30F10.5.
 
+        With ``dtypes='compact'`` the dtypes come from ``compact_dtype``.
 
         """
-        dtypesdict = {}
-        dtypes = []
-        for field in self.record_types[record_type]["fields"]:
-            dtype = field["inferred_dtype"]
-            dtypesdict[dtype] = dtype
-            dtypes.extend([dtype] * field["cols"])
+        schema = self.schema(record_type)
         if retdict:
-            return dtypes, dtypesdict
+            return list(schema.dtypes), dict(schema.dtypes_dict)
         else:
-            return dtypes
+            return list(schema.dtypes)
 
     def get_column_definitions(self, record_type=""):
         """Return the field definition for all the columns i.e. the same
@@ -476,35 +1528,12 @@ class GDF2(object):
             etc.
 
         """
-        columns = []
-        for field in self.record_types[record_type]["fields"]:
-            for column_name in self.get_field_columns(field["name"], record_type):
-                m = re.match("([0-9]*)([a-zA-Z]{1})([0-9]+)(.*)", field["format"])
-                if m:
-                    column_format = m.group(2) + m.group(3) + m.group(4)
-                else:
-                    column_format = field["format"]
-                column = {
-                    "name": column_name,
-                    "unit": field["unit"],
-                    "null": field["null"],
-                    "width": field["width"],
-                    "column_format": column_format,
-                    "field_name": field["name"],
-                    "field_comment": field["comment"],
-                    "field_format": field["format"],
-                    "field_long_name": field["long_name"],
-                    "field_cols": field["cols"],
-                }
-                columns.append(column)
-        return columns
+        return [dict(c) for c in self.schema(record_type).column_definitions]
 
     def get_field_definition(self, field_name, record_type=""):
         """Find field_name in record_types definition and
         return the dictionary."""
-        for field in self.record_types[record_type]["fields"]:
-            if field["name"] == field_name:
-                return field
+        return self.schema(record_type).field_map.get(field_name, None)
 
     def get_field_columns(self, field_name, record_type=""):
         """Expand a field name (if necessary) into the constituent column names.
@@ -517,64 +1546,216 @@ class GDF2(object):
             the data table methods.
 
         """
-        field = self.get_field_definition(field_name, record_type=record_type)
-        if field is None and re.search(r"\[\d*\]$", field_name):
-            return (field_name,)
-        if field["cols"] == 1:
+        columns = self.schema(record_type).field_columns.get(field_name, None)
+        if columns is None and re.search(r"\[\d*\]$", field_name):
             return (field_name,)
-        else:
-            columns = []
-            for i in range(field["cols"]):
-                colname = "{}_{:d}".format(field_name, i) if self.clean_column_names else "{}[{:d}]".format(field_name, i)
-                columns.append(colname)
-            return tuple(columns)
+        if columns is None:
+            raise KeyError("No field named {}".format(field_name))
+        return columns
 
-    def get_fields_data(self, field_names, record_type=""):
+    @instrument.read_operation
+    def get_fields_data(
+        self, field_names, record_type="", where=None, line=None, bbox=None
+    ):
         """Return a tuple of ndarrays with the data for requested fields.
 
         Args:
             field_names (list-like): list of field names from
                 (must exist in `gdf.field_names()`)
             record_type (str):
+            where (dict): only read the records where each field has the
+                given value(s) - see ``GDF2.df``
+            line: shorthand for ``where={"LINE": line}``, for whichever
+                field is named LINE, line or Line.
+            bbox (tuple): only read the records inside ``(xmin, ymin, xmax,
+                ymax)`` - see ``GDF2.build_spatial_index``
 
         Returns: a tuple of ndarrays
 
-        """
-        columns = []
-        field_to_columns_mapping = {}
-        for field_name in field_names:
-            # Check to see if it is 1D or 2D
-            field = self.get_field_definition(field_name, record_type=record_type)
-            if field["cols"] == 1:
-                columns.append(field_name)
-                field_to_columns_mapping[field_name] = [field_name]
-            elif field["cols"] > 1:
-                field_columns = self.get_field_columns(
-                    field_name, record_type=record_type
-                )
-                columns += list(field_columns)
-                field_to_columns_mapping[field_name] = list(field_columns)
-        df = self.df(record_type=record_type, usecols=columns)
-        field_arrays = []
-        for field_name in field_names:
-            array = df[field_to_columns_mapping[field_name]].values
-            if isinstance(array, Array):
-                array.compute_chunk_sizes()
-            if array.shape[1] == 1:
-                array = array.ravel()
-            field_arrays.append(array)
-        return tuple(field_arrays)
+        The actual function called is ``PandasEngine.get_fields_data``,
+        ``DaskEngine.get_fields_data`` or ``NumpyEngine.get_fields_data``.
 
-    def get_field_data(self, field_name, record_type=""):
+        """
+        if line is not None:
+            where = dict(where or {})
+            where[self._line_field(record_type)] = line
+        return self.engine.get_fields_data(
+            field_names, record_type=record_type, where=where, bbox=bbox
+        )
+
+    @instrument.read_operation
+    def get_field_data(
+        self, field_name, record_type="", where=None, line=None, bbox=None
+    ):
         """Return the data for a field.
 
         This is simply a wrapper around ``GDF2.get_fields_data``.
 
         """
-        return self.get_fields_data([field_name], record_type=record_type)[0]
+        return self.get_fields_data(
+            [field_name], record_type=record_type, where=where, line=line, bbox=bbox
+        )[0]
+
+
+# Decimal digits which always survive a round trip through float32.
+FLOAT32_DIGITS = np.finfo(np.float32).precision
+
+
+def compact_dtype(field):
+    """Return the smallest dtype which holds every value of a field exactly.
+
+    The dtype is worked out from the field's format code:
+
+    - ``Fw.d`` fields are float32 if every value that fits in the field
+      has at most 6 significant digits (i.e. ``w <= 7``, allowing for the
+      decimal point), otherwise float64.
+    - ``Ew.d`` fields (which are otherwise read as text) are float32 if
+      d + 1 <= 6, otherwise float64.
+    - ``Iw`` fields use the smallest integer type for a w digit number. If
+      the field has a NULL value the nulls are read as NaN, so these are
+      float32 (w <= 6) or float64 instead.
+    - ``A`` fields are ``'category'``, as they usually hold a handful of
+      repeated values such as line or flight identifiers.
+
+    Other fields keep their usual dtype.
+
+    Args:
+        field (dict): field definition from ``GDF2.record_types``
+
+    """
+    m = re.match(r"[0-9]*([A-Z])([0-9]+)\.?([0-9]*)", field["format"].strip().upper())
+    if not m:
+        return field["inferred_dtype"]
+    code, width, decimals = m.group(1), int(m.group(2)), m.group(3)
+    if code in ("E", "D", "G") and decimals:
+        digits = int(decimals) + 1
+    elif code == "F":
+        digits = width - 1
+    elif code == "I":
+        if field["null"] is None:
+            for int_type in (np.int8, np.int16, np.int32, np.int64):
+                if 10 ** width - 1 <= np.iinfo(int_type).max:
+                    return int_type
+            return np.int64
+        digits = width
+    elif code == "A":
+        return "category"
+    else:
+        return field["inferred_dtype"]
+    return np.float32 if digits <= FLOAT32_DIGITS else np.float64
+
+
+def is_dask_dataframe(obj):
+    """Check for a dask DataFrame without importing dask."""
+    dd = sys.modules.get("dask.dataframe", None)
+    return not dd is None and isinstance(obj, dd.DataFrame)
+
+
+def clean_column_name(name):
+    """Clean a column name into an identifier-friendly form, e.g. for
+    namedtuple field names."""
+    new_name = re.sub(r"\W+", "_", name)
+    new_name = re.sub(r"^[\d_]+", "", new_name)
+    return new_name
+
+
+def concat_frames(frames, **kwargs):
+    """Concatenate DataFrames, keeping category columns as categories.
+
+    ``pd.concat`` turns category columns into object columns unless every
+    frame has the same categories.
+
+    """
+    frames = list(frames)
+    if len(frames) > 1:
+        for name, dtype in frames[0].dtypes.items():
+            if not isinstance(dtype, pd.CategoricalDtype):
+                continue
+            columns = [f[name] for f in frames]
+            if all(isinstance(c.dtype, pd.CategoricalDtype) for c in columns):
+                dtype = pd.CategoricalDtype(union_categoricals(columns).categories)
+                frames = [f.astype({name: dtype}) for f in frames]
+    return pd.concat(frames, **kwargs)
+
+
+ROW_KINDS = ("dict", "tuple", "record")
+
+
+def row_type(names):
+    """Create a namedtuple type for rows with the given column names.
+
+    Column names which are not valid identifiers (e.g. "Con[0]") are
+    renamed for attribute access, as in ``DataFrame.itertuples``, but every
+    column can be accessed by its original name with ``row[name]``.
+
+    """
+    base = namedtuple("Row", names, rename=True)
+    positions = {name: i for i, name in enumerate(names)}
+
+    class Row(base):
+        __slots__ = ()
+
+        def __getitem__(self, key):
+            if isinstance(key, str):
+                key = positions[key]
+            return tuple.__getitem__(self, key)
+
+    return Row
+
+
+def iter_chunk_rows(chunk, kind="dict", row_types=None):
+    """Iterate over the rows of a DataFrame chunk.
+
+    Args:
+        chunk (pandas.DataFrame)
+        kind (str): see ``GDF2.iterrows``
+        row_types (dict): cache of namedtuple types by column names, so
+            they are only created once per iteration
+
+    """
+    if kind == "record":
+        # Iterating a plain structured array is much faster than a recarray.
+        yield from chunk.rename_axis("Index").to_records().view(np.ndarray)
+        return
+    names = ("Index",) + tuple(chunk.columns)
+    values = [chunk.index.tolist()] + [chunk[c].tolist() for c in chunk.columns]
+    if kind == "tuple":
+        if row_types is None:
+            row_types = {}
+        if not names in row_types:
+            row_types[names] = row_type(names)
+        yield from map(row_types[names]._make, zip(*values))
+    else:
+        for row in chunk.itertuples():
+            yield dict(row._asdict())
+
+
+# Smallest byte range worth sending to a worker process.
+PARALLEL_MIN_BYTES = 2 ** 20
+
+
+def _parse_byte_range(func, filename, begin, end, kwargs, blocks=None):
+    data = compression.read_range(filename, begin, end, blocks)
+    if not data.strip():
+        return None
+    return func(io.BytesIO(data), **kwargs)
+
+
+def _read_partition(begin, end, start, func, filename, kwargs, meta, blocks=None):
+    df = _parse_byte_range(func, filename, begin, end, kwargs, blocks)
+    if df is None:
+        return meta
+    df.index = pd.RangeIndex(start, start + len(df))
+    return df
+
+
+# Keyword arguments to Engine.df which can be answered from the cache.
+CACHE_KWARGS = ("record_type", "usecols", "chunksize", "nrows")
 
 
 class Engine(ABC):
+    use_cache = True
+
     def __init__(self, parent):
         """Create reading engine.
 
@@ -584,12 +1765,17 @@ class Engine(ABC):
         """
         self.parent = parent
 
+    @instrument.timed("schema")
     def expand_field_names(self, record_type="", **kwargs):
-        names, namesdict = self.parent.column_names(record_type, retdict=True)
-        rt = self.parent._read_dat[record_type][self.__class__]
+        namesdict = self.parent.schema(record_type).names_dict
+        rt = self.parent._readers_for(record_type)[self.__class__]
         kws = dict(**rt["kwargs"])
         kws.update(kwargs)
-        logger.debug("df(kws=\n{})".format(pprint.pformat(kws)))
+        # The reader arguments are large for wide files, so only format
+        # them when they will be logged.
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug("df(kws=\n{})".format(pprint.pformat(kws)))
         if "usecols" in kws:
             logger.debug("initial usecols = {}".format(kws["usecols"]))
             for key in kws["usecols"]:
@@ -599,16 +1785,415 @@ class Engine(ABC):
                     for col_key in namesdict[key]:
                         kws["usecols"].append(col_key)
             logger.debug("final usecols = {}".format(kws["usecols"]))
-        logger.debug("final na_values = {}".format(kws["na_values"]))
+        if debug:
+            logger.debug("final na_values = {}".format(kws["na_values"]))
         return rt, kws
 
-    def df(self, **kwargs):
-        rt, kws = self.expand_field_names(**kwargs)
-        return rt["func"](*rt["args"], **kws)
+    def df(self, record_type="", **kwargs):
+        if self._needs_demux(record_type):
+            return self._record_type_df(record_type, **kwargs)
+        rt, kws = self.expand_field_names(record_type=record_type, **kwargs)
+        if self.parent.cache and self.use_cache and set(kwargs) <= set(CACHE_KWARGS):
+            return self._read_cache(rt, kws)
+        return self._parse_file(rt, kws)
+
+    def _parse_file(self, rt, kws):
+        compressed = compression.compression_of(self.parent.dat_filename)
+        if compressed and rt["func"] in (pd.read_fwf, pd.read_table):
+            # pandas does not infer the compression for read_fwf.
+            kws = dict(kws, compression=compressed)
+        with instrument.stage("parse") as stage:
+            df = rt["func"](*rt["args"], **kws)
+            if isinstance(df, pd.DataFrame):
+                stage.bytes = os.path.getsize(self.parent.dat_filename)
+                stage.rows = len(df)
+        return df
+
+    def _needs_demux(self, record_type=""):
+        """Check whether lines must be routed by record type before parsing."""
+        return bool(record_type) or bool(self.parent.tagged_record_types)
+
+    def _parse_kwargs(self, record_type="", **kwargs):
+        """Return the reader and keyword arguments for parsing bytes."""
+        return self.expand_field_names(record_type=record_type, **kwargs)
+
+    def _from_pandas(self, df):
+        return df
+
+    def read_record_types(self, record_types=None, **kwargs):
+        """Read several record types in a single pass.
+
+        See ``GDF2.read_record_types``.
+
+        """
+        tags = self.parent.record_type_tags
+        if record_types is None:
+            record_types = [""] + list(tags)
+        for record_type in record_types:
+            if record_type and not record_type in tags:
+                raise KeyError("No record type {}".format(record_type))
+        if "" in record_types:
+            rt, kws = self._parse_kwargs(**kwargs)
+        frames = {record_type: [] for record_type in record_types}
+        for record_type, data in self.parent._iter_record_type_blocks(record_types):
+            if record_type:
+                frames[record_type].append(
+                    self.parent._record_type_frame(record_type, data)
+                )
+            else:
+                frames[""].append(self._parse_bytes(rt, kws, data, 0))
+        result = {}
+        for record_type in record_types:
+            if record_type:
+                df = frames[record_type][0]
+                self.parent._record_type_frames[record_type] = df
+            elif frames[""]:
+                df = concat_frames(frames[""], ignore_index=True)
+            else:
+                df = self._parse_bytes(rt, kws, b"", 0)
+            result[record_type] = self._from_pandas(df)
+        return result
+
+    def _record_type_df(self, record_type="", **kwargs):
+        """Read one record type of a file with several record types."""
+        chunksize = kwargs.pop("chunksize", None)
+        nrows = kwargs.pop("nrows", None)
+        kwargs.pop("blocksize", None)
+        if record_type:
+            frames = self.parent._record_type_frames
+            if not record_type in frames:
+                self.read_record_types(list(self.parent.record_type_tags))
+            rt, kws = self.expand_field_names(record_type=record_type, **kwargs)
+            df = frames[record_type]
+            if "usecols" in kws:
+                df = df[[c for c in kws["names"] if c in kws["usecols"]]]
+        else:
+            # Keep the tagged record types while the file is being read.
+            record_types = [""] + list(self.parent.record_type_tags)
+            df = self.read_record_types(record_types, **kwargs)[""]
+            if is_dask_dataframe(df):
+                df = df.compute()
+        if not nrows is None:
+            df = df.iloc[:nrows]
+        if chunksize:
+            return (
+                self._from_pandas(df.iloc[i : i + chunksize])
+                for i in range(0, len(df), chunksize)
+            )
+        return self._from_pandas(df)
+
+    def _read_cache(self, rt, kws):
+        cache = self.parent._column_cache
+        if not cache.is_valid():
+            logger.info("Building cache {}".format(cache.path))
+            full_kws = {k: v for k, v in kws.items() if not k in CACHE_KWARGS}
+            data = self._parse_file(rt, full_kws)
+            try:
+                with instrument.stage("cache", rows=len(data)):
+                    cache.write(data)
+            except OSError as e:
+                logger.warning("Unable to write cache {}: {}".format(cache.path, e))
+                return self._parse_file(rt, kws)
+        with instrument.stage("cache") as stage:
+            df = cache.read(
+                usecols=kws.get("usecols", None),
+                chunksize=kws.get("chunksize", None),
+                nrows=kws.get("nrows", None),
+            )
+            if isinstance(df, pd.DataFrame):
+                stage.rows = len(df)
+        return df
+
+    def field_columns(self, field_names, record_type=""):
+        """Map each field name to the list of its column names."""
+        field_to_columns_mapping = {}
+        for field_name in field_names:
+            # Check to see if it is 1D or 2D
+            field = self.parent.get_field_definition(field_name, record_type=record_type)
+            if field["cols"] == 1:
+                field_to_columns_mapping[field_name] = [field_name]
+            elif field["cols"] > 1:
+                field_columns = self.parent.get_field_columns(
+                    field_name, record_type=record_type
+                )
+                field_to_columns_mapping[field_name] = list(field_columns)
+        return field_to_columns_mapping
+
+    def rows(self, start, stop, record_type="", **kwargs):
+        """Return records start to stop as a DataFrame.
+
+        See ``GDF2.rows``.
+
+        """
+        rt, kws = self.expand_field_names(record_type=record_type, **kwargs)
+        if self.parent.cache and self.use_cache and set(kwargs) <= set(CACHE_KWARGS):
+            cache = self.parent._column_cache
+            if cache.is_valid():
+                with instrument.stage("cache", rows=stop - start):
+                    return cache.rows(start, stop, usecols=kws.get("usecols", None))
+        data = self.parent._read_record_bytes(start, stop)
+        return self._parse_bytes(rt, kws, data, start)
+
+    def _parse_bytes(self, rt, kws, data, start):
+        if not data.strip():
+            usecols = kws.get("usecols", None)
+            columns = [n for n in kws["names"] if usecols is None or n in usecols]
+            dtypes = kws.get("dtype", {})
+            return pd.DataFrame(
+                columns=columns, index=pd.RangeIndex(start, start)
+            ).astype({c: dtypes[c] for c in columns if c in dtypes})
+        with instrument.stage("parse", bytes=len(data)) as stage:
+            df = rt["func"](io.BytesIO(data), **kws)
+            stage.rows = len(df)
+        df.index = pd.RangeIndex(start, start + len(df))
+        return df
+
+    def parallel_df(self, workers, record_type="", **kwargs):
+        """Parse the data table in a pool of worker processes.
+
+        See ``GDF2.df``.
+
+        """
+        if "chunksize" in kwargs or "nrows" in kwargs:
+            raise ValueError("chunksize and nrows cannot be used with workers")
+        if (self.parent.cache and self.use_cache) or self._needs_demux(record_type):
+            return self.df(record_type=record_type, **kwargs)
+        rt, kws = self.expand_field_names(record_type=record_type, **kwargs)
+        size = os.path.getsize(self.parent.dat_filename)
+        nparts = max(1, min(workers * 4, size // PARALLEL_MIN_BYTES))
+        ranges = self.parent._byte_ranges(nparts)
+        blocks = self._blocks()
+        logger.debug("Parsing {} byte ranges with {} workers".format(len(ranges), workers))
+        with instrument.stage("parse", bytes=size) as stage:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                frames = list(
+                    pool.map(
+                        _parse_byte_range,
+                        repeat(rt["func"]),
+                        repeat(self.parent.dat_filename),
+                        [r[0] for r in ranges],
+                        [r[1] for r in ranges],
+                        repeat(kws),
+                        repeat(blocks),
+                    )
+                )
+            frames = [f for f in frames if f is not None]
+            stage.rows = sum(len(f) for f in frames)
+        if not frames:
+            return self._parse_bytes(rt, kws, b"", 0)
+        return concat_frames(frames, ignore_index=True)
+
+    def parallel_iterchunks(
+        self, workers, chunksize=100000, fields=None, record_type="", kind="dict"
+    ):
+        """Parse blocks of the data table in a pool of worker processes.
+
+        See ``GDF2.iterchunks``.
+
+        """
+        if (
+            (self.parent.cache and self.use_cache)
+            or record_type
+            or self._needs_demux(record_type)
+        ):
+            yield from self.iterchunks(
+                chunksize=chunksize, fields=fields, record_type=record_type, kind=kind
+            )
+            return
+        if fields is None:
+            fields = self.parent.field_names(record_type)
+        field_to_columns_mapping = self.field_columns(fields, record_type)
+        columns = [c for f in fields for c in field_to_columns_mapping[f]]
+        rt, kws = self.expand_field_names(record_type=record_type, usecols=columns)
+        index = self.parent.record_index
+        starts = list(range(0, index.nrecords, chunksize))
+        offsets = [index.offset(start) for start in starts] + [
+            index.offset(index.nrecords)
+        ]
+
+        def result(start, nbytes, future):
+            with instrument.stage("parse", bytes=nbytes) as stage:
+                chunk = future.result()
+                stage.rows = 0 if chunk is None else len(chunk)
+            if chunk is None:
+                return None
+            chunk.index = pd.RangeIndex(start, start + len(chunk))
+            if kind == "dataframe":
+                return chunk
+            return self._chunk_arrays(chunk, fields, field_to_columns_mapping)
+
+        # Keep at most two blocks per worker in flight so that memory use
+        # stays bounded when the consumer is slower than the parsing.
+        pending = deque()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for start, begin, end in zip(starts, offsets[:-1], offsets[1:]):
+                future = pool.submit(
+                    _parse_byte_range,
+                    rt["func"],
+                    self.parent.dat_filename,
+                    begin,
+                    end,
+                    kws,
+                    index.blocks,
+                )
+                pending.append((start, end - begin, future))
+                if len(pending) >= workers * 2:
+                    chunk = result(*pending.popleft())
+                    if chunk is not None:
+                        yield chunk
+            while pending:
+                chunk = result(*pending.popleft())
+                if chunk is not None:
+                    yield chunk
+
+    def select(self, where=None, rows=None, record_type="", bbox=None, **kwargs):
+        """Return the records matching where and inside bbox as a DataFrame.
+
+        See ``GDF2.df``, ``GDF2.build_index`` and ``GDF2.build_spatial_index``.
+
+        """
+        ranges = self.parent._where_ranges(
+            where, rows=rows, record_type=record_type, bbox=bbox
+        )
+        if not ranges:
+            ranges = [(0, 0)]
+        if bbox is None:
+            return self._read_ranges(ranges, record_type=record_type, **kwargs)
+
+        # The grid cells overlapping bbox also hold records outside it, so
+        # the coordinates are read as well to filter the records exactly.
+        index = self.parent.spatial_index()
+        x = self.parent.get_field_columns(index.x_field, record_type)[0]
+        y = self.parent.get_field_columns(index.y_field, record_type)[0]
+        usecols = kwargs.get("usecols", None)
+        extra = []
+        if usecols is not None:
+            extra = [c for c in (x, y) if not c in usecols]
+            kwargs["usecols"] = list(usecols) + extra
+        df = self._read_ranges(ranges, record_type=record_type, **kwargs)
+        xmin, ymin, xmax, ymax = bbox
+        inside = (df[x] >= xmin) & (df[x] <= xmax) & (df[y] >= ymin) & (df[y] <= ymax)
+        df = df[inside]
+        if extra:
+            df = df.drop(columns=extra)
+        return df
+
+    def _read_ranges(self, ranges, record_type="", **kwargs):
+        """Read sorted ranges of records as one DataFrame.
+
+        The bytes of every range are gathered and parsed in a single call,
+        rather than once per range, and the DataFrame is indexed by record
+        number.
+
+        """
+        if len(ranges) == 1 or (self.parent.cache and self.use_cache):
+            return self.concat(
+                [
+                    self.rows(start, stop, record_type=record_type, **kwargs)
+                    for start, stop in ranges
+                ]
+            )
+        rt, kws = self.expand_field_names(record_type=record_type, **kwargs)
+        record_index = self.parent.record_index
+        offsets = [
+            (record_index.offset(start), record_index.offset(stop))
+            for start, stop in ranges
+        ]
+        blocks = []
+        with instrument.stage("read") as stage:
+            for data in compression.read_ranges(
+                self.parent.dat_filename, offsets, record_index.blocks
+            ):
+                if data and not data.endswith(b"\n"):
+                    data += b"\n"
+                blocks.append(data)
+            stage.bytes = sum(len(data) for data in blocks)
+        df = self._parse_bytes(rt, kws, b"".join(blocks), 0)
+        df.index = pd.Index(
+            np.concatenate([np.arange(start, stop) for start, stop in ranges])
+        )
+        return df
+
+    def concat(self, frames):
+        return concat_frames(frames)
+
+    def arrow_dtypes(self, df):
+        """Convert a DataFrame to pyarrow-backed dtypes, see ``GDF2.df``."""
+        return columnar.arrow_dtypes(df)
+
+    def get_fields_data(self, field_names, record_type="", where=None, bbox=None):
+        """Return a tuple of ndarrays with the data for requested fields.
+
+        See ``GDF2.get_fields_data``.
+
+        """
+        field_to_columns_mapping = self.field_columns(field_names, record_type)
+        columns = []
+        for field_name in field_names:
+            columns += field_to_columns_mapping[field_name]
+        if where is None and bbox is None:
+            df = self.df(record_type=record_type, usecols=columns)
+        else:
+            df = self.select(
+                where, record_type=record_type, bbox=bbox, usecols=columns
+            )
+        field_arrays = []
+        for field_name in field_names:
+            array = self._to_array(df[field_to_columns_mapping[field_name]])
+            if array.shape[1] == 1:
+                array = array.ravel()
+            field_arrays.append(array)
+        return tuple(field_arrays)
+
+    def _to_array(self, df):
+        return df.values
+
+    def iterchunks(self, chunksize=100000, fields=None, record_type="", kind="dict"):
+        """Iterate over blocks of the data table. See ``GDF2.iterchunks``."""
+        if fields is None:
+            fields = self.parent.field_names(record_type)
+        field_to_columns_mapping = self.field_columns(fields, record_type)
+        columns = [c for f in fields for c in field_to_columns_mapping[f]]
+        chunks = self._iter_dataframes(chunksize, record_type, columns)
+        for chunk in self._timed_chunks(chunks, record_type):
+            if kind == "dataframe":
+                yield chunk
+            else:
+                yield self._chunk_arrays(chunk, fields, field_to_columns_mapping)
+
+    def _iter_dataframes(self, chunksize, record_type, columns):
+        return self.df(record_type=record_type, usecols=columns, chunksize=chunksize)
+
+    def _blocks(self):
+        """Return the block index of a compressed .dat file, or None."""
+        if compression.compression_of(self.parent.dat_filename):
+            return self.parent.record_index.blocks
+        return None
+
+    def _timed_chunks(self, chunks, record_type=""):
+        """Time parsing each chunk from a reader made by ``df(chunksize=...)``."""
+        if self.parent.cache and self.use_cache:
+            return instrument.timed_iter(chunks, "cache")
+        if self._needs_demux(record_type):
+            # The chunks are sliced from a table which was parsed by df().
+            return chunks
+        size = os.path.getsize(self.parent.dat_filename)
+        return instrument.timed_iter(chunks, "parse", bytes=size)
+
+    @staticmethod
+    def _chunk_arrays(chunk, fields, field_to_columns_mapping):
+        arrays = {}
+        for field_name in fields:
+            field_columns = field_to_columns_mapping[field_name]
+            if len(field_columns) == 1:
+                arrays[field_name] = chunk[field_columns[0]].to_numpy()
+            else:
+                arrays[field_name] = chunk[field_columns].to_numpy()
+        return arrays
 
     @abstractmethod
-    def iterrows(self, *args, **kwargs):
-        """Iterate over rows of the data table. Each row is a dict."""
+    def iterrows(self, *args, kind="dict", **kwargs):
+        """Iterate over rows of the data table. See ``GDF2.iterrows``."""
         pass
 
 
@@ -616,23 +2201,295 @@ class PandasEngine(Engine):
     read_fwf = pd.read_fwf
     read_table = pd.read_table
 
-    def iterrows(self, *args, **kwargs):
+    def iterrows(self, *args, kind="dict", **kwargs):
         kwargs.setdefault("chunksize", 5000)
 
-        for chunk in self.df(*args, **kwargs):
-            for row in chunk.itertuples():
-                yield dict(row._asdict())
+        row_types = {}
+        chunks = self.df(*args, **kwargs)
+        for chunk in self._timed_chunks(chunks, kwargs.get("record_type", "")):
+            yield from iter_chunk_rows(chunk, kind, row_types)
 
 
 class DaskEngine(Engine):
-    read_fwf = dd.read_fwf
-    read_table = dd.read_table
+    # Loading the cache would pull the whole table into memory.
+    use_cache = False
+
+    # dask is imported by the methods of this engine rather than at the top
+    # of the module, as it takes longer to import than everything else.
+
+    @staticmethod
+    def read_fwf(*args, **kwargs):
+        from dask import dataframe as dd
+
+        return dd.read_fwf(*args, **kwargs)
+
+    @staticmethod
+    def read_table(*args, **kwargs):
+        from dask import dataframe as dd
+
+        return dd.read_table(*args, **kwargs)
+
+    def df(self, record_type="", blocksize="64MB", **kwargs):
+        """Return the data table as a dask DataFrame.
+
+        Partitions are cut on record boundaries found with
+        ``GDF2.record_index``, so every partition has a known number of
+        records and the index has known divisions: ``.loc`` only reads the
+        partitions it needs.
+
+        Args:
+            blocksize (str or int): approximate size of each partition
+
+        """
+        if self._needs_demux(record_type) or "chunksize" in kwargs or "nrows" in kwargs:
+            return super().df(record_type=record_type, **kwargs)
+        ddf, lengths = self._partitioned_df(record_type, blocksize, **kwargs)
+        return ddf
+
+    def _partitioned_df(self, record_type="", blocksize="64MB", **kwargs):
+        """Return the data table and the number of records in each partition."""
+        import dask
+        from dask import dataframe as dd
+
+        rt, kws = self._parse_kwargs(record_type=record_type, **kwargs)
+        filename = self.parent.dat_filename
+        index = self.parent.record_index
+        nrecords = index.nrecords
+        if isinstance(blocksize, str):
+            blocksize = dask.utils.parse_bytes(blocksize)
+        nparts = max(1, min(nrecords, -(-index.size // blocksize)))
+        starts = [nrecords * i // nparts for i in range(nparts)] + [nrecords]
+        offsets = [index.offset(n) for n in starts]
+        meta = self._parse_bytes(
+            rt, kws, self.parent._read_record_bytes(0, min(1, nrecords)), 0
+        ).iloc[:0]
+        ddf = dd.from_map(
+            _read_partition,
+            offsets[:-1],
+            offsets[1:],
+            starts[:-1],
+            args=(rt["func"], filename, kws, meta, index.blocks),
+            meta=meta,
+            divisions=starts[:-1] + [max(nrecords - 1, 0)],
+            label="read-gdf2",
+        )
+        return ddf, list(np.diff(starts))
+
+    def get_fields_data(self, field_names, record_type="", where=None, bbox=None):
+        """Return a tuple of dask arrays with the data for requested fields.
+
+        The arrays have known chunk sizes from the record index, so their
+        shapes are available without computing anything.
+
+        """
+        if where is not None or bbox is not None or self._needs_demux(record_type):
+            return super().get_fields_data(
+                field_names, record_type=record_type, where=where, bbox=bbox
+            )
+        field_to_columns_mapping = self.field_columns(field_names, record_type)
+        columns = []
+        for field_name in field_names:
+            columns += field_to_columns_mapping[field_name]
+        ddf, lengths = self._partitioned_df(record_type, usecols=columns)
+        field_arrays = []
+        for field_name in field_names:
+            array = ddf[field_to_columns_mapping[field_name]].to_dask_array(
+                lengths=lengths
+            )
+            if array.shape[1] == 1:
+                array = array.ravel()
+            field_arrays.append(array)
+        return tuple(field_arrays)
 
-    def iterrows(self, *args, **kwargs):
+    def _to_array(self, df):
+        from dask.array import Array
+
+        array = df.values
+        if isinstance(array, Array):
+            array.compute_chunk_sizes()
+        return array
+
+    def rows(self, start, stop, record_type="", **kwargs):
+        """Return records start to stop as a single-partition dask DataFrame.
+
+        The byte range is small enough to parse directly with pandas.
+
+        """
+        rt, kws = self._parse_kwargs(record_type=record_type, **kwargs)
+        data = self.parent._read_record_bytes(start, stop)
+        return self._from_pandas(self._parse_bytes(rt, kws, data, start))
+
+    def _parse_kwargs(self, record_type="", **kwargs):
+        """Return the pandas reader and keyword arguments for parsing bytes."""
+        rt, kws = self.expand_field_names(record_type=record_type, **kwargs)
+        pandas_rt = self.parent._readers_for(record_type)[PandasEngine]
+        pandas_kws = dict(pandas_rt["kwargs"])
+        pandas_kws.update({k: v for k, v in kws.items() if not k == "blocksize"})
+        return pandas_rt, pandas_kws
+
+    def _from_pandas(self, df):
+        from dask import dataframe as dd
+
+        return dd.from_pandas(df, npartitions=1)
+
+    def concat(self, frames):
+        from dask import dataframe as dd
+
+        return dd.concat(frames)
+
+    def _read_ranges(self, ranges, record_type="", **kwargs):
+        return self.concat(
+            [
+                self.rows(start, stop, record_type=record_type, **kwargs)
+                for start, stop in ranges
+            ]
+        )
+
+    def arrow_dtypes(self, df):
+        return df.map_partitions(columnar.arrow_dtypes)
+
+    def parallel_df(self, workers, **kwargs):
+        """Return the lazy dask DataFrame; workers is left to dask's scheduler."""
+        logger.info("workers is ignored by the dask engine")
+        return self.df(**kwargs)
+
+    def parallel_iterchunks(self, workers, **kwargs):
+        logger.info("workers is ignored by the dask engine")
+        return self.iterchunks(**kwargs)
+
+    def _iter_dataframes(self, chunksize, record_type, columns):
+        ddf = self.df(record_type=record_type, usecols=columns, blocksize="64MB")
+        for part in ddf.to_delayed():
+            # Computing the partition is timed by _timed_chunks.
+            chunk = part.compute()
+            for i in range(0, len(chunk), chunksize):
+                yield chunk.iloc[i : i + chunksize]
+
+    def iterrows(self, *args, kind="dict", **kwargs):
         kwargs.setdefault("blocksize", "64MB")
 
+        row_types = {}
         for part in self.df(*args, **kwargs).to_delayed():
-            chunk = part.compute()
+            with instrument.stage("parse") as stage:
+                chunk = part.compute()
+                stage.rows = len(chunk)
+            yield from iter_chunk_rows(chunk, kind, row_types)
+
+
+class NumpyEngine(PandasEngine):
+    """Decode fixed-width .dat files straight into NumPy arrays.
+
+    With ``method='fixed-widths'`` each record is sliced into columns using
+    the widths from the .dfn file, skipping pandas' tokenizer entirely. With
+    ``method='whitespace'`` there are no byte offsets to slice on, so it
+    falls back to ``pd.read_table``.
 
-            for row in chunk.itertuples():
-                yield dict(row._asdict())
+    """
+
+    read_fwf = fixed_width.read_fwf
+    read_table = pd.read_table
+
+    def get_fields_data(self, field_names, record_type="", where=None, bbox=None):
+        """Return a tuple of ndarrays with the data for requested fields.
+
+        For fixed-width files only the byte range of each requested field
+        is decoded, and the columns of a 2D field are decoded together as
+        one block, so reading one channel of a wide file costs roughly in
+        proportion to the bytes it needs. Otherwise this is the same as
+        ``PandasEngine.get_fields_data``.
+
+        """
+        if (
+            self.parent.method != "fixed-widths"
+            or self.parent.cache
+            or where
+            or bbox is not None
+            or self._needs_demux(record_type)
+        ):
+            return super().get_fields_data(
+                field_names, record_type=record_type, where=where, bbox=bbox
+            )
+        reader = self.parent._fixed_width_reader(record_type)
+        field_to_columns_mapping = self.field_columns(field_names, record_type)
+        columns = [c for cols in field_to_columns_mapping.values() for c in cols]
+        if not reader.is_fixed or not all(c in reader._index for c in columns):
+            return super().get_fields_data(field_names, record_type=record_type)
+        table = fixed_width.MemmapTable(reader)
+        field_arrays = []
+        for field_name in field_names:
+            names = field_to_columns_mapping[field_name]
+            column = fixed_width.MemmapColumn(table, names)
+            with instrument.stage("parse", rows=len(table)) as stage:
+                field_arrays.append(column[:])
+                stage.bytes = len(table) * self._columns_width(reader, names)
+        return tuple(field_arrays)
+
+    @staticmethod
+    def _columns_width(reader, names):
+        return sum(reader.widths[reader._index[name]] for name in names)
+
+    def rows(self, start, stop, record_type="", **kwargs):
+        """Return records start to stop as a DataFrame.
+
+        For fixed-width files the records are decoded directly from their
+        byte range. Otherwise this is the same as ``PandasEngine.rows``.
+
+        """
+        if self.parent.method != "fixed-widths" or self.parent.cache:
+            return super().rows(start, stop, record_type=record_type, **kwargs)
+        rt, kws = self.expand_field_names(record_type=record_type, **kwargs)
+        reader = self.parent._fixed_width_reader(record_type)
+        if reader.is_fixed:
+            with instrument.stage("read") as stage:
+                records = reader.records(start, stop)
+                stage.bytes = records.nbytes
+        else:
+            data = self.parent._read_record_bytes(start, stop)
+            records = reader.lines_to_records(data.splitlines())
+        with instrument.stage("parse", bytes=records.nbytes, rows=len(records)):
+            return reader.frame(
+                records,
+                usecols=kws.get("usecols", None),
+                index=pd.RangeIndex(start, start + len(records)),
+            )
+
+    def iterchunks(self, chunksize=100000, fields=None, record_type="", kind="dict"):
+        """Iterate over blocks of the data table. See ``GDF2.iterchunks``.
+
+        For fixed-width files each block is decoded straight from the
+        memory-mapped file, and only the byte ranges of the requested
+        fields are decoded.
+
+        """
+        reader = None
+        if (
+            self.parent.method == "fixed-widths"
+            and not self.parent.cache
+            and not self._needs_demux(record_type)
+        ):
+            reader = self.parent._fixed_width_reader(record_type)
+        if reader is None or not reader.is_fixed:
+            yield from super().iterchunks(
+                chunksize=chunksize, fields=fields, record_type=record_type, kind=kind
+            )
+            return
+        if fields is None:
+            fields = self.parent.field_names(record_type)
+        field_to_columns_mapping = self.field_columns(fields, record_type)
+        columns = [c for f in fields for c in field_to_columns_mapping[f]]
+        table = fixed_width.MemmapTable(reader)
+        width = self._columns_width(reader, columns)
+        for i in range(0, len(table), chunksize):
+            key = slice(i, min(i + chunksize, len(table)))
+            nrows = key.stop - key.start
+            with instrument.stage("parse", bytes=nrows * width, rows=nrows):
+                if kind == "dataframe":
+                    chunk = table.frame(key, usecols=columns)
+                else:
+                    chunk = {}
+                    for field_name in fields:
+                        column = fixed_width.MemmapColumn(
+                            table, field_to_columns_mapping[field_name]
+                        )
+                        chunk[field_name] = column[key]
+            yield chunk
@@ -0,0 +1,903 @@
+"""Record count, line-offset and field value indexes for .dat files.
+
+For files where every record has the same byte length the position of any
+record is simply ``n * record_length``. Checking that every record has that
+length reads the file once, and the record length is then kept in a small
+sidecar file next to the .dat. For other files the byte offset of every
+``stride``-th line is found with a single bytes-level scan and kept in the
+sidecar file instead, so that later sessions can count records and seek to
+any record without scanning the file again.
+
+A field index records the runs of consecutive records which share a value
+of one field (e.g. a line number), so that a subset of the survey can be
+read without scanning the whole file. A spatial index does the same for
+the grid cells of the records' coordinates.
+
+"""
+import logging
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from aseg_gdf2 import compression, fixed_width
+from aseg_gdf2 import instrument
+
+logger = logging.getLogger(__name__)
+
+NEWLINE = ord(b"\n")
+SPACE = ord(b" ")
+
+# Version of the sidecar line-offset index. Indexes from older versions
+# counted blank lines as records, so are built again.
+INDEX_VERSION = 2
+
+
+def index_filename(dat_filename):
+    """Return the filename of the sidecar index for a .dat file."""
+    return dat_filename + ".index.npz"
+
+
+def _iter_blocks(filename, blocksize, start=0):
+    with open(filename, "rb") as f:
+        f.seek(start)
+        while True:
+            block = f.read(blocksize)
+            if not block:
+                break
+            yield block
+
+
+def scan_line_offsets(
+    filename, stride=256, blocksize=2 ** 24, members=None, start=0
+):
+    """Scan a file for the byte offset of every stride-th record.
+
+    Each line which is not blank is a record. Blank lines (empty, or only
+    whitespace) are skipped, as they are by pandas and by
+    :class:`aseg_gdf2.fixed_width.FixedWidthReader`, so that record
+    numbers match the row positions of ``GDF2.df()``.
+
+    Compressed files are decompressed as they are scanned, and the offsets
+    are those in the decompressed contents.
+
+    Args:
+        filename (str): file to scan
+        stride (int): keep the offset of every stride-th record
+        blocksize (int): number of bytes to read at a time
+        members (list): for compressed files, filled with the offsets of
+            each compressed member - see
+            :func:`aseg_gdf2.compression.iter_decompressed`
+        start (int): byte offset of the line to start from, for files which
+            are not compressed. Records are counted from there.
+
+    Returns: a tuple ``(offsets, nlines)`` where offsets is an int64 array
+        with the byte offset of records 0, stride, 2 * stride, ... and
+        nlines is the total number of records, including a last line with
+        no line terminator.
+
+    """
+    if compression.compression_of(filename) is None:
+        blocks = _iter_blocks(filename, blocksize, start)
+    else:
+        blocks = compression.iter_decompressed(filename, members=members)
+        start = 0
+    offsets = []
+    nlines = 0
+    # Start of the line which the previous block ended in the middle of,
+    # and whether any of it so far is not whitespace.
+    line_start = start
+    filled = False
+    position = start
+    for block in blocks:
+        data = np.frombuffer(block, dtype=np.uint8)
+        newlines = np.flatnonzero(data == NEWLINE)
+        starts = np.concatenate([[0], newlines + 1])
+        starts = starts[starts < len(data)]
+        # Whether each line (or part of a line) in the block has any bytes
+        # other than whitespace and control characters.
+        has_text = np.logical_or.reduceat(data > SPACE, starts)
+        n = len(newlines)
+        if n:
+            line_starts = starts[:n].astype(np.int64) + position
+            line_starts[0] = line_start
+            is_record = has_text[:n]
+            is_record[0] |= filled
+            records = line_starts[is_record]
+            offsets.append(records[(-nlines) % stride :: stride])
+            nlines += len(records)
+            line_start = position + len(data)
+            filled = False
+        if len(starts) > n:
+            # The block ends in the middle of a line.
+            if n:
+                line_start = position + int(starts[n])
+            filled = filled or bool(has_text[n])
+        position += len(data)
+    if filled:
+        # A last line with no line terminator.
+        if not nlines % stride:
+            offsets.append(np.array([line_start], dtype=np.int64))
+        nlines += 1
+    if not offsets:
+        return np.zeros(0, dtype=np.int64), nlines
+    return np.concatenate(offsets), nlines
+
+
+def scan_line_prefixes(filename, prefixes, blocksize=2 ** 24):
+    """Scan a file for lines which begin with any of a list of prefixes.
+
+    Args:
+        filename (str): file to scan
+        prefixes (list): prefixes to look for, as bytes
+        blocksize (int): number of bytes to read at a time
+
+    Returns: a set of the prefixes which begin at least one line.
+
+    """
+    found = set()
+    remaining = list(prefixes)
+    longest = max([len(p) for p in prefixes] + [1])
+    with compression.open_file(filename) as f:
+        # Keep enough of the previous block to find a prefix split across
+        # two blocks; the file starts as if after a newline.
+        tail = b"\n"
+        while remaining:
+            block = f.read(blocksize)
+            if not block:
+                break
+            data = tail + block
+            for prefix in list(remaining):
+                if b"\n" + prefix in data:
+                    found.add(prefix)
+                    remaining.remove(prefix)
+            tail = data[-longest:]
+    return found
+
+
+class RecordIndex(object):
+    """Record count and byte offsets of the records of a .dat file.
+
+    Use :meth:`RecordIndex.open` rather than creating one directly.
+
+    Arguments:
+        filename (str): the .dat file
+        nrecords (int): number of records (lines which are not blank) in the
+            file
+        record_length (int): byte length of each record including the line
+            terminator, for files with fixed-length records
+        offsets (ndarray): byte offset of every stride-th record, for files
+            without fixed-length records
+        stride (int): see offsets
+        size (int): size of the file when the index was built
+        mtime_ns (int): modification time of the file when the index was built
+        data_size (int): size of the decompressed contents of a compressed
+            file - the same as size by default
+        blocks (aseg_gdf2.compression.BlockIndex): where each member of a
+            compressed file starts
+
+    """
+
+    def __init__(
+        self,
+        filename,
+        nrecords,
+        record_length=None,
+        offsets=None,
+        stride=None,
+        size=None,
+        mtime_ns=None,
+        data_size=None,
+        blocks=None,
+    ):
+        self.filename = filename
+        self.nrecords = nrecords
+        self.record_length = record_length
+        self.offsets = offsets
+        self.stride = stride
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.data_size = size if data_size is None else data_size
+        self.blocks = blocks
+
+    def __len__(self):
+        return self.nrecords
+
+    def __repr__(self):
+        return "<{}.{} {} nrecords={}>".format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            self.filename,
+            self.nrecords,
+        )
+
+    @property
+    def is_fixed(self):
+        return self.record_length is not None
+
+    @classmethod
+    def open(cls, filename, min_length=0, stride=256, sidecar=True, previous=None):
+        """Load the index for a .dat file, building it if necessary.
+
+        Files with fixed-length records are checked for a line terminator
+        at every record boundary (see
+        :func:`aseg_gdf2.fixed_width.detect_record_length`) the first time,
+        and after that the record length is loaded from the sidecar file
+        too. If the file has only grown since an index was saved (e.g. it
+        is still being written), just the appended lines or records are
+        checked - see ``RecordIndex.extend``.
+
+        Args:
+            filename (str): the .dat file
+            min_length (int): minimum bytes per record for the file to be
+                treated as having fixed-length records - see
+                :func:`aseg_gdf2.fixed_width.detect_record_length`
+            stride (int): keep the offset of every stride-th line when
+                the records are not fixed-length
+            sidecar (bool): load and save the line-offset index from a
+                sidecar file next to the .dat file
+            previous (RecordIndex): an earlier index of the file to extend,
+                rather than the one in the sidecar file
+
+        Returns: :class:`aseg_gdf2.index.RecordIndex`
+
+        """
+        if previous is None and sidecar:
+            previous = cls.load(filename, current=False)
+        if previous is not None and previous.is_fixed:
+            if previous.record_length <= min_length:
+                previous = None
+        elif previous is not None and previous.stride != stride:
+            previous = None
+        index = None
+        if previous is not None:
+            if previous.is_current():
+                return previous
+            index = previous.extend()
+        if index is None:
+            record_length, eol = fixed_width.detect_record_length(
+                filename, min_length=min_length
+            )
+            if record_length is None:
+                index = cls.build(filename, stride=stride)
+            else:
+                index = cls.fixed(filename, record_length)
+        if sidecar:
+            try:
+                index.save()
+            except OSError as e:
+                logger.warning("Unable to save index for {}: {}".format(filename, e))
+        return index
+
+    @classmethod
+    def fixed(cls, filename, record_length):
+        """Create the index of a .dat file with fixed-length records."""
+        stat = os.stat(filename)
+        return cls(
+            filename,
+            -(-stat.st_size // record_length),
+            record_length=record_length,
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+        )
+
+    @classmethod
+    def build(cls, filename, stride=256):
+        """Scan a .dat file and build a line-offset index."""
+        stat = os.stat(filename)
+        members = None
+        if compression.compression_of(filename):
+            members = []
+        with instrument.stage("index", bytes=stat.st_size):
+            offsets, nrecords = scan_line_offsets(
+                filename, stride=stride, members=members
+            )
+        data_size = None
+        blocks = None
+        if not members is None:
+            blocks = compression.BlockIndex.from_members(members)
+            data_size = blocks.size
+        return cls(
+            filename,
+            nrecords,
+            offsets=offsets,
+            stride=stride,
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+            data_size=data_size,
+            blocks=blocks,
+        )
+
+    @classmethod
+    def load(cls, filename, current=True):
+        """Load an index from its sidecar file.
+
+        Args:
+            filename (str): the .dat file
+            current (bool): return None if the .dat file has changed since
+                the index was saved
+
+        Returns: None if there is no sidecar file, or it is out of date.
+
+        """
+        path = index_filename(filename)
+        if not os.path.isfile(path):
+            return None
+        stat = os.stat(filename)
+        try:
+            with np.load(path) as data:
+                meta = dict(zip(data["meta_keys"], data["meta_values"].tolist()))
+                offsets = data["offsets"]
+                blocks = None
+                if "block_starts" in data:
+                    blocks = compression.BlockIndex(
+                        data["block_starts"], data["block_offsets"]
+                    )
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Ignoring unreadable index {}: {}".format(path, e))
+            return None
+        if meta.get("version") != INDEX_VERSION:
+            logger.info("Index {} is from another version".format(path))
+            return None
+        changed = meta["size"] != stat.st_size or meta["mtime_ns"] != stat.st_mtime_ns
+        if current and changed:
+            logger.info("Index {} is out of date".format(path))
+            return None
+        if meta.get("record_length", 0):
+            return cls(
+                filename,
+                meta["nrecords"],
+                record_length=meta["record_length"],
+                size=meta["size"],
+                mtime_ns=meta["mtime_ns"],
+            )
+        return cls(
+            filename,
+            meta["nrecords"],
+            offsets=offsets,
+            stride=meta["stride"],
+            size=meta["size"],
+            mtime_ns=meta["mtime_ns"],
+            data_size=meta.get("data_size", None),
+            blocks=blocks,
+        )
+
+    def save(self):
+        """Write the index to its sidecar file.
+
+        For fixed-length records this only records the record length, which
+        was checked against every record boundary of the file.
+
+        """
+        meta = {
+            "version": INDEX_VERSION,
+            "nrecords": self.nrecords,
+            "record_length": self.record_length or 0,
+            "stride": self.stride or 0,
+            "size": self.size,
+            "mtime_ns": self.mtime_ns,
+            "data_size": self.data_size,
+        }
+        arrays = {}
+        if not self.blocks is None:
+            arrays["block_starts"] = self.blocks.starts
+            arrays["block_offsets"] = self.blocks.offsets
+        path = index_filename(self.filename)
+        tmp = path + ".tmp.npz"
+        np.savez(
+            tmp,
+            offsets=np.zeros(0, dtype=np.int64) if self.is_fixed else self.offsets,
+            meta_keys=np.array(list(meta.keys())),
+            meta_values=np.array(list(meta.values()), dtype=np.int64),
+            **arrays,
+        )
+        os.replace(tmp, path)
+
+    def is_current(self):
+        """Check the .dat file has not changed since the index was built."""
+        stat = os.stat(self.filename)
+        return stat.st_size == self.size and stat.st_mtime_ns == self.mtime_ns
+
+    def extend(self):
+        """Index the lines appended to the .dat file since the index was built.
+
+        The file is scanned from the last indexed line (at most ``stride``
+        lines before the old end of the file), so a last line which was
+        still being written when the index was built is counted again in
+        full. For fixed-length records only the boundaries of the appended
+        records are checked for a line terminator.
+
+        Returns: a new :class:`RecordIndex`, or None if the file has not
+        simply grown (e.g. it was truncated or rewritten), or is compressed,
+        or the appended records are not all of the same length.
+
+        """
+        stat = os.stat(self.filename)
+        if (
+            stat.st_size <= self.size
+            or not self.blocks is None
+            or compression.compression_of(self.filename)
+        ):
+            return None
+        if self.is_fixed:
+            record_length, eol = fixed_width.detect_record_length(
+                self.filename, verified=(self.record_length, self.size)
+            )
+            if record_length != self.record_length:
+                return None
+            return RecordIndex.fixed(self.filename, record_length)
+        kept = max(len(self.offsets) - 1, 0)
+        start = int(self.offsets[kept]) if len(self.offsets) else 0
+        with instrument.stage("index", bytes=stat.st_size - start):
+            offsets, nlines = scan_line_offsets(
+                self.filename, stride=self.stride, start=start
+            )
+        logger.info(
+            "Indexed {} lines from byte {} of {}".format(nlines, start, self.filename)
+        )
+        return RecordIndex(
+            self.filename,
+            kept * self.stride + nlines,
+            offsets=np.concatenate([self.offsets[:kept], offsets]),
+            stride=self.stride,
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+        )
+
+    def offset(self, n):
+        """Return the byte offset of record n.
+
+        For fixed-length records this is computed directly. Otherwise the
+        nearest indexed record before record n is looked up and at most
+        ``stride - 1`` records (and any blank lines) are skipped from there.
+
+        """
+        if n < 0:
+            n += self.nrecords
+        if n < 0 or n > self.nrecords:
+            raise IndexError("record {} out of range".format(n))
+        if self.is_fixed:
+            return min(n * self.record_length, self.size)
+        if n == self.nrecords:
+            return self.data_size
+        i, skip = divmod(n, self.stride)
+        pos = int(self.offsets[i])
+        if not skip:
+            return pos
+        with compression.open_file(self.filename, pos, self.blocks) as f:
+            for line in f:
+                if line.strip():
+                    if not skip:
+                        break
+                    skip -= 1
+                pos += len(line)
+        return pos
+
+    def seek(self, f, n):
+        """Seek the binary file object f to the start of record n."""
+        f.seek(self.offset(n))
+        return f
+
+
+def field_index_filename(dat_filename, field_name):
+    """Return the filename of the sidecar index of a field's values."""
+    return dat_filename + ".{}.runs.npz".format(re.sub(r"\W", "_", field_name))
+
+
+def merge_ranges(starts, stops):
+    """Sort and merge overlapping or adjacent [start, stop) ranges."""
+    order = np.argsort(starts, kind="stable")
+    merged = []
+    for start, stop in zip(np.asarray(starts)[order], np.asarray(stops)[order]):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+    return [(int(a), int(b)) for a, b in merged]
+
+
+def intersect_ranges(a, b):
+    """Intersect two sorted lists of merged [start, stop) ranges."""
+    out = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        start = max(a[i][0], b[j][0])
+        stop = min(a[i][1], b[j][1])
+        if start < stop:
+            out.append((start, stop))
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return out
+
+
+class FieldIndex(object):
+    """Runs of equal values of one field, as ranges of record numbers.
+
+    Airborne data is recorded line by line, so a field such as a line or
+    flight number takes the same value for long runs of consecutive
+    records. Storing one ``(value, start, stop)`` entry per run keeps the
+    index small.
+
+    Use :meth:`FieldIndex.build` or :meth:`FieldIndex.load` rather than
+    creating one directly.
+
+    Arguments:
+        filename (str): the .dat file
+        field_name (str): the indexed field
+        values (ndarray): value of each run
+        starts (ndarray): first record number of each run
+        stops (ndarray): record number after the end of each run
+        size (int): size of the .dat file when the index was built
+        mtime_ns (int): modification time of the .dat file when the index
+            was built
+
+    """
+
+    def __init__(self, filename, field_name, values, starts, stops, size, mtime_ns):
+        self.filename = filename
+        self.field_name = field_name
+        self.values = values
+        self.starts = starts
+        self.stops = stops
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+    def __len__(self):
+        return len(self.values)
+
+    def __repr__(self):
+        return "<{}.{} {} runs={}>".format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            self.field_name,
+            len(self),
+        )
+
+    @classmethod
+    def build(cls, filename, field_name, chunks):
+        """Build the index from the values of the field.
+
+        Args:
+            filename (str): the .dat file
+            field_name (str): the field being indexed
+            chunks (iterable): 1D arrays of consecutive values of the
+                field, starting from record 0
+
+        """
+        stat = os.stat(filename)
+        values, starts, stops = [], [], []
+        n = 0
+        for chunk in chunks:
+            chunk = np.asarray(chunk)
+            if not len(chunk):
+                continue
+            isna = pd.isna(chunk)
+            changed = (chunk[1:] != chunk[:-1]) & ~(isna[1:] & isna[:-1])
+            run_starts = np.concatenate([[0], np.flatnonzero(changed) + 1])
+            run_stops = np.append(run_starts[1:], len(chunk))
+            run_values = chunk[run_starts]
+            if values and _same_value(values[-1], run_values[0]):
+                # The first run continues the last run of the previous chunk.
+                stops[-1] = n + run_stops[0]
+                run_starts, run_stops, run_values = (
+                    run_starts[1:],
+                    run_stops[1:],
+                    run_values[1:],
+                )
+            values.extend(run_values)
+            starts.extend(run_starts + n)
+            stops.extend(run_stops + n)
+            n += len(chunk)
+        values = np.array(values)
+        if values.dtype == object:
+            values = values.astype(str)
+        return cls(
+            filename,
+            field_name,
+            values,
+            np.array(starts, dtype=np.int64),
+            np.array(stops, dtype=np.int64),
+            stat.st_size,
+            stat.st_mtime_ns,
+        )
+
+    @classmethod
+    def load(cls, filename, field_name):
+        """Load the index of a field from its sidecar file.
+
+        Returns: None if there is no sidecar file, or it is out of date.
+
+        """
+        path = field_index_filename(filename, field_name)
+        if not os.path.isfile(path):
+            return None
+        stat = os.stat(filename)
+        try:
+            with np.load(path) as data:
+                index = cls(
+                    filename,
+                    field_name,
+                    data["values"],
+                    data["starts"],
+                    data["stops"],
+                    int(data["size"]),
+                    int(data["mtime_ns"]),
+                )
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Ignoring unreadable index {}: {}".format(path, e))
+            return None
+        if not index.is_current():
+            logger.info("Index {} is out of date".format(path))
+            return None
+        return index
+
+    def save(self):
+        """Write the index to its sidecar file."""
+        path = field_index_filename(self.filename, self.field_name)
+        tmp = path + ".tmp.npz"
+        np.savez(
+            tmp,
+            values=self.values,
+            starts=self.starts,
+            stops=self.stops,
+            size=self.size,
+            mtime_ns=self.mtime_ns,
+        )
+        os.replace(tmp, path)
+
+    def is_current(self):
+        """Check the .dat file has not changed since the index was built."""
+        stat = os.stat(self.filename)
+        return stat.st_size == self.size and stat.st_mtime_ns == self.mtime_ns
+
+    def unique(self):
+        """Return the distinct values of the field."""
+        return pd.unique(self.values)
+
+    def ranges(self, values):
+        """Return the record ranges where the field has one of values.
+
+        Args:
+            values: a value or list of values of the field
+
+        Returns: sorted list of ``(start, stop)`` record number ranges.
+
+        """
+        if np.ndim(values) == 0:
+            values = [values]
+        values = np.asarray(values)
+        if self.values.dtype.kind == "U":
+            values = values.astype(str)
+        mask = np.isin(self.values, values)
+        return merge_ranges(self.starts[mask], self.stops[mask])
+
+
+def _same_value(a, b):
+    return a == b or (pd.isna(a) and pd.isna(b))
+
+
+def spatial_index_filename(dat_filename, x_field, y_field):
+    """Return the filename of the sidecar spatial index for a .dat file."""
+    return dat_filename + ".{}.{}.grid.npz".format(
+        re.sub(r"\W", "_", x_field), re.sub(r"\W", "_", y_field)
+    )
+
+
+class SpatialIndex(object):
+    """Grid index of the records of a .dat file by their x and y coordinates.
+
+    Use :meth:`GDF2.build_spatial_index` rather than creating one directly.
+
+    The extent of the survey is divided into a grid of square cells, and
+    the runs of consecutive records which fall in the same cell are stored
+    in the same way as a :class:`FieldIndex`. As airborne and ground
+    surveys are recorded along lines, a line crossing the grid only adds
+    one run per cell it passes through, however many records it has.
+
+    Arguments:
+        filename (str): the .dat file
+        x_field (str): field with the x coordinate (e.g. easting)
+        y_field (str): field with the y coordinate (e.g. northing)
+        origin (tuple): x and y of the lower left corner of the grid
+        cell_size (float): width and height of each cell
+        shape (tuple): number of cells along x and y
+        cells (ndarray): cell number (``iy * nx + ix``) of each run, or -1
+            for records without coordinates
+        starts (ndarray): first record number of each run
+        stops (ndarray): record number after the end of each run
+        size (int): size of the .dat file when the index was built
+        mtime_ns (int): modification time of the .dat file when the index
+            was built
+
+    """
+
+    def __init__(
+        self,
+        filename,
+        x_field,
+        y_field,
+        origin,
+        cell_size,
+        shape,
+        cells,
+        starts,
+        stops,
+        size,
+        mtime_ns,
+    ):
+        self.filename = filename
+        self.x_field = x_field
+        self.y_field = y_field
+        self.origin = tuple(float(v) for v in origin)
+        self.cell_size = float(cell_size)
+        self.shape = tuple(int(n) for n in shape)
+        self.cells = cells
+        self.starts = starts
+        self.stops = stops
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __repr__(self):
+        return "<{}.{} {},{} grid={}x{} runs={}>".format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            self.x_field,
+            self.y_field,
+            self.shape[0],
+            self.shape[1],
+            len(self),
+        )
+
+    @classmethod
+    def build(cls, filename, x_field, y_field, extent, chunks, ncells=256):
+        """Build the index from the coordinates of every record.
+
+        Args:
+            filename (str): the .dat file
+            x_field (str): field with the x coordinate
+            y_field (str): field with the y coordinate
+            extent (tuple): ``(xmin, ymin, xmax, ymax)`` of the coordinates
+            chunks (iterable): tuples of 1D arrays ``(x, y)`` of the
+                coordinates of consecutive records, starting from record 0
+            ncells (int): number of cells along the longer side of the grid
+
+        """
+        xmin, ymin, xmax, ymax = extent
+        cell_size = max(xmax - xmin, ymax - ymin) / ncells
+        if not cell_size > 0:
+            cell_size = 1.0
+        shape = (
+            max(int(np.ceil((xmax - xmin) / cell_size)), 1),
+            max(int(np.ceil((ymax - ymin) / cell_size)), 1),
+        )
+        index = cls(
+            filename,
+            x_field,
+            y_field,
+            (xmin, ymin),
+            cell_size,
+            shape,
+            None,
+            None,
+            None,
+            0,
+            0,
+        )
+        runs = FieldIndex.build(
+            filename, "cell", (index.cell_numbers(x, y) for x, y in chunks)
+        )
+        index.cells = runs.values.astype(np.int64)
+        index.starts = runs.starts
+        index.stops = runs.stops
+        index.size = runs.size
+        index.mtime_ns = runs.mtime_ns
+        return index
+
+    def cell_numbers(self, x, y):
+        """Return the grid cell of each pair of coordinates, or -1 for NaN."""
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        nx, ny = self.shape
+        with np.errstate(invalid="ignore"):
+            ix = np.floor((x - self.origin[0]) / self.cell_size)
+            iy = np.floor((y - self.origin[1]) / self.cell_size)
+        valid = np.isfinite(ix) & np.isfinite(iy)
+        ix = np.clip(np.where(valid, ix, 0), 0, nx - 1).astype(np.int64)
+        iy = np.clip(np.where(valid, iy, 0), 0, ny - 1).astype(np.int64)
+        return np.where(valid, iy * nx + ix, -1)
+
+    @classmethod
+    def load(cls, filename, x_field, y_field):
+        """Load the spatial index from its sidecar file.
+
+        Returns: None if there is no sidecar file, or it is out of date.
+
+        """
+        path = spatial_index_filename(filename, x_field, y_field)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with np.load(path) as data:
+                index = cls(
+                    filename,
+                    x_field,
+                    y_field,
+                    data["origin"],
+                    float(data["cell_size"]),
+                    data["shape"],
+                    data["cells"].astype(np.int64),
+                    data["starts"],
+                    data["stops"],
+                    int(data["size"]),
+                    int(data["mtime_ns"]),
+                )
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Ignoring unreadable index {}: {}".format(path, e))
+            return None
+        if not index.is_current():
+            logger.info("Index {} is out of date".format(path))
+            return None
+        return index
+
+    def save(self):
+        """Write the index to its sidecar file."""
+        path = spatial_index_filename(self.filename, self.x_field, self.y_field)
+        tmp = path + ".tmp.npz"
+        # Run boundaries are sorted, so they compress well.
+        np.savez_compressed(
+            tmp,
+            origin=np.asarray(self.origin),
+            cell_size=self.cell_size,
+            shape=np.asarray(self.shape),
+            cells=self.cells.astype(
+                np.int32 if self.shape[0] * self.shape[1] < 2 ** 31 else np.int64
+            ),
+            starts=self.starts,
+            stops=self.stops,
+            size=self.size,
+            mtime_ns=self.mtime_ns,
+        )
+        os.replace(tmp, path)
+
+    def is_current(self):
+        """Check the .dat file has not changed since the index was built."""
+        stat = os.stat(self.filename)
+        return stat.st_size == self.size and stat.st_mtime_ns == self.mtime_ns
+
+    def ranges(self, bbox):
+        """Return the record ranges in the grid cells which overlap bbox.
+
+        The records in these ranges are a superset of those inside bbox,
+        so they still need filtering by their coordinates.
+
+        Args:
+            bbox (tuple): ``(xmin, ymin, xmax, ymax)``
+
+        Returns: sorted list of ``(start, stop)`` record number ranges.
+
+        """
+        xmin, ymin, xmax, ymax = bbox
+        nx, ny = self.shape
+        x0, y0 = self.origin
+        ix0 = max(int(np.floor((xmin - x0) / self.cell_size)), 0)
+        ix1 = min(int(np.floor((xmax - x0) / self.cell_size)), nx - 1)
+        iy0 = max(int(np.floor((ymin - y0) / self.cell_size)), 0)
+        iy1 = min(int(np.floor((ymax - y0) / self.cell_size)), ny - 1)
+        if ix0 > ix1 or iy0 > iy1:
+            return []
+        ix = self.cells % nx
+        iy = self.cells // nx
+        mask = (
+            (self.cells >= 0)
+            & (ix >= ix0)
+            & (ix <= ix1)
+            & (iy >= iy0)
+            & (iy <= iy1)
+        )
+        return merge_ranges(self.starts[mask], self.stops[mask])
@@ -0,0 +1,427 @@
+"""Timings and counters for the stages of reading a data package.
+
+Each call to a reading method of a GDF2 object (``df``, ``rows``,
+``get_fields_data``, ``iterchunks``, ``stats`` and so on) records how long
+each stage of the read took, how many bytes it read and how many rows it
+produced, in ``gdf.last_read_stats``::
+
+    >>> df = gdf.df()
+    >>> gdf.last_read_stats.to_frame()
+            calls   seconds      bytes     rows  ...
+    stage
+    schema      1  0.000412        NaN      NaN  ...
+    parse       1  1.231160  104857600  1000000  ...
+
+To feed the stages of every read into your own metrics, collect them in a
+block, or register a callback which is called as each stage finishes::
+
+    >>> from aseg_gdf2 import instrument
+    >>> with instrument.collect() as stats:
+    ...     gdf.df()
+    ...     other.get_field_data("Con")
+    >>> stats.records         # one dict per timed stage
+    >>> instrument.add_callback(print)
+
+The stages are:
+
+- ``dfn``: parsing the .dfn file
+- ``index``: counting records, building or loading the line-offset index
+  and looking up the field and spatial indexes
+- ``schema``: working out column names, dtypes, NULL values and the
+  arguments to the parser
+- ``read``: reading bytes from the .dat file
+- ``parse``: turning bytes into columns. This includes replacing NULL
+  values, which happens inside the pandas parsers and the NumPy decoder
+  rather than as a separate step, and for memory-mapped files it includes
+  reading the bytes as well.
+- ``demux``: finding and routing the lines of each record type
+- ``cache``: reading or writing the sidecar column cache
+
+The time of a stage excludes any stages inside it (e.g. the ``read``
+stages of a ``demux`` stage), so the times of the stages add up to about
+the time of the whole call. Peak RSS is the high-water mark of the
+resident memory of the process, and RSS growth is how much the stage
+raised it. They are None on platforms without the ``resource`` module.
+
+Only work done in this process is timed. The dask engine builds a lazy
+DataFrame, so the parsing happens when you call ``compute()`` and is not
+recorded, except where the reading methods compute partitions themselves
+(``iterrows`` and ``iterchunks``). With ``workers`` the parsing done in
+the worker processes is recorded as one ``parse`` stage in this process.
+The chunks of ``df(chunksize=...)`` are parsed as you iterate over the
+reader which it returns, after the call has finished, so use
+``iterchunks`` to time them.
+
+"""
+import contextvars
+import functools
+import logging
+import sys
+import time
+import types
+from contextlib import contextmanager
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("dfn", "index", "schema", "read", "parse", "demux", "cache")
+
+# ReadStats objects which stages are being recorded to.
+_collectors = contextvars.ContextVar("aseg_gdf2_collectors", default=())
+# Description of the read operation in progress.
+_operation = contextvars.ContextVar("aseg_gdf2_operation", default=None)
+# Stages which have started and not finished, innermost last.
+_open_stages = contextvars.ContextVar("aseg_gdf2_open_stages", default=())
+
+_callbacks = []
+
+
+def peak_rss():
+    """Return the peak resident memory of this process in bytes, or None."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def add_callback(func):
+    """Call func with the record of every stage as it finishes.
+
+    The record is a dict with the keys described in ``ReadStats.records``.
+
+    """
+    _callbacks.append(func)
+
+
+def remove_callback(func):
+    """Stop calling a function added with ``add_callback``."""
+    _callbacks.remove(func)
+
+
+class Stage(object):
+    """A stage in progress, as returned by ``stage()``.
+
+    Set ``bytes`` and ``rows`` once they are known.
+
+    """
+
+    __slots__ = ("name", "bytes", "rows", "nested_seconds", "cancelled")
+
+    def __init__(self, name, bytes=None, rows=None):
+        self.name = name
+        self.bytes = bytes
+        self.rows = rows
+        self.nested_seconds = 0.0
+        self.cancelled = False
+
+    def cancel(self):
+        """Do not record this stage."""
+        self.cancelled = True
+
+
+def is_active():
+    """Return True if stages are being recorded."""
+    return bool(_collectors.get()) or bool(_callbacks)
+
+
+@contextmanager
+def stage(name, bytes=None, rows=None):
+    """Time the code in a with block as a stage of reading.
+
+    Args:
+        name (str): one of ``STAGES``
+        bytes (int): number of bytes read, if known in advance
+        rows (int): number of rows produced, if known in advance
+
+    Yields: a :class:`Stage`, on which bytes and rows can be set.
+
+    """
+    current = Stage(name, bytes=bytes, rows=rows)
+    if not is_active():
+        yield current
+        return
+    parents = _open_stages.get()
+    token = _open_stages.set(parents + (current,))
+    before = peak_rss()
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        elapsed = time.perf_counter() - start
+        _open_stages.reset(token)
+        if parents:
+            parents[-1].nested_seconds += elapsed
+        if not current.cancelled:
+            _record(current, elapsed - current.nested_seconds, before)
+
+
+def timed(name):
+    """Decorate a function to time each call as a stage of reading."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(bytes=None, rows=None):
+    """Add to the bytes and rows of the innermost stage in progress."""
+    stages = _open_stages.get()
+    if not stages:
+        return
+    current = stages[-1]
+    if not bytes is None:
+        current.bytes = (current.bytes or 0) + bytes
+    if not rows is None:
+        current.rows = (current.rows or 0) + rows
+
+
+def timed_iter(iterable, name, bytes=None):
+    """Time getting each item from an iterable of DataFrames as a stage.
+
+    Args:
+        iterable: yields DataFrames (or anything else with a length)
+        name (str): one of ``STAGES``
+        bytes (int): total bytes read by the iterable, which is recorded
+            when it is exhausted, as the bytes for each item are not known
+
+    """
+    iterator = iter(iterable)
+    while True:
+        with stage(name) as current:
+            try:
+                item = next(iterator)
+            except StopIteration:
+                if bytes is None:
+                    current.cancel()
+                current.bytes = bytes
+                return
+            current.rows = len(item)
+        yield item
+
+
+def _record(current, seconds, rss_before):
+    rss = peak_rss()
+    operation = _operation.get() or {}
+    record = {
+        "operation": operation.get("operation", None),
+        "filename": operation.get("filename", None),
+        "engine": operation.get("engine", None),
+        "method": operation.get("method", None),
+        "stage": current.name,
+        "seconds": seconds,
+        "bytes": current.bytes,
+        "rows": current.rows,
+        "peak_rss": rss,
+        "rss_growth": None if rss is None else rss - rss_before,
+    }
+    record.update(_rates(record))
+    for stats in _collectors.get():
+        stats.add(record)
+    for func in list(_callbacks):
+        try:
+            func(dict(record))
+        except Exception as e:
+            logger.warning("Error in read stats callback {}: {}".format(func, e))
+
+
+def _rates(record):
+    seconds = record["seconds"]
+    rates = {}
+    for key in ("bytes", "rows"):
+        value = record[key]
+        rate = None
+        if not value is None and seconds > 0:
+            rate = value / seconds
+        rates["{}_per_second".format(key)] = rate
+    return rates
+
+
+class ReadStats(object):
+    """Timed stages of one or more reads.
+
+    Arguments:
+        operation (str): name of the GDF2 method, or None for ``collect()``
+        filename (str): the .dat file
+        engine (str): ``'pandas'``, ``'dask'`` or ``'numpy'``
+        method (str): ``'whitespace'`` or ``'fixed-widths'``
+
+    Attributes:
+        seconds (float): wall time of the whole read. For iterators this
+            is the time spent producing items, not the time in between.
+        records (list): a dict for each timed stage, in the order they
+            finished, with the keys ``operation``, ``filename``,
+            ``engine``, ``method``, ``stage``, ``seconds``, ``bytes``,
+            ``rows``, ``peak_rss``, ``rss_growth``, ``bytes_per_second``
+            and ``rows_per_second``. Counts which are not known are None.
+
+    """
+
+    def __init__(self, operation=None, filename=None, engine=None, method=None):
+        self.operation = operation
+        self.filename = filename
+        self.engine = engine
+        self.method = method
+        self.seconds = 0.0
+        self.records = []
+        self._owner = None
+
+    def __repr__(self):
+        return "<{}.{} {} seconds={:.6f} stages={}>".format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            self.operation,
+            self.seconds,
+            self.stages,
+        )
+
+    def add(self, record):
+        """Add the record of a timed stage."""
+        self.records.append(record)
+
+    @property
+    def stages(self):
+        """Names of the stages which were timed, in the order of ``STAGES``."""
+        names = set(r["stage"] for r in self.records)
+        return [s for s in STAGES if s in names] + sorted(names - set(STAGES))
+
+    def __getitem__(self, name):
+        """Return the totals for one stage - see ``to_dict``."""
+        records = [r for r in self.records if r["stage"] == name]
+        if not records:
+            raise KeyError(name)
+        totals = {"calls": len(records)}
+        for key in ("seconds", "bytes", "rows", "rss_growth"):
+            values = [r[key] for r in records if not r[key] is None]
+            totals[key] = sum(values) if values else None
+        totals["seconds"] = totals["seconds"] or 0.0
+        peaks = [r["peak_rss"] for r in records if not r["peak_rss"] is None]
+        totals["peak_rss"] = max(peaks) if peaks else None
+        totals.update(_rates(totals))
+        return totals
+
+    @property
+    def peak_rss(self):
+        """Highest peak RSS of any stage."""
+        peaks = [r["peak_rss"] for r in self.records if not r["peak_rss"] is None]
+        return max(peaks) if peaks else None
+
+    def to_dict(self):
+        """Return the totals of each stage as a JSON-serialisable dict.
+
+        The totals for each stage are the number of times it was timed
+        (``calls``), the sums of ``seconds``, ``bytes``, ``rows`` and
+        ``rss_growth``, the highest ``peak_rss``, and ``bytes_per_second``
+        and ``rows_per_second``.
+
+        """
+        return {
+            "operation": self.operation,
+            "filename": self.filename,
+            "engine": self.engine,
+            "method": self.method,
+            "seconds": self.seconds,
+            "peak_rss": self.peak_rss,
+            "stages": {name: self[name] for name in self.stages},
+        }
+
+    def to_frame(self):
+        """Return the totals of each stage as a DataFrame indexed by stage."""
+        columns = [
+            "calls",
+            "seconds",
+            "bytes",
+            "rows",
+            "bytes_per_second",
+            "rows_per_second",
+            "peak_rss",
+            "rss_growth",
+        ]
+        rows = [self[name] for name in self.stages]
+        df = pd.DataFrame(rows, index=self.stages, columns=columns)
+        df.index.name = "stage"
+        return df
+
+    def _run(self, func, *args, **kwargs):
+        token = _collectors.set(_collectors.get() + (self,))
+        operation = None
+        if not self.operation is None:
+            operation = _operation.set(
+                {
+                    "operation": self.operation,
+                    "filename": self.filename,
+                    "engine": self.engine,
+                    "method": self.method,
+                }
+            )
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.seconds += time.perf_counter() - start
+            if not operation is None:
+                _operation.reset(operation)
+            _collectors.reset(token)
+
+    def _iterate(self, iterator):
+        while True:
+            try:
+                item = self._run(next, iterator)
+            except StopIteration:
+                return
+            yield item
+
+
+@contextmanager
+def collect():
+    """Collect the stages of every read in a with block.
+
+    Yields: a :class:`ReadStats` which the stages are added to.
+
+    """
+    stats = ReadStats()
+    token = _collectors.set(_collectors.get() + (stats,))
+    start = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        stats.seconds = time.perf_counter() - start
+        _collectors.reset(token)
+
+
+def read_operation(method):
+    """Decorate a GDF2 method to record its stages in ``last_read_stats``.
+
+    Calls from inside another decorated method of the same object are
+    recorded as part of the outer call. Generators are wrapped so that
+    their stages are recorded as they are iterated over.
+
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if any(c._owner == id(self) for c in _collectors.get()):
+            return method(self, *args, **kwargs)
+        stats = ReadStats(
+            method.__name__, self.dat_filename, self._engine, self.method
+        )
+        stats._owner = id(self)
+        self.last_read_stats = stats
+        result = stats._run(method, self, *args, **kwargs)
+        if isinstance(result, types.GeneratorType):
+            return stats._iterate(result)
+        return result
+
+    return wrapper
@@ -0,0 +1,389 @@
+"""Mergeable summary statistics of the columns of a data table.
+
+Statistics are computed a block of records at a time and the results for
+each block merged, so that a whole .dat file can be summarised in bounded
+memory. They are saved to a small sidecar file next to the .dat file so
+that they only need to be computed once.
+
+"""
+import json
+import logging
+import math
+import os
+from collections.abc import Mapping
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+STATS_VERSION = 1
+DEFAULT_BINS = 64
+
+# Finest histogram bin width, relative to the largest value in the column.
+# This keeps bin numbers well inside the range of int64.
+MIN_RELATIVE_WIDTH = 2.0 ** -40
+
+
+def stats_filename(dat_filename):
+    """Return the filename of the sidecar statistics for a .dat file."""
+    return dat_filename + ".stats.json"
+
+
+def bin_width(lo, hi, bins, width=0):
+    """Return the histogram bin width for values from lo to hi.
+
+    This is the smallest power of two, and at least width, for which the
+    values fall in at most bins bins with edges at multiples of the width.
+
+    """
+    width = max(
+        width,
+        (hi - lo) / bins,
+        max(abs(lo), abs(hi)) * MIN_RELATIVE_WIDTH,
+        np.finfo(float).tiny,
+    )
+    mantissa, exponent = math.frexp(width)
+    width = math.ldexp(1.0, exponent - 1 if mantissa == 0.5 else exponent)
+    while math.floor(hi / width) - math.floor(lo / width) >= bins:
+        width *= 2
+    return width
+
+
+class ColumnStats(object):
+    """Count, NULL count, range, mean, variance and histogram of a column.
+
+    Arguments:
+        numeric (bool): False for text columns, which only have counts
+        bins (int): maximum number of histogram bins
+
+    Statistics for different blocks of records are combined with
+    ``merge``, which gives the same result as computing them from all the
+    records at once (to within rounding of the mean and variance).
+
+    The histogram bins have a width which is a power of two and edges at
+    multiples of that width. When the values no longer fit in ``bins``
+    bins the width is doubled and neighbouring bins added together, so
+    histograms of different blocks can always be merged exactly.
+
+    NULL values are counted in ``nulls`` and left out of everything else.
+    Infinite values are ignored.
+
+    """
+
+    def __init__(self, numeric=True, bins=DEFAULT_BINS):
+        self.numeric = numeric
+        self.bins = bins
+        self.count = 0
+        self.nulls = 0
+        self.min = None
+        self.max = None
+        self._mean = 0.0
+        self._m2 = 0.0
+        self.bin_width = None
+        self.bin_start = 0
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def __repr__(self):
+        return "<{}.{} count={} nulls={} min={} max={}>".format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            self.count,
+            self.nulls,
+            self.min,
+            self.max,
+        )
+
+    @classmethod
+    def from_values(cls, values, numeric=True, bins=DEFAULT_BINS):
+        """Compute the statistics of a 1D array of values.
+
+        NaN (or None for text columns) values count as NULLs. If numeric
+        is True, values which are not numbers (e.g. text from ``E``
+        format fields) are converted to numbers first.
+
+        """
+        self = cls(numeric=numeric, bins=bins)
+        values = np.asarray(values)
+        if not numeric:
+            isnull = pd.isna(values)
+            self.nulls = int(isnull.sum())
+            self.count = len(values) - self.nulls
+            return self
+        if not values.dtype.kind in "biuf":
+            values = pd.to_numeric(pd.Series(values), errors="coerce").to_numpy(
+                dtype=float
+            )
+        values = values.astype(np.float64, copy=False)
+        isnull = np.isnan(values)
+        self.nulls = int(isnull.sum())
+        values = values[~isnull & np.isfinite(values)]
+        if not len(values):
+            return self
+        self.count = len(values)
+        self.min = float(values.min())
+        self.max = float(values.max())
+        self._mean = float(values.mean())
+        self._m2 = float(((values - self._mean) ** 2).sum())
+        self.bin_width = bin_width(self.min, self.max, bins)
+        numbers = np.floor(values / self.bin_width).astype(np.int64)
+        self.bin_start = int(numbers.min())
+        self.counts = np.bincount(numbers - self.bin_start).astype(np.int64)
+        return self
+
+    @property
+    def mean(self):
+        return self._mean if self.count else None
+
+    @property
+    def var(self):
+        """Sample variance (with one degree of freedom, as in pandas)."""
+        return self._m2 / (self.count - 1) if self.count > 1 else None
+
+    @property
+    def std(self):
+        var = self.var
+        return None if var is None else math.sqrt(var)
+
+    def merge(self, other):
+        """Add the statistics of other, for more values of the same column.
+
+        Returns: self
+
+        """
+        self.nulls += other.nulls
+        if not other.count:
+            return self
+        if not self.numeric:
+            self.count += other.count
+            return self
+        if not self.count:
+            for attr in ("count", "min", "max", "_mean", "_m2"):
+                setattr(self, attr, getattr(other, attr))
+            self.bin_width = other.bin_width
+            self.bin_start = other.bin_start
+            self.counts = other.counts.copy()
+            return self
+        n = self.count + other.count
+        delta = other._mean - self._mean
+        self._mean += delta * other.count / n
+        self._m2 += other._m2 + delta ** 2 * self.count * other.count / n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.count = n
+
+        width = bin_width(
+            self.min, self.max, self.bins, max(self.bin_width, other.bin_width)
+        )
+        start = math.floor(self.min / width)
+        counts = np.zeros(math.floor(self.max / width) - start + 1, dtype=np.int64)
+        for hist in (self, other):
+            numbers = hist.bin_start + np.flatnonzero(hist.counts)
+            # Both widths are powers of two, so each old bin lies wholly
+            # within one new bin.
+            factor = int(round(width / hist.bin_width))
+            np.add.at(counts, numbers // factor - start, hist.counts[hist.counts > 0])
+        self.bin_width = width
+        self.bin_start = start
+        self.counts = counts
+        return self
+
+    def histogram(self):
+        """Return the histogram of the values.
+
+        Returns: a tuple ``(counts, edges)`` as from ``numpy.histogram``,
+        with ``len(edges) == len(counts) + 1``. Both are empty for text
+        columns and columns with no values.
+
+        """
+        if not self.count or not self.numeric:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        edges = (self.bin_start + np.arange(len(self.counts) + 1)) * self.bin_width
+        return self.counts.copy(), edges
+
+    def to_dict(self):
+        """Return the statistics as a JSON-serialisable dict."""
+        return {
+            "numeric": self.numeric,
+            "bins": self.bins,
+            "count": self.count,
+            "nulls": self.nulls,
+            "min": self.min,
+            "max": self.max,
+            "mean": self._mean,
+            "m2": self._m2,
+            "bin_width": self.bin_width,
+            "bin_start": self.bin_start,
+            "counts": self.counts.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        """Create ColumnStats from the output of ``to_dict``."""
+        self = cls(numeric=d["numeric"], bins=d["bins"])
+        self.count = d["count"]
+        self.nulls = d["nulls"]
+        self.min = d["min"]
+        self.max = d["max"]
+        self._mean = d["mean"]
+        self._m2 = d["m2"]
+        self.bin_width = d["bin_width"]
+        self.bin_start = d["bin_start"]
+        self.counts = np.array(d["counts"], dtype=np.int64)
+        return self
+
+
+class TableStats(Mapping):
+    """Statistics of the columns of a data table, by column name.
+
+    Arguments:
+        columns (dict): column name to :class:`ColumnStats`
+        fields (dict): column name to the name of the field it belongs to
+
+    Look up a column with e.g. ``stats["Con[3]"]``, or get a summary of
+    every column with ``to_frame()``.
+
+    """
+
+    def __init__(self, columns=None, fields=None):
+        self.columns = dict(columns or {})
+        self.fields = dict(fields or {})
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __len__(self):
+        return len(self.columns)
+
+    def __repr__(self):
+        return "<{}.{} columns={}>".format(
+            self.__class__.__module__, self.__class__.__name__, len(self)
+        )
+
+    @classmethod
+    def from_frame(cls, df, fields, numeric, bins=DEFAULT_BINS):
+        """Compute the statistics of every column of a DataFrame.
+
+        Args:
+            df (pandas.DataFrame): a block of the data table
+            fields (dict): column name to field name
+            numeric (dict): column name to whether the column holds
+                numbers (see ``ColumnStats.from_values``)
+            bins (int): maximum number of histogram bins
+
+        """
+        columns = {}
+        for name in df.columns:
+            values = df[name]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.astype(object)
+            columns[name] = ColumnStats.from_values(
+                values.to_numpy(), numeric=numeric[name], bins=bins
+            )
+        return cls(columns, fields)
+
+    def merge(self, other):
+        """Add the statistics of other, for more records of the table.
+
+        Columns which are only in other are added.
+
+        Returns: self
+
+        """
+        for name, column in other.items():
+            if name in self.columns:
+                self.columns[name].merge(column)
+            else:
+                self.columns[name] = column
+        self.fields.update(other.fields)
+        return self
+
+    def subset(self, columns):
+        """Return the statistics of some of the columns."""
+        return TableStats(
+            {c: self.columns[c] for c in columns},
+            {c: self.fields.get(c, None) for c in columns},
+        )
+
+    def to_frame(self):
+        """Return a summary of every column as a DataFrame.
+
+        Returns: a pandas.DataFrame indexed by column name, with columns
+        ``field``, ``count``, ``nulls``, ``min``, ``max``, ``mean`` and
+        ``std``.
+
+        """
+        rows = []
+        for name, column in self.columns.items():
+            rows.append(
+                {
+                    "field": self.fields.get(name, None),
+                    "count": column.count,
+                    "nulls": column.nulls,
+                    "min": column.min,
+                    "max": column.max,
+                    "mean": column.mean,
+                    "std": column.std,
+                }
+            )
+        columns = ["field", "count", "nulls", "min", "max", "mean", "std"]
+        df = pd.DataFrame(rows, index=list(self.columns), columns=columns)
+        for name in columns[3:]:
+            df[name] = df[name].astype(float)
+        return df
+
+
+def load(dat_filename, bins=DEFAULT_BINS):
+    """Load statistics from the sidecar file of a .dat file.
+
+    Returns: dict of record type to a dict of column name to the stored
+    statistics of that column. This is empty if there is no sidecar file,
+    or it is out of date or was computed with a different number of bins.
+
+    """
+    path = stats_filename(dat_filename)
+    if not os.path.isfile(path):
+        return {}
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning("Ignoring unreadable statistics {}: {}".format(path, e))
+        return {}
+    stat = os.stat(dat_filename)
+    if (
+        data.get("version") != STATS_VERSION
+        or data.get("size") != stat.st_size
+        or data.get("mtime_ns") != stat.st_mtime_ns
+        or data.get("bins") != bins
+    ):
+        logger.info("Statistics {} are out of date".format(path))
+        return {}
+    return data["record_types"]
+
+
+def save(dat_filename, record_types, bins=DEFAULT_BINS):
+    """Write statistics to the sidecar file of a .dat file.
+
+    Args:
+        dat_filename (str): the .dat file
+        record_types (dict): as returned by ``load``
+        bins (int): maximum number of histogram bins
+
+    """
+    stat = os.stat(dat_filename)
+    data = {
+        "version": STATS_VERSION,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "bins": bins,
+        "record_types": record_types,
+    }
+    path = stats_filename(dat_filename)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
@@ -0,0 +1,199 @@
+"""Synthetic airborne survey data packages of any size.
+
+These are for benchmarks and tests which need more data than the example
+packages. The survey is flown as east-west lines, alternately west to east
+and east to west, with a line number, fiducial, coordinates, a magnetic
+field with the odd NULL, and a 2D conductivity field of any number of
+channels. The .dat file is written a block of records at a time, so
+packages much larger than memory can be made.
+
+Example::
+
+    >>> from aseg_gdf2 import synthetic
+    >>> dfn, dat = synthetic.make_survey("big", nrecords=10 ** 7, channels=30)
+
+"""
+import logging
+import re
+
+import numpy as np
+
+from aseg_gdf2 import writer
+
+logger = logging.getLogger(__name__)
+
+LAYOUTS = ("fixed", "whitespace")
+
+
+def _field(name, format, unit="", null=None):
+    cols, code, width, decimals = writer.parse_format(format)
+    return {
+        "name": name,
+        "format": format,
+        "unit": unit,
+        "null": null,
+        "cols": cols,
+        "width": width,
+    }
+
+
+COMMENT_FIELDS = [_field("RT", "A4"), _field("COMMENTS", "A76")]
+
+
+def survey_fields(channels=30):
+    """Return the field definitions of a synthetic survey.
+
+    Args:
+        channels (int): number of columns of the 2D ``CON`` field
+
+    Returns: list of dicts in the form of the fields in
+    ``GDF2.record_types``.
+
+    """
+    return [
+        _field("LINE", "I8"),
+        _field("FIDUCIAL", "F12.1", "s"),
+        _field("EASTING", "F10.1", "m"),
+        _field("NORTHING", "F11.1", "m"),
+        _field("ELEVATION", "F8.2", "m"),
+        _field("MAG", "F11.3", "nT", null="-99999.999"),
+        _field("CON", "{:d}F10.4".format(channels), "mS/m", null="-999.9999"),
+    ]
+
+
+def survey_chunks(
+    nrecords, channels=30, records_per_line=5000, chunksize=100000, seed=0
+):
+    """Generate the data of a synthetic survey a block of records at a time.
+
+    Args:
+        nrecords (int): total number of records
+        channels (int): number of columns of the 2D ``CON`` field
+        records_per_line (int): number of records in each survey line
+        chunksize (int): number of records per block
+        seed (int): seed for the random noise, so the data is repeatable
+
+    Yields: dicts of field name to 1D or 2D arrays, as for
+    ``aseg_gdf2.write``.
+
+    """
+    decay = np.exp(-np.arange(channels) / max(channels / 4, 1))
+    for start in range(0, nrecords, chunksize):
+        i = np.arange(start, min(start + chunksize, nrecords))
+        noise = _noise(seed, i[0], i[-1] + 1, channels)
+        line_number = i // records_per_line
+        position = i % records_per_line
+        position = np.where(
+            line_number % 2 == 1, records_per_line - 1 - position, position
+        )
+        mag = 58000 + 200 * np.sin(position / 500) + noise["mag"]
+        mag[noise["null"] < 0.001] = np.nan
+        yield {
+            "LINE": 1000 + line_number * 10,
+            "FIDUCIAL": i * 0.1,
+            "EASTING": 500000 + position * 10.0,
+            "NORTHING": 7000000 + line_number * 200.0 + noise["northing"],
+            "ELEVATION": 300 + 50 * np.cos(position / 1000),
+            "MAG": mag,
+            "CON": noise["con"] * decay,
+        }
+
+
+# Noise is drawn for blocks of this many records, each from its own
+# seed, so that the data does not depend on the chunksize.
+NOISE_BLOCK = 4096
+
+
+def _noise(seed, start, stop, channels):
+    blocks = []
+    for block in range(start // NOISE_BLOCK, (stop - 1) // NOISE_BLOCK + 1):
+        rng = np.random.default_rng((seed, block))
+        blocks.append(
+            {
+                "mag": rng.normal(0, 1, NOISE_BLOCK),
+                "null": rng.random(NOISE_BLOCK),
+                "northing": rng.normal(0, 5, NOISE_BLOCK),
+                "con": rng.lognormal(3, 0.5, (NOISE_BLOCK, 1)),
+            }
+        )
+    offset = start - (start // NOISE_BLOCK) * NOISE_BLOCK
+    return {
+        key: np.concatenate([b[key] for b in blocks])[offset : offset + stop - start]
+        for key in blocks[0]
+    }
+
+
+def _ragged(data):
+    # Squeeze the blanks between values to one, so that records have
+    # different lengths and can only be read by splitting on whitespace.
+    return re.sub(b"(?m)^ +", b"", re.sub(b"  +", b" ", data))
+
+
+def make_survey(
+    path,
+    nrecords=10000,
+    channels=30,
+    layout="fixed",
+    comments=False,
+    records_per_line=5000,
+    chunksize=100000,
+    seed=0,
+):
+    """Write a synthetic survey data package.
+
+    Args:
+        path (str): filename for the .dat or .dfn file, with or without
+            the extension
+        nrecords (int): number of data records
+        channels (int): number of columns of the 2D ``CON`` field
+        layout (str): ``'fixed'`` for records of the same length, readable
+            with either method, or ``'whitespace'`` for records with single
+            blanks between values, which can only be read with
+            ``method='whitespace'``
+        comments (bool): add a ``COMM`` record type, with a comment record
+            at the start of each survey line
+        records_per_line (int): number of records in each survey line
+        chunksize (int): number of records to generate and write at a time
+        seed (int): seed for the random noise
+
+    Returns: a tuple of the .dfn and .dat filenames.
+
+    """
+    if not layout in LAYOUTS:
+        raise ValueError("layout must be one of {}".format(LAYOUTS))
+    # Comment records must not be split across the blocks of records.
+    chunksize = max(chunksize // records_per_line, 1) * records_per_line
+    fields = survey_fields(channels)
+    record_types = {"": {"fields": fields}}
+    if comments:
+        record_types["COMM"] = {"fields": COMMENT_FIELDS}
+
+    # Write the .dfn file (and an empty .dat file) from the definitions.
+    dfn_filename, dat_filename = writer.write(
+        path, {rt: [] for rt in record_types}, record_types=record_types
+    )
+    with open(dat_filename, "wb") as f:
+        chunks = survey_chunks(
+            nrecords,
+            channels=channels,
+            records_per_line=records_per_line,
+            chunksize=chunksize,
+            seed=seed,
+        )
+        for chunk in chunks:
+            data = writer.format_records(fields, chunk)
+            if comments:
+                length = len(data) // len(chunk["LINE"])
+                lines = [
+                    data[i : i + length * records_per_line]
+                    for i in range(0, len(data), length * records_per_line)
+                ]
+                data = b"".join(
+                    b"COMM Survey line %d\n" % line + block
+                    for line, block in zip(chunk["LINE"][::records_per_line], lines)
+                )
+            if layout == "whitespace":
+                data = _ragged(data)
+            f.write(data)
+    logger.info("Wrote {} records to {}".format(nrecords, dat_filename))
+    return dfn_filename, dat_filename
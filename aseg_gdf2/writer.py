@@ -0,0 +1,457 @@
+"""Write ASEG GDF2 data packages.
+
+The .dfn file is generated from field definitions in the same form as
+``GDF2.record_types``, and the .dat file is formatted a block of records at
+a time with NumPy: each column is converted to digits with integer
+arithmetic on the whole block rather than formatting values one by one.
+
+"""
+import itertools
+import logging
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+SPACE = ord(b" ")
+NEWLINE = ord(b"\n")
+ZERO = ord(b"0")
+DOT = ord(b".")
+MINUS = ord(b"-")
+PLUS = ord(b"+")
+EXPONENT = ord(b"e")
+
+# Powers of ten used to count the digits of non-negative int64 values.
+POWERS = 10 ** np.arange(1, 19, dtype=np.int64)
+
+FORMAT_RE = re.compile(r"([0-9]*)([A-Za-z])([0-9]+)\.?([0-9]*)")
+COLUMN_RE = re.compile(r"^(.*)\[([0-9]+)\]$")
+
+
+def parse_format(format):
+    """Split a format code like ``30F10.5`` into its parts.
+
+    Returns: a tuple ``(cols, code, width, decimals)``, e.g.
+        ``(30, "F", 10, 5)``.
+
+    """
+    m = FORMAT_RE.match(format.strip())
+    if not m:
+        raise ValueError("Unable to parse format code {}".format(format))
+    cols = int(m.group(1)) if m.group(1) else 1
+    decimals = int(m.group(4)) if m.group(4) else 0
+    return cols, m.group(2).upper(), int(m.group(3)), decimals
+
+
+def field_arrays(data):
+    """Convert a chunk of data to a dict of field name to ndarray.
+
+    Args:
+        data (pandas.DataFrame or dict): columns named ``Con[0]``,
+            ``Con[1]``, ... are gathered into a 2D field ``Con``. A dict
+            maps field names to 1D or 2D arrays.
+
+    """
+    if isinstance(data, pd.DataFrame):
+        fields = {}
+        for name in data.columns:
+            m = COLUMN_RE.match(str(name))
+            field_name = m.group(1) if m else name
+            fields.setdefault(field_name, []).append(name)
+        arrays = {}
+        for field_name, columns in fields.items():
+            if len(columns) == 1 and columns[0] == field_name:
+                arrays[field_name] = _column_values(data[field_name])
+            else:
+                arrays[field_name] = np.column_stack(
+                    [_column_values(data[c]) for c in columns]
+                )
+        return arrays
+    return {
+        name: _column_values(values) if isinstance(values, pd.Series) else np.asarray(values)
+        for name, values in data.items()
+    }
+
+
+def _column_values(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.astype(object).to_numpy()
+    return series.to_numpy()
+
+
+def iter_field_chunks(data, chunksize=100000):
+    """Yield the data a chunk at a time as dicts of field arrays."""
+    if isinstance(data, (pd.DataFrame, dict)):
+        arrays = field_arrays(data)
+        nrecords = len(next(iter(arrays.values()))) if arrays else 0
+        for i in range(0, nrecords, chunksize):
+            yield {k: v[i : i + chunksize] for k, v in arrays.items()}
+    else:
+        for chunk in data:
+            yield field_arrays(chunk)
+
+
+def infer_field(name, values):
+    """Work out a field definition which can hold values.
+
+    Integers become ``I`` fields, floats ``F`` fields with the fewest
+    decimals which keep the values exactly (or ``E`` fields for values
+    too large or small for that), and anything else ``A`` fields. Each
+    field is one character wider than its widest value so that it is
+    separated from the previous field by a blank. Float fields are given a
+    NULL value, as missing values can turn up in any chunk. It has one more
+    digit than the largest value, so it can't be mistaken for one, and the
+    field is widened to fit it.
+
+    Args:
+        name (str): field name
+        values (ndarray): 1D or 2D (for a 2D field) sample of the values
+
+    Returns: dict in the form of the fields in ``GDF2.record_types``.
+
+    """
+    values = np.asarray(values)
+    cols = values.shape[1] if values.ndim == 2 else 1
+    flat = values.ravel()
+    null = None
+    if flat.dtype.kind in "iub":
+        flat = flat.astype(np.int64)
+        largest = int(np.abs(flat).max()) if len(flat) else 0
+        format = "I{:d}".format(len(str(largest)) + 2)
+    elif flat.dtype.kind == "f":
+        finite = flat[np.isfinite(flat)].astype(np.float64)
+        largest = float(np.abs(finite).max()) if len(finite) else 0.0
+        decimals = _decimals(finite, np.finfo(flat.dtype).eps)
+        digits = len(str(int(largest))) if largest >= 1 else 1
+        if decimals is None or digits + decimals > 15:
+            format = "E24.16"
+            null = "-9999999999"
+        else:
+            format = "F{:d}.{:d}".format(digits + decimals + 4, decimals)
+            null = "-" + "9" * (digits + 1)
+            if decimals:
+                null += "." + "9" * decimals
+    else:
+        text = [str(v) for v in flat if not pd.isna(v)]
+        width = max([len(t.encode("utf-8")) for t in text] + [0])
+        format = "A{:d}".format(width + 1)
+    width = parse_format(format)[2]
+    if cols > 1:
+        format = "{:d}{}".format(cols, format)
+    return {
+        "name": name,
+        "format": format,
+        "unit": "",
+        "null": null,
+        "long_name": "",
+        "comment": "",
+        "cols": cols,
+        "width": width,
+    }
+
+
+def _decimals(values, eps, most=8):
+    """Return the fewest decimals (up to most) which keep values exactly."""
+    for decimals in range(most + 1):
+        scaled = values * 10.0 ** decimals
+        tolerance = 4 * eps * np.maximum(np.abs(scaled), 1)
+        if (np.abs(scaled - np.rint(scaled)) <= tolerance).all():
+            return decimals
+    return None
+
+
+def dfn_lines(record_types):
+    """Generate the lines of a .dfn file.
+
+    Args:
+        record_types (dict): maps record type to ``{"fields": [...]}``,
+            in the form of ``GDF2.record_types``. The data record type is
+            ``""``.
+
+    """
+    lines = []
+    for record_type, definition in record_types.items():
+        if record_type == "":
+            continue
+        fields = [_field_definition(f) for f in definition["fields"]]
+        lines.append("DEFN   ST=RECD,RT={};{}".format(record_type, ";".join(fields)))
+    fields = record_types.get("", {"fields": []})["fields"]
+    for i, field in enumerate(fields):
+        lines.append("DEFN {:d} ST=RECD,RT=;{}".format(i + 1, _field_definition(field)))
+    lines.append("DEFN {:d} ST=RECD,RT=;END DEFN".format(len(fields) + 1))
+    return lines
+
+
+def _field_definition(field):
+    attributes = []
+    if not field.get("null", None) is None:
+        attributes.append("NULL={}".format(field["null"]))
+    if field.get("unit", ""):
+        attributes.append("UNIT={}".format(field["unit"]))
+    if field.get("long_name", ""):
+        attributes.append("NAME={}".format(field["long_name"]))
+    comment = field.get("comment", "")
+    if comment and not "=" in comment:
+        attributes.append(comment)
+    definition = "{}:{}".format(field["name"], field["format"])
+    if attributes:
+        definition += ":" + ",".join(attributes)
+    return definition
+
+
+def format_column(values, format, null=None):
+    """Format values as fixed-width text.
+
+    Args:
+        values (ndarray): 1D array of values
+        format (str): format code for one column, e.g. ``F10.3``
+        null (str): written for missing (NaN) values
+
+    Returns: 2D uint8 array of shape ``(len(values), width)``.
+
+    """
+    _, code, width, decimals = parse_format(format)
+    values = np.asarray(values)
+    if code == "A":
+        return _format_text(values, width, null)
+    missing = pd.isna(values) if values.dtype.kind in "fO" else None
+    if missing is not None and missing.any():
+        if null is None:
+            raise ValueError("Missing values but no NULL for format {}".format(format))
+        values = np.where(missing, 0, values)
+    values = values.astype(np.int64 if code == "I" else np.float64)
+    _check_null(np.round(values, decimals) if code == "F" else values, missing, null)
+    if code == "I":
+        out = _format_fixed(values, width, 0, point=False)
+    elif code == "F":
+        out = _format_fixed(values, width, decimals, point=decimals > 0)
+    elif code in ("E", "D", "G"):
+        out = _format_exponent(values, width, decimals)
+    else:
+        raise ValueError("Unable to write format code {}".format(format))
+    if missing is not None and missing.any():
+        out[missing] = _format_text(np.array([null]), width)[0]
+    return out
+
+
+def _check_null(values, missing, null):
+    """Check none of the values would be read back as missing."""
+    try:
+        null = float(null)
+    except (TypeError, ValueError):
+        return
+    clash = values == null
+    if not missing is None:
+        clash &= ~missing
+    if clash.any():
+        raise ValueError("Value {} is the NULL value of the field".format(null))
+
+
+def _check_width(length, width, values):
+    if len(length) and length.max() > width:
+        raise ValueError(
+            "Value {} does not fit in a field {} characters wide".format(
+                values[np.argmax(length)], width
+            )
+        )
+
+
+def _format_fixed(values, width, decimals, point=True):
+    n = len(values)
+    if values.dtype.kind == "f":
+        scaled = np.rint(np.abs(values) * 10.0 ** decimals)
+        if n and not (scaled < 2.0 ** 63).all():
+            raise ValueError("Value does not fit in a field {} characters wide".format(width))
+        scaled = scaled.astype(np.int64)
+    else:
+        scaled = np.abs(values)
+    negative = (values < 0) & (scaled > 0)
+    ndigits = np.maximum(1 + np.searchsorted(POWERS, scaled, side="right"), decimals + 1)
+    length = ndigits + int(point) + negative
+    _check_width(length, width, values)
+    out = np.full((n, width), SPACE, dtype=np.uint8)
+    remaining = scaled
+    col = width - 1
+    for k in range(int(ndigits.max()) if n else 0):
+        if point and k == decimals:
+            out[:, col] = DOT
+            col -= 1
+        remaining, digit = np.divmod(remaining, 10)
+        out[:, col] = np.where(k < ndigits, ZERO + digit, SPACE)
+        col -= 1
+    rows = np.flatnonzero(negative)
+    out[rows, width - length[rows]] = MINUS
+    return out
+
+
+def _format_exponent(values, width, decimals):
+    n = len(values)
+    magnitude = np.abs(values)
+    nonzero = magnitude > 0
+    exponent = np.zeros(n, dtype=np.int64)
+    exponent[nonzero] = np.floor(np.log10(magnitude[nonzero]))
+    mantissa = np.rint(magnitude * 10.0 ** (decimals - exponent))
+    # log10 can be out by one either way near powers of ten.
+    high = mantissa >= 10 ** (decimals + 1)
+    low = nonzero & (mantissa < 10 ** decimals)
+    exponent[high] += 1
+    exponent[low] -= 1
+    fix = high | low
+    mantissa[fix] = np.rint(magnitude[fix] * 10.0 ** (decimals - exponent[fix]))
+    mantissa = mantissa.astype(np.int64)
+    negative = (values < 0) & (mantissa > 0)
+    exponent_digits = 3 if n and (np.abs(exponent) >= 100).any() else 2
+    length = 1 + (decimals + 1 if decimals else 0) + 2 + exponent_digits + negative
+    _check_width(length, width, values)
+    out = np.full((n, width), SPACE, dtype=np.uint8)
+    col = width - 1
+    remaining = np.abs(exponent)
+    for k in range(exponent_digits):
+        remaining, digit = np.divmod(remaining, 10)
+        out[:, col] = ZERO + digit
+        col -= 1
+    out[:, col] = np.where(exponent < 0, MINUS, PLUS)
+    out[:, col - 1] = EXPONENT
+    col -= 2
+    remaining = mantissa
+    for k in range(decimals + 1):
+        if decimals and k == decimals:
+            out[:, col] = DOT
+            col -= 1
+        remaining, digit = np.divmod(remaining, 10)
+        out[:, col] = ZERO + digit
+        col -= 1
+    out[np.flatnonzero(negative), col] = MINUS
+    return out
+
+
+def _format_text(values, width, null=None):
+    n = len(values)
+    if values.dtype.kind == "S":
+        encoded = values
+    else:
+        if values.dtype.kind == "O":
+            missing = pd.isna(values)
+            if missing.any():
+                values = values.copy()
+                values[missing] = "" if null is None else null
+        encoded = np.char.encode(values.astype(str), "utf-8")
+    lengths = np.char.str_len(encoded) if n else np.zeros(0, dtype=int)
+    _check_width(lengths, width, values)
+    out = np.full((n, width), SPACE, dtype=np.uint8)
+    # Leave a blank before the text when every value has room for it.
+    offset = 1 if n and lengths.max() < width else 0
+    cells = np.asarray(encoded, dtype="S{:d}".format(width - offset))
+    cells = cells.view(np.uint8).reshape(n, width - offset)
+    out[:, offset:] = np.where(cells == 0, SPACE, cells)
+    return out
+
+
+def format_records(fields, arrays):
+    """Format a chunk of records as the bytes of .dat lines.
+
+    Args:
+        fields (list): field definitions, in file order
+        arrays (dict): maps field name to a 1D or 2D array of values
+
+    Returns: bytes
+
+    """
+    nrecords = len(arrays[fields[0]["name"]]) if fields else 0
+    length = sum(f["width"] * f["cols"] for f in fields)
+    out = np.empty((nrecords, length + 1), dtype=np.uint8)
+    out[:, -1] = NEWLINE
+    start = 0
+    for field in fields:
+        values = np.asarray(arrays[field["name"]])
+        if len(values) != nrecords:
+            raise ValueError(
+                "Field {} has {} values, expected {}".format(
+                    field["name"], len(values), nrecords
+                )
+            )
+        cols, code, width, decimals = parse_format(field["format"])
+        column_format = field["format"][len(str(cols)) :] if cols > 1 else field["format"]
+        block = format_column(values.reshape(-1), column_format, field.get("null", None))
+        stop = start + width * cols
+        out[:, start:stop] = block.reshape(nrecords, width * cols)
+        start = stop
+    return out.tobytes()
+
+
+def write(path, data, record_types=None, chunksize=100000):
+    """Write a GDF2 data package (.dfn and .dat files).
+
+    Args:
+        path (str): filename for the .dat or .dfn file, with or without
+            the extension
+        data: the data table, as a DataFrame, a dict of field name to
+            1D or 2D array, or an iterable of either to write the table a
+            chunk at a time. To write other record types too, pass a dict
+            mapping record type to data, e.g. ``{"": df, "COMM":
+            comments}``; these records are written before the data.
+        record_types (dict): field definitions in the form of
+            ``GDF2.record_types``, e.g. ``{"": {"fields": [...]}}``. Fields
+            which are not defined are worked out from the first chunk of
+            data with ``infer_field``, in which case later chunks must fit
+            in the same formats.
+        chunksize (int): number of records to format at a time when data
+            is a DataFrame or dict
+
+    Returns: a tuple of the .dfn and .dat filenames.
+
+    """
+    base, ext = os.path.splitext(str(path))
+    if not ext.lower() in (".dat", ".dfn"):
+        base += ext
+    dfn_filename = base + ".dfn"
+    dat_filename = base + ".dat"
+
+    if isinstance(data, dict) and "" in data:
+        sources = dict(data)
+    else:
+        sources = {"": data}
+    record_types = record_types or {}
+
+    definitions = {}
+    tagged = {}
+    for record_type, source in sources.items():
+        chunks = iter_field_chunks(source, chunksize)
+        first = next(chunks, None)
+        defined = {
+            f["name"]: dict(f)
+            for f in record_types.get(record_type, {"fields": []})["fields"]
+        }
+        fields = list(defined.values())
+        for name, values in (first or {}).items():
+            if not name in defined:
+                fields.append(infer_field(name, values))
+        for field in fields:
+            cols, code, width, decimals = parse_format(field["format"])
+            field["cols"], field["width"] = cols, width
+        definitions[record_type] = {"fields": fields}
+        if record_type:
+            tagged[record_type] = [first] + list(chunks) if first else []
+        else:
+            data_chunks = (chunks, first)
+
+    with open(dfn_filename, "w") as f:
+        for line in dfn_lines(definitions):
+            f.write(line + "\n")
+
+    nrecords = 0
+    with open(dat_filename, "wb") as f:
+        for record_type, chunks in tagged.items():
+            for chunk in chunks:
+                f.write(format_records(definitions[record_type]["fields"], chunk))
+        chunks, first = data_chunks
+        fields = definitions[""]["fields"]
+        if first is not None:
+            for chunk in itertools.chain([first], chunks):
+                f.write(format_records(fields, chunk))
+                nrecords += len(chunk[fields[0]["name"]])
+    logger.info("Wrote {} records to {}".format(nrecords, dat_filename))
+    return dfn_filename, dat_filename
@@ -0,0 +1,194 @@
+"""Benchmarks of reading synthetic survey data packages with asv.
+
+Each benchmark reads a package made by ``aseg_gdf2.synthetic.make_survey``.
+Packages are generated the first time they are needed and kept in
+``ASEG_GDF2_BENCHMARK_DATA`` (a directory under the system temporary
+directory by default), so that they are shared between runs and commits.
+
+By default the data tables go up to 10^6 records. Set
+``ASEG_GDF2_BENCHMARK_MAX_RECORDS=100000000`` to go up to 10^8, and
+``ASEG_GDF2_BENCHMARK_MAX_VALUES`` to change the largest number of values
+(records times channels) in a package, which is 10^8 by default.
+Combinations which are too large, or which cannot be read (fixed-width
+reads of ragged records), are skipped.
+
+"""
+import os
+import shutil
+import tempfile
+
+import aseg_gdf2
+from aseg_gdf2 import synthetic
+
+DATA_DIR = os.environ.get(
+    "ASEG_GDF2_BENCHMARK_DATA",
+    os.path.join(tempfile.gettempdir(), "aseg_gdf2_benchmarks"),
+)
+MAX_RECORDS = int(os.environ.get("ASEG_GDF2_BENCHMARK_MAX_RECORDS", 10 ** 6))
+MAX_VALUES = int(os.environ.get("ASEG_GDF2_BENCHMARK_MAX_VALUES", 10 ** 8))
+
+# Change this when make_survey changes, so that packages are made again.
+DATA_VERSION = 1
+
+NRECORDS = [n for n in (10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7, 10 ** 8) if n <= MAX_RECORDS]
+ENGINES = ["pandas", "dask", "numpy"]
+METHODS = ["whitespace", "fixed-widths"]
+
+
+def survey(nrecords, channels=30, layout="fixed", comments=False):
+    """Return the path of a synthetic survey, making it if necessary.
+
+    Raises NotImplementedError, which asv treats as a skipped benchmark, if
+    the survey would have more than MAX_VALUES values.
+
+    """
+    if nrecords * channels > MAX_VALUES:
+        raise NotImplementedError("larger than ASEG_GDF2_BENCHMARK_MAX_VALUES")
+    name = "survey_v{}_{}x{}_{}{}".format(
+        DATA_VERSION, nrecords, channels, layout, "_comm" if comments else ""
+    )
+    path = os.path.join(DATA_DIR, name)
+    if not os.path.isfile(path + ".dfn"):
+        # Write to a temporary name so that an interrupted run does not
+        # leave a partial package behind.
+        os.makedirs(DATA_DIR, exist_ok=True)
+        synthetic.make_survey(
+            path + "_tmp",
+            nrecords=nrecords,
+            channels=channels,
+            layout=layout,
+            comments=comments,
+        )
+        os.replace(path + "_tmp.dat", path + ".dat")
+        os.replace(path + "_tmp.dfn", path + ".dfn")
+    return path
+
+
+def remove_sidecars(path):
+    """Delete the index, cache and statistics files made by earlier reads."""
+    prefix = os.path.basename(path) + ".dat."
+    for name in os.listdir(os.path.dirname(path)):
+        if name.startswith(prefix):
+            filename = os.path.join(os.path.dirname(path), name)
+            if os.path.isdir(filename):
+                shutil.rmtree(filename)
+            else:
+                os.remove(filename)
+
+
+def compute(result):
+    """Finish the work behind a dask result so that it is timed."""
+    if isinstance(result, tuple):
+        return tuple(compute(r) for r in result)
+    if hasattr(result, "compute"):
+        return result.compute()
+    return result
+
+
+def check_method(layout, method):
+    if layout == "whitespace" and method == "fixed-widths":
+        raise NotImplementedError("ragged records can only be read as whitespace")
+
+
+class Read:
+    """Read the whole of a survey with 30 channels."""
+
+    params = [NRECORDS, ["fixed", "whitespace"], ENGINES, METHODS]
+    param_names = ["nrecords", "layout", "engine", "method"]
+    number = 1
+    repeat = (1, 5, 60.0)
+    timeout = 3600
+
+    def setup(self, nrecords, layout, engine, method):
+        check_method(layout, method)
+        self.path = survey(nrecords, layout=layout)
+        remove_sidecars(self.path)
+        self.gdf = aseg_gdf2.read(self.path, engine=engine, method=method)
+
+    def time_read(self, nrecords, layout, engine, method):
+        aseg_gdf2.read(self.path, engine=engine, method=method)
+
+    def time_nrecords(self, nrecords, layout, engine, method):
+        self.gdf.nrecords
+
+    def time_df(self, nrecords, layout, engine, method):
+        compute(self.gdf.df())
+
+    def peakmem_df(self, nrecords, layout, engine, method):
+        compute(self.gdf.df())
+
+    def time_get_fields_data(self, nrecords, layout, engine, method):
+        compute(self.gdf.get_fields_data(["EASTING", "NORTHING", "CON"]))
+
+    def peakmem_get_fields_data(self, nrecords, layout, engine, method):
+        compute(self.gdf.get_fields_data(["EASTING", "NORTHING", "CON"]))
+
+
+class IterRows:
+    """Iterate over every record of a survey with 30 channels."""
+
+    params = [[n for n in NRECORDS if n <= 10 ** 5], ENGINES, ["dict", "tuple"]]
+    param_names = ["nrecords", "engine", "kind"]
+    number = 1
+    repeat = (1, 3, 60.0)
+    timeout = 3600
+
+    def setup(self, nrecords, engine, kind):
+        self.gdf = aseg_gdf2.read(survey(nrecords), engine=engine)
+
+    def time_iterrows(self, nrecords, engine, kind):
+        for row in self.gdf.iterrows(kind=kind):
+            pass
+
+
+class WideFields:
+    """Read surveys with 2D fields of 30 to 500 channels."""
+
+    params = [NRECORDS, [30, 100, 500], ENGINES]
+    param_names = ["nrecords", "channels", "engine"]
+    number = 1
+    repeat = (1, 5, 60.0)
+    timeout = 3600
+
+    def setup(self, nrecords, channels, engine):
+        self.path = survey(nrecords, channels=channels)
+        self.gdf = aseg_gdf2.read(self.path, engine=engine, method="fixed-widths")
+
+    def time_df(self, nrecords, channels, engine):
+        compute(self.gdf.df())
+
+    def peakmem_df(self, nrecords, channels, engine):
+        compute(self.gdf.df())
+
+    def time_get_fields_data_2d(self, nrecords, channels, engine):
+        compute(self.gdf.get_fields_data(["CON"]))
+
+    def time_get_fields_data_1d(self, nrecords, channels, engine):
+        compute(self.gdf.get_fields_data(["MAG"]))
+
+    def peakmem_get_fields_data_1d(self, nrecords, channels, engine):
+        compute(self.gdf.get_fields_data(["MAG"]))
+
+
+class RecordTypes:
+    """Read a survey with a COMM record at the start of each line."""
+
+    params = [NRECORDS, ENGINES, METHODS]
+    param_names = ["nrecords", "engine", "method"]
+    number = 1
+    repeat = (1, 5, 60.0)
+    timeout = 3600
+
+    def setup(self, nrecords, engine, method):
+        self.path = survey(nrecords, comments=True)
+        remove_sidecars(self.path)
+        self.gdf = aseg_gdf2.read(self.path, engine=engine, method=method)
+
+    def time_nrecords(self, nrecords, engine, method):
+        self.gdf.nrecords
+
+    def time_df(self, nrecords, engine, method):
+        compute(self.gdf.df())
+
+    def time_read_record_types(self, nrecords, engine, method):
+        compute(tuple(self.gdf.read_record_types(["", "COMM"]).values()))
@@ -24,4 +24,11 @@ setup(
     ],
     keywords="python geophysics file-formats",
     install_requires=("pandas>=2.0,<3.0", "dask>=2023.1.0,<2025.0.0"),
+    extras_require={
+        "parquet": ["pyarrow"],
+        "zarr": ["zarr"],
+        "hdf5": ["h5py"],
+        "zstd": ["zstandard"],
+    },
+    entry_points={"console_scripts": ["aseg-gdf2=aseg_gdf2.cli:main"]},
 )
@@ -0,0 +1,25 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+tests = Path(__file__).parent
+
+# Sidecar files written next to .dat files, e.g. by GDF2.record_index.
+SIDECARS = ("*.index.npz", "*.runs.npz", "*.grid.npz", "*.stats.json", "*.npycache")
+
+
+def sidecar_files():
+    return {path for pattern in SIDECARS for path in tests.rglob(pattern)}
+
+
+@pytest.fixture(autouse=True, scope="session")
+def remove_sidecar_files():
+    """Remove the sidecar files written next to the example data packages."""
+    existing = sidecar_files()
+    yield
+    for path in sidecar_files() - existing:
+        if path.is_dir():
+            shutil.rmtree(path)
+        else:
+            path.unlink()
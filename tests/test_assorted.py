@@ -10,7 +10,7 @@ import pytest
 import aseg_gdf2
 
 
-@pytest.mark.parametrize("engine", ["pandas", "dask"])
+@pytest.mark.parametrize("engine", ["pandas", "dask", "numpy"])
 @pytest.mark.parametrize("method", ["whitespace", "fixed-widths"])
 class TestAssorted:
     def test_read_ext_dfn(self, engine, method):
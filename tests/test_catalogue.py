@@ -0,0 +1,105 @@
+import os, shutil, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from pathlib import Path
+
+repo = Path(__file__).parent.parent
+
+import pytest
+
+import aseg_gdf2
+from aseg_gdf2.catalogue import Catalogue, find_packages
+
+
+@pytest.fixture
+def archive(tmp_path):
+    root = tmp_path / "archive"
+    for subdir, src in (
+        ("a", repo / "tests" / "aseg_examples" / "Example_Mag_Gondwana_200Ma"),
+        ("a", repo / "tests" / "aseg_examples" / "Example_Rad256_SeasameSt_2008"),
+        ("b/c", repo / "tests" / "example_datasets" / "9a13704a" / "Mugrave_WB_MGA52"),
+    ):
+        (root / subdir).mkdir(parents=True, exist_ok=True)
+        for ext in (".dfn", ".dat", ".des", ".met"):
+            if os.path.isfile(str(src) + ext):
+                shutil.copy(str(src) + ext, root / subdir)
+    return root
+
+
+def test_find_packages(archive):
+    packages = find_packages(archive)
+    assert [os.path.basename(p["dfn"]) for p in packages] == [
+        "Example_Mag_Gondwana_200Ma.dfn",
+        "Example_Rad256_SeasameSt_2008.dfn",
+        "Mugrave_WB_MGA52.dfn",
+    ]
+    assert packages[0]["dat"].endswith("Example_Mag_Gondwana_200Ma.dat")
+    assert packages[0]["met"].endswith("Example_Mag_Gondwana_200Ma.met")
+    assert packages[2]["des"].endswith("Mugrave_WB_MGA52.des")
+    assert packages[2]["met"] is None
+
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_scan(archive, workers):
+    cat = aseg_gdf2.scan(str(archive), workers=workers)
+    assert os.path.isfile(str(archive / "aseg_gdf2_catalogue.sqlite"))
+    packages = cat.packages().set_index("dfn")
+    gondwana = packages.loc[str(archive / "a" / "Example_Mag_Gondwana_200Ma.dfn")]
+    assert gondwana["nrecords"] == 254
+    assert gondwana["nfields"] == 17
+    assert (gondwana["lon_field"], gondwana["lat_field"]) == ("Longitude", "Latitude")
+    assert gondwana["lon_min"] == pytest.approx(141.74971)
+    assert gondwana["lat_max"] == pytest.approx(-29.99336)
+    mugrave = packages.loc[str(archive / "b" / "c" / "Mugrave_WB_MGA52.dfn")]
+    assert (mugrave["x_field"], mugrave["y_field"]) == ("Easting", "NORTH")
+    assert mugrave["nrecords"] == 38
+
+    fields = cat.fields(archive / "b" / "c" / "Mugrave_WB_MGA52.dfn").set_index("name")
+    assert fields.loc["Con", "cols"] == 30
+    assert fields.loc["Con", "unit"] == "mS/m"
+    assert fields.loc["LINE", "count"] == 38
+
+    assert list(cat.find(bbox=(141, -31, 143, -29))["dfn"]) == [gondwana.name]
+    assert len(cat.find(bbox=(130, -31, 140, -29))) == 0
+    assert list(cat.find(fields=["Con", "LINE"])["dfn"]) == [mugrave.name]
+    found = cat.find(bbox=(800000, 7000000, 810000, 7100000), projected=True)
+    assert list(found["dfn"]) == [mugrave.name]
+    cat.close()
+
+
+def test_scan_incremental(archive, tmp_path):
+    filename = str(tmp_path / "catalogue.sqlite")
+    with Catalogue(filename) as cat:
+        assert cat.update(archive) == {"scanned": 3, "unchanged": 0, "removed": 0}
+        assert cat.update(archive) == {"scanned": 0, "unchanged": 3, "removed": 0}
+
+        dat = archive / "a" / "Example_Rad256_SeasameSt_2008.dat"
+        with open(dat, "rb") as f:
+            line = f.readline()
+        with open(dat, "ab") as f:
+            f.write(b"\r\n" + line.rstrip())
+        assert cat.update(archive) == {"scanned": 1, "unchanged": 2, "removed": 0}
+        packages = cat.packages().set_index("dfn")
+        assert packages.loc[str(dat)[:-4] + ".dfn", "nrecords"] == 85
+
+        os.remove(archive / "b" / "c" / "Mugrave_WB_MGA52.dat")
+        assert cat.update(archive)["scanned"] == 1
+        errors = cat.packages()["error"].dropna()
+        assert len(errors) == 1 and "No .dat file" in errors.iloc[0]
+
+        shutil.rmtree(archive / "b")
+        assert cat.update(archive) == {"scanned": 0, "unchanged": 2, "removed": 1}
+        assert len(cat) == 2
+        assert set(cat.fields()["package_id"]) == set(cat.packages().index)
+
+
+def test_scan_cli(archive, tmp_path, capsys):
+    from aseg_gdf2.cli import main
+
+    filename = tmp_path / "cat.sqlite"
+    os.remove(archive / "a" / "Example_Mag_Gondwana_200Ma.dat")
+    assert main(["scan", str(archive), "-c", str(filename), "-w", "2"]) == 0
+    out = capsys.readouterr().out
+    assert "3 packages in {}".format(filename) in out
+    assert "Example_Mag_Gondwana_200Ma.dfn: " in out
@@ -0,0 +1,104 @@
+import os, shutil, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from pathlib import Path
+
+repo = Path(__file__).parent.parent
+
+import pytest
+import numpy as np
+import pandas as pd
+
+import aseg_gdf2
+from aseg_gdf2.cli import main
+
+mugrave = repo / "tests" / "example_datasets" / "9a13704a" / "Mugrave_WB_MGA52"
+rad256 = repo / "tests" / "aseg_examples" / "Example_Rad256_SeasameSt_2008"
+
+
+def copy_package(src, path):
+    """Copy a data package, so that sidecar files are written in path."""
+    for ext in (".dfn", ".dat"):
+        shutil.copy(str(src) + ext, path)
+    return path / src.name
+
+
+def test_convert_parquet(tmp_path, capsys):
+    pq = pytest.importorskip("pyarrow.parquet")
+    out = tmp_path / "out.parquet"
+    assert main(["convert", str(mugrave) + ".dfn", str(out), "--chunksize", "10"]) == 0
+    assert "Wrote 38 records" in capsys.readouterr().out
+    table = pq.read_table(str(out))
+    expected = aseg_gdf2.read(str(mugrave), method="fixed-widths").df()
+    pd.testing.assert_frame_equal(table.to_pandas(), expected)
+    metadata = table.schema.field("Con[3]").metadata
+    assert metadata[b"field"] == b"Con"
+    assert metadata[b"unit"] == b"mS/m"
+    assert metadata[b"format"] == b"30F15.5"
+
+
+def test_convert_parquet_fields_workers(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    out = tmp_path / "out.pq"
+    args = ["convert", str(mugrave) + ".dat", str(out), "-f", "LINE,Con", "-w", "2"]
+    assert main(args + ["--chunksize", "7", "--method", "whitespace"]) == 0
+    df = pq.read_table(str(out)).to_pandas()
+    expected = aseg_gdf2.read(str(mugrave)).df()
+    assert list(df.columns) == ["LINE"] + ["Con[{}]".format(i) for i in range(30)]
+    pd.testing.assert_frame_equal(df, expected[df.columns])
+
+
+def test_convert_errors(tmp_path, capsys):
+    with pytest.raises(SystemExit):
+        main(["convert", str(mugrave) + ".dfn", str(tmp_path / "out.csv")])
+    assert "Unable to tell the output format" in capsys.readouterr().err
+    with pytest.raises(SystemExit):
+        main(["convert", str(mugrave) + ".dfn", str(tmp_path / "out.h5"), "-f", "Foo"])
+    assert "Unknown fields: Foo" in capsys.readouterr().err
+
+
+def test_convert_zarr(tmp_path):
+    zarr = pytest.importorskip("zarr")
+    out = tmp_path / "out.zarr"
+    assert main(["convert", str(mugrave) + ".dfn", str(out), "--chunksize", "10"]) == 0
+    group = zarr.open_group(str(out), mode="r")
+    gdf = aseg_gdf2.read(str(mugrave), method="fixed-widths")
+    con, line = gdf.get_fields_data(["Con", "LINE"])
+    np.testing.assert_array_equal(group["Con"][:], con)
+    np.testing.assert_array_equal(group["LINE"][:], line)
+    assert group["Con"].attrs["unit"] == "mS/m"
+    assert len(group["Con"].attrs["columns"]) == 30
+
+
+def test_convert_hdf5(tmp_path):
+    h5py = pytest.importorskip("h5py")
+    src = copy_package(rad256, tmp_path)
+    out = tmp_path / "out.h5"
+    assert main(["convert", str(src) + ".dfn", str(out), "-f", "FLTLINE,RAW_SPEC"]) == 0
+    gdf = aseg_gdf2.read(str(src), method="fixed-widths", engine="numpy")
+    fltline, spec = gdf.get_fields_data(["FLTLINE", "RAW_SPEC"])
+    with h5py.File(str(out), "r") as f:
+        assert f["RAW_SPEC"].shape == (84, 256)
+        assert list(f["FLTLINE"].asstr()[:]) == list(fltline)
+        assert f["RAW_SPEC"].attrs["format"] == gdf.get_field_definition("RAW_SPEC")["format"]
+
+
+def test_convert_arrow(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    src = copy_package(rad256, tmp_path)
+    out = tmp_path / "out.arrow"
+    args = ["convert", str(src) + ".dfn", str(out), "-f", "FLTLINE,RAW_SPEC"]
+    assert main(args + ["--dtypes", "compact", "--chunksize", "20"]) == 0
+    table = pa.ipc.open_file(str(out)).read_all()
+    gdf = aseg_gdf2.read(str(src), method="fixed-widths", dtypes="compact")
+    fltline, spec = gdf.get_fields_data(["FLTLINE", "RAW_SPEC"])
+    # Categories are written as plain strings.
+    assert table.schema.field("FLTLINE").type == pa.string()
+    assert table.schema.field("RAW_SPEC").type == pa.list_(pa.float32(), 256)
+    assert table.column("FLTLINE").to_pylist() == list(fltline)
+    raw_spec = table.column("RAW_SPEC").combine_chunks().flatten()
+    np.testing.assert_array_equal(
+        raw_spec.to_numpy(zero_copy_only=False).reshape(-1, 256), spec
+    )
+    assert table.schema.field("RAW_SPEC").metadata[b"format"] == b"256f5.0"
@@ -1,4 +1,4 @@
-import os, sys
+import os, shutil, sys
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
@@ -8,11 +8,12 @@ repo = Path(__file__).parent.parent
 
 import pytest
 import numpy as np
+import pandas as pd
 
 import aseg_gdf2
 
 
-@pytest.mark.parametrize("engine", ["pandas", "dask"])
+@pytest.mark.parametrize("engine", ["pandas", "dask", "numpy"])
 @pytest.mark.parametrize("method", ["whitespace", "fixed-widths"])
 class TestDatasets:
     def test_iterrows_1(self, engine, method):
@@ -51,6 +52,81 @@ class TestDatasets:
         )
         assert gdf.nrecords == 23040
 
+    def test_rows(self, engine, method):
+        gdf = aseg_gdf2.read(
+            str(repo / "tests" / "example_datasets" / "9a13704a" / "Mugrave_WB_MGA52"),
+            method=method,
+            engine=engine
+        )
+        df = gdf.rows(10, 20)
+        if engine == "dask":
+            df = df.compute()
+        assert list(df.index) == list(range(10, 20))
+        assert (df["LINE"] == gdf.get_field_data("LINE")[10:20]).all()
+
+    def test_rows_bounds(self, engine, method):
+        gdf = aseg_gdf2.read(
+            str(repo / "tests" / "example_datasets" / "3bcfc711" / "GA1286_Waveforms"),
+            method=method,
+            engine=engine
+        )
+        for (start, stop), expected in [
+            ((-3, None), [23037, 23038, 23039]),
+            ((-3, -1), [23037, 23038]),
+            ((23038, 30000), [23038, 23039]),
+            ((30000, 40000), []),
+            ((20, 10), []),
+        ]:
+            df = gdf.rows(start, stop, usecols=["Time"])
+            if engine == "dask":
+                df = df.compute()
+            assert list(df.index) == expected
+
+    def test_df_rows_slice(self, engine, method):
+        gdf = aseg_gdf2.read(
+            str(repo / "tests" / "example_datasets" / "3bcfc711" / "GA1286_Waveforms"),
+            method=method,
+            engine=engine
+        )
+        df = gdf.df(rows=slice(-3, None), usecols=["Time"])
+        if engine == "dask":
+            df = df.compute()
+        assert list(df.columns) == ["Time"]
+        assert list(df["Time"]) == [59.9844, 59.9896, 59.9948]
+        assert df.index[-1] == 23039
+
+    def test_iterrows_kinds(self, engine, method):
+        gdf = aseg_gdf2.read(
+            str(repo / "tests" / "example_datasets" / "9a13704a" / "Mugrave_WB_MGA52"),
+            method=method,
+            engine=engine
+        )
+        expected = next(gdf.iterrows())
+        for kind in ("tuple", "record"):
+            rows = list(gdf.iterrows(kind=kind))
+            assert len(rows) == 38
+            assert rows[0]["Index"] == 0
+            assert rows[0]["LINE"] == expected["LINE"]
+            assert rows[0]["Con[0]"] == expected["_43"]
+            assert np.isnan(rows[5]["Con_doi[24]"])
+        assert next(gdf.iterrows(kind="tuple")).LINE == 112601
+        with pytest.raises(ValueError):
+            next(gdf.iterrows(kind="list"))
+
+    def test_iterchunks(self, engine, method):
+        gdf = aseg_gdf2.read(
+            str(repo / "tests" / "example_datasets" / "9a13704a" / "Mugrave_WB_MGA52"),
+            method=method,
+            engine=engine
+        )
+        chunks = list(gdf.iterchunks(chunksize=10, fields=["LINE", "Con_doi"]))
+        assert [len(c["LINE"]) for c in chunks] == [10, 10, 10, 8]
+        assert chunks[0]["Con_doi"].shape == (10, 30)
+        assert chunks[0]["Con_doi"][4, -6] == 174.27675
+        assert np.isnan(chunks[0]["Con_doi"][5, -6])
+        frames = list(gdf.iterchunks(chunksize=30, kind="dataframe"))
+        assert [f.shape for f in frames] == [(30, 132), (8, 132)]
+
     def test_2d_field_data(self, engine, method):
         gdf = aseg_gdf2.read(
             str(repo / "tests" / "example_datasets" / "9a13704a" / "Mugrave_WB_MGA52"),
@@ -201,6 +277,10 @@ class TestDatasets:
                 clean_column_names=True
             )
 
+            row = next(gdf.iterrows(usecols=["flight", "conductivity"], kind="tuple"))
+            assert row.flight == 59
+            assert row.conductivity_29 == "1.175960e-03"
+
             row = next(gdf.iterrows(usecols=["flight", "conductivity"]))
             assert row == {
                 "Index": 0,
@@ -236,3 +316,718 @@ class TestDatasets:
                 "conductivity_9": "7.498534e-02",
                 "flight": 59
             }
+
+
+@pytest.mark.parametrize(
+    "dataset",
+    [
+        ("example_datasets", "3bcfc711", "GA1286_Waveforms"),
+        ("example_datasets", "8e598964", "AusAEM_02_NT&WA_AEM_Tranche1_GA_vsum_inversion"),
+        ("example_datasets", "9a13704a", "Mugrave_WB_MGA52"),
+        ("aseg_examples", "Example_Rad256_SeasameSt_2008"),
+    ],
+)
+def test_numpy_engine_matches_pandas(dataset):
+    gdf = aseg_gdf2.read(str(repo.joinpath("tests", *dataset)), method="fixed-widths")
+    expected = gdf.df()
+    gdf.engine = "numpy"
+    pd.testing.assert_frame_equal(gdf.df(), expected)
+    field_name = gdf.field_names()[0]
+    pd.testing.assert_frame_equal(
+        gdf.df(usecols=[field_name]), expected[[field_name]]
+    )
+
+
+def test_numpy_engine_chunks():
+    gdf = aseg_gdf2.read(
+        str(repo / "tests" / "example_datasets" / "3bcfc711" / "GA1286_Waveforms"),
+        method="fixed-widths",
+        engine="numpy",
+    )
+    chunks = list(gdf.df(chunksize=5000))
+    assert [len(c) for c in chunks] == [5000, 5000, 5000, 5000, 3040]
+    assert chunks[-1].index[-1] == 23039
+    assert chunks[-1]["Time"].iloc[-1] == 59.9948
+
+
+def test_memmap_random_access():
+    gdf = aseg_gdf2.read(
+        str(repo / "tests" / "example_datasets" / "3bcfc711" / "GA1286_Waveforms")
+    )
+    table = gdf.memmap()
+    assert len(table) == 23040
+    assert table[0]["Time"] == 0.0052
+    # The last record has no line terminator.
+    assert table[-1]["Time"] == 59.9948
+    assert (table["Time"][-2:] == [59.9896, 59.9948]).all()
+    assert table.records[1]["Time"] == b"    0.0104"
+    pd.testing.assert_frame_equal(table[100:200], gdf.df().iloc[100:200])
+
+
+def test_memmap_2d_field():
+    gdf = aseg_gdf2.read(
+        str(repo / "tests" / "example_datasets" / "9a13704a" / "Mugrave_WB_MGA52")
+    )
+    column = gdf.memmap()["Con_doi"]
+    assert column.shape == (38, 30)
+    assert column[4, -6] == 174.27675
+    assert np.isnan(column[5, -6])
+    np.testing.assert_array_equal(
+        np.asarray(column), gdf.get_field_data("Con_doi")
+    )
+    assert sum(len(c) for c in column.iterchunks(10)) == 38
+
+
+def test_cache(tmp_path, monkeypatch):
+    src = repo / "tests" / "example_datasets" / "9a13704a"
+    for ext in ("dfn", "dat"):
+        shutil.copy(src / ("Mugrave_WB_MGA52." + ext), tmp_path)
+    expected = aseg_gdf2.read(str(src / "Mugrave_WB_MGA52")).df()
+
+    gdf = aseg_gdf2.read(str(tmp_path / "Mugrave_WB_MGA52"), cache=True)
+    pd.testing.assert_frame_equal(gdf.df(), expected)
+    assert (tmp_path / "Mugrave_WB_MGA52.dat.npycache" / "manifest.json").is_file()
+    assert gdf._column_cache.is_valid()
+    pd.testing.assert_frame_equal(gdf.df(), expected)
+    assert gdf.get_field_data("Con_doi")[4, -6] == 174.27675
+    assert next(gdf.iterrows())["LINE"] == 112601
+
+    # Touching the file keeps the cache because the contents are unchanged.
+    os.utime(gdf.dat_filename, (0, 0))
+    assert gdf._column_cache.is_valid()
+    # The new mtime is saved, so the file is not hashed again.
+    with monkeypatch.context() as m:
+        m.setattr(aseg_gdf2.cache, "file_hash", None)
+        assert gdf._column_cache.is_valid()
+        cache = aseg_gdf2.cache.ColumnCache(
+            gdf.dat_filename, gdf._column_cache.path, gdf._column_cache.schema
+        )
+        assert cache.is_valid()
+    with open(gdf.dat_filename, "ab") as f:
+        f.write(b" ")
+    assert not gdf._column_cache.is_valid()
+
+
+def test_cache_directory(tmp_path):
+    gdf = aseg_gdf2.read(
+        str(repo / "tests" / "example_datasets" / "3bcfc711" / "GA1286_Waveforms"),
+        cache=str(tmp_path),
+    )
+    assert len(gdf.df(usecols=["Time"])) == 23040
+    assert (tmp_path / "GA1286_Waveforms.dat.npycache").is_dir()
+    gdf.clear_cache()
+    assert not (tmp_path / "GA1286_Waveforms.dat.npycache").exists()
+
+
+@pytest.mark.parametrize(
+    "dataset, field_names",
+    [
+        (("3bcfc711", "GA1286_Waveforms"), ["Time", "Flight"]),
+        (("9a13704a", "Mugrave_WB_MGA52"), ["LINE", "Con_doi", "Easting"]),
+    ],
+)
+def test_numpy_engine_projected_fields_data(dataset, field_names):
+    path = str(repo.joinpath("tests", "example_datasets", *dataset))
+    expected = aseg_gdf2.read(path).get_fields_data(field_names)
+    gdf = aseg_gdf2.read(path, method="fixed-widths", engine="numpy")
+    for array, expected_array in zip(gdf.get_fields_data(field_names), expected):
+        assert array.shape == expected_array.shape
+        np.testing.assert_array_equal(array, expected_array)
+
+
+@pytest.mark.parametrize("engine", ["pandas", "numpy"])
+def test_rows_ragged_records(tmp_path, engine):
+    src = repo / "tests" / "aseg_examples" / "Example_Mag_Gondwana_200Ma"
+    for ext in (".dfn", ".dat"):
+        shutil.copy(str(src) + ext, tmp_path)
+    dat_filename = tmp_path / "Example_Mag_Gondwana_200Ma.dat"
+    # Pad records with trailing whitespace so they are no longer fixed-length.
+    lines = dat_filename.read_bytes().splitlines()
+    lines = [line + b" " * (i % 3) for i, line in enumerate(lines)]
+    dat_filename.write_bytes(b"\n".join(lines) + b"\n")
+    gdf = aseg_gdf2.read(
+        str(tmp_path / "Example_Mag_Gondwana_200Ma"), method="fixed-widths", engine=engine
+    )
+    assert not gdf.record_index.is_fixed
+    expected = gdf.df()
+    pd.testing.assert_frame_equal(gdf.rows(100, 110), expected.iloc[100:110])
+
+
+@pytest.mark.parametrize("engine", ["pandas", "dask", "numpy"])
+@pytest.mark.parametrize("method", ["whitespace", "fixed-widths"])
+def test_field_index_where(tmp_path, engine, method):
+    src = repo / "tests" / "example_datasets" / "9a13704a"
+    for ext in ("dfn", "dat"):
+        shutil.copy(src / ("Mugrave_WB_MGA52." + ext), tmp_path)
+    gdf = aseg_gdf2.read(
+        str(tmp_path / "Mugrave_WB_MGA52"), method=method, engine=engine
+    )
+    index = gdf.build_index("LINE")
+    assert list(index.unique()) == [112601, 912002]
+    assert (tmp_path / "Mugrave_WB_MGA52.dat.LINE.runs.npz").is_file()
+
+    df = gdf.df(where={"LINE": 912002}, usecols=["LINE", "Con"])
+    if engine == "dask":
+        df = df.compute()
+    assert list(df.index) == list(range(16, 38))
+    assert df.columns[1] == "Con[0]"
+    assert (df["LINE"] == 912002).all()
+
+    con = gdf.get_field_data("Con", line=112601)
+    assert con.shape == (16, 30)
+    assert np.isnan(gdf.get_field_data("Con_doi", where={"LINE": 112601})[5, -6])
+
+
+@pytest.mark.parametrize("engine", ["pandas", "dask", "numpy"])
+@pytest.mark.parametrize("method", ["whitespace", "fixed-widths"])
+def test_spatial_index_bbox(tmp_path, engine, method):
+    # Six east-west lines flown back and forth, with 20 records each.
+    line = np.repeat(np.arange(1, 7) * 10, 20)
+    easting = np.tile(np.arange(20) * 50.0, 6)
+    easting[20:40] = easting[20:40][::-1]
+    easting[60:80] = easting[60:80][::-1]
+    easting[100:120] = easting[100:120][::-1]
+    northing = line * 10.0 + 6000000
+    mag = np.arange(120) * 0.5
+    mag[7] = np.nan
+    aseg_gdf2.write(
+        str(tmp_path / "survey.dat"),
+        pd.DataFrame({"LINE": line, "EAST": easting, "NORTH": northing, "MAG": mag}),
+    )
+    gdf = aseg_gdf2.read(str(tmp_path / "survey"), method=method, engine=engine)
+    with pytest.raises(ValueError):
+        gdf.df(bbox=(0, 0, 1, 1))
+    index = gdf.build_spatial_index("EAST", "NORTH", ncells=16)
+    assert max(index.shape) == 16
+    assert len(index) < gdf.nrecords
+    assert (tmp_path / "survey.dat.EAST.NORTH.grid.npz").is_file()
+
+    expected = gdf.df()
+    if engine == "dask":
+        expected = expected.compute()
+    bbox = (200, 6000150, 420, 6000500)
+    assert len(index.ranges(bbox)) > 1
+    for bbox in [bbox, (0, 0, 1e7, 1e7), (0, 0, 1, 1), (-100, 6000100, 0, 6000100)]:
+        inside = expected["EAST"].between(bbox[0], bbox[2]) & expected[
+            "NORTH"
+        ].between(bbox[1], bbox[3])
+        df = gdf.df(bbox=bbox, usecols=["LINE", "MAG"])
+        if engine == "dask":
+            df = df.compute()
+        assert list(df.columns) == ["LINE", "MAG"]
+        assert list(df.index) == list(expected.index[inside])
+        np.testing.assert_array_equal(df["MAG"], expected["MAG"][inside])
+        mag = np.asarray(gdf.get_field_data("MAG", bbox=bbox))
+        np.testing.assert_array_equal(mag, expected["MAG"][inside])
+
+    # A new session loads the index from its sidecar file.
+    gdf = aseg_gdf2.read(str(tmp_path / "survey"))
+    assert gdf.spatial_index().shape == index.shape
+    df = gdf.df(bbox=(200, 6000150, 420, 6000500), where={"LINE": 20})
+    assert list(df["EAST"]) == [400, 350, 300, 250, 200]
+
+
+@pytest.mark.parametrize("engine", ["pandas", "numpy"])
+@pytest.mark.parametrize("method", ["whitespace", "fixed-widths"])
+def test_df_workers(monkeypatch, engine, method):
+    # Force several byte ranges on the small example file.
+    monkeypatch.setattr(aseg_gdf2.gdf2, "PARALLEL_MIN_BYTES", 1000)
+    gdf = aseg_gdf2.read(
+        str(repo / "tests" / "example_datasets" / "9a13704a" / "Mugrave_WB_MGA52"),
+        method=method,
+        engine=engine,
+    )
+    assert len(gdf._byte_ranges(4)) == 4
+    pd.testing.assert_frame_equal(gdf.df(workers=2), gdf.df())
+    pd.testing.assert_frame_equal(
+        gdf.df(workers=2, usecols=["LINE", "Con"]), gdf.df(usecols=["LINE", "Con"])
+    )
+    with pytest.raises(ValueError):
+        gdf.df(workers=2, nrows=5)
+
+
+@pytest.mark.parametrize("engine", ["pandas", "numpy"])
+@pytest.mark.parametrize("method", ["whitespace", "fixed-widths"])
+def test_iterchunks_workers(engine, method):
+    gdf = aseg_gdf2.read(
+        str(repo / "tests" / "example_datasets" / "9a13704a" / "Mugrave_WB_MGA52"),
+        method=method,
+        engine=engine,
+    )
+    chunks = list(gdf.iterchunks(chunksize=10, fields=["LINE", "Con"], workers=2))
+    expected = list(gdf.iterchunks(chunksize=10, fields=["LINE", "Con"]))
+    assert [len(c["LINE"]) for c in chunks] == [10, 10, 10, 8]
+    for chunk, expected_chunk in zip(chunks, expected):
+        np.testing.assert_array_equal(chunk["Con"], expected_chunk["Con"])
+        np.testing.assert_array_equal(chunk["LINE"], expected_chunk["LINE"])
+    df = pd.concat(gdf.iterchunks(chunksize=10, kind="dataframe", workers=2))
+    pd.testing.assert_frame_equal(df, gdf.df())
+
+
+@pytest.mark.parametrize("engine", ["pandas", "dask", "numpy"])
+@pytest.mark.parametrize("method", ["whitespace", "fixed-widths"])
+@pytest.mark.parametrize("workers", [None, 2])
+def test_stats(tmp_path, engine, method, workers):
+    src = repo / "tests" / "example_datasets" / "9a13704a"
+    for ext in ("dfn", "dat"):
+        shutil.copy(src / ("Mugrave_WB_MGA52." + ext), tmp_path)
+    gdf = aseg_gdf2.read(str(tmp_path / "Mugrave_WB_MGA52"), method=method, engine=engine)
+    stats = gdf.stats(fields=["LINE", "Con_doi", "Easting"], chunksize=7, workers=workers)
+    assert list(stats) == ["LINE"] + list(gdf.get_field_columns("Con_doi")) + ["Easting"]
+    assert stats["Con_doi[0]"].histogram()[0].sum() == 38
+    assert stats.fields["Con_doi[21]"] == "Con_doi"
+
+    df = gdf.df() if engine != "dask" else gdf.df().compute()
+    summary = stats.to_frame()
+    expected = df[list(stats)].describe().T
+    np.testing.assert_array_equal(summary["count"], expected["count"])
+    np.testing.assert_array_equal(summary["nulls"], df[list(stats)].isna().sum())
+    assert summary.loc["Con_doi[21]", "nulls"] == 2
+    for name in ("min", "max", "mean", "std"):
+        np.testing.assert_allclose(summary[name], expected[name], rtol=1e-12)
+    for column in ("Con_doi[21]", "Easting"):
+        counts, edges = stats[column].histogram()
+        assert len(counts) <= 64
+        np.testing.assert_array_equal(
+            counts, np.histogram(df[column].dropna(), bins=edges)[0]
+        )
+
+    # The second call is answered from the sidecar file.
+    assert (tmp_path / "Mugrave_WB_MGA52.dat.stats.json").is_file()
+    gdf.iterchunks = None
+    cached = gdf.stats(fields=["Con_doi", "LINE"])
+    assert cached["Con_doi[21]"].to_dict() == stats["Con_doi[21]"].to_dict()
+
+
+def test_stats_sidecar(tmp_path):
+    src = repo / "tests" / "aseg_examples" / "Example_Mag_Gondwana_200Ma"
+    for ext in (".dfn", ".dat"):
+        shutil.copy(str(src) + ext, tmp_path)
+    gdf = aseg_gdf2.read(str(tmp_path / "Example_Mag_Gondwana_200Ma"))
+    first = gdf.stats(fields=["Longitude"])
+    assert first["Longitude"].min == 141.74971
+
+    # Columns not in the sidecar file yet are read and added to it.
+    both = gdf.stats(fields=["Latitude", "Longitude"])
+    assert both["Longitude"].to_dict() == first["Longitude"].to_dict()
+    # Columns read with other dtypes (float32 here) are computed again.
+    radalt = gdf.stats(fields=["Radalt"])["Radalt"]
+    compact = aseg_gdf2.read(gdf.dfn_filename[:-4], dtypes="compact")
+    compact_radalt = compact.stats(fields=["Radalt"])["Radalt"]
+    assert compact_radalt.min == float(np.float32(radalt.min)) != radalt.min
+    assert gdf.stats(fields=["Radalt"])["Radalt"].min == radalt.min
+    with open(gdf.dat_filename, "rb") as f:
+        dat = f.read()
+    os.remove(gdf.dat_filename)
+    with open(gdf.dat_filename, "wb") as f:
+        f.write(dat)
+    # The .dat file has a new mtime so the statistics are computed again.
+    assert aseg_gdf2.stats.load(gdf.dat_filename) == {}
+    assert gdf.stats(fields=["Latitude"])["Latitude"].max == both["Latitude"].max
+
+
+@pytest.mark.parametrize("engine", ["pandas", "dask", "numpy"])
+@pytest.mark.parametrize("method", ["whitespace", "fixed-widths"])
+def test_record_types(tmp_path, engine, method):
+    src = repo / "tests" / "aseg_examples" / "Example_Mag_Gondwana_200Ma"
+    shutil.copy(str(src) + ".dfn", tmp_path)
+    with open(str(src) + ".dat", "rb") as f:
+        lines = f.readlines()
+    lines = [b"COMM Survey flown 1995\n"] + lines[:50] + [b"COMM Line 47020\n"] + lines[50:]
+    with open(tmp_path / "Example_Mag_Gondwana_200Ma.dat", "wb") as f:
+        f.write(b"".join(lines))
+
+    expected = aseg_gdf2.read(str(src), method=method).df()
+    gdf = aseg_gdf2.read(
+        str(tmp_path / "Example_Mag_Gondwana_200Ma"), method=method, engine=engine
+    )
+    assert gdf.tagged_record_types == ["COMM"]
+    frames = gdf.read_record_types()
+    if engine == "dask":
+        frames = {k: v.compute() for k, v in frames.items()}
+    pd.testing.assert_frame_equal(frames[""], expected, check_dtype=False)
+    assert list(frames["COMM"]["COMMENTS"]) == ["Survey flown 1995", "Line 47020"]
+
+    comments = gdf.df(record_type="COMM", usecols=["COMMENTS"])
+    df = gdf.df()
+    if engine == "dask":
+        comments = comments.compute()
+        df = df.compute()
+    assert list(comments.columns) == ["COMMENTS"]
+    pd.testing.assert_frame_equal(df, expected, check_dtype=False)
+    assert len(gdf.get_field_data("Line")) == len(expected)
+
+
+@pytest.mark.parametrize("method", ["whitespace", "fixed-widths"])
+def test_dask_partitions(method):
+    gdf = aseg_gdf2.read(
+        str(repo / "tests" / "example_datasets" / "9a13704a" / "Mugrave_WB_MGA52"),
+        method=method,
+        engine="dask",
+    )
+    expected = aseg_gdf2.read(gdf.dfn_filename[:-4], method=method).df()
+    ddf = gdf.df(blocksize=10000)
+    assert ddf.known_divisions
+    assert ddf.npartitions == 7
+    pd.testing.assert_frame_equal(ddf.compute(), expected)
+    part = ddf.loc[22:24]
+    assert part.npartitions == 1
+    assert list(part.compute().index) == [22, 23, 24]
+
+    con, line = gdf.get_fields_data(["Con", "LINE"])
+    assert con.shape == (38, 30)
+    assert not np.isnan(con.chunks[0]).any()
+    np.testing.assert_array_equal(line.compute(), expected["LINE"].to_numpy())
+
+
+@pytest.mark.parametrize("method", ["whitespace", "fixed-widths"])
+def test_dask_partitions_blank_lines(tmp_path, method):
+    src = repo / "tests" / "example_datasets" / "9a13704a" / "Mugrave_WB_MGA52"
+    shutil.copy(str(src) + ".dfn", tmp_path)
+    with open(str(src) + ".dat", "rb") as f:
+        lines = [line for line in f if line.strip()]
+    with open(tmp_path / "Mugrave_WB_MGA52.dat", "wb") as f:
+        f.write(b"".join(lines[:20] + [b"\n"] + lines[20:] + [b"\n"]))
+    gdf = aseg_gdf2.read(
+        str(tmp_path / "Mugrave_WB_MGA52"), method=method, engine="dask"
+    )
+    ddf = gdf.df(blocksize=10000)
+    assert ddf.divisions[-1] == 37
+    assert len(ddf.compute()) == 38
+    (line,) = gdf.get_fields_data(["LINE"])
+    assert line.shape == (38,)
+    assert line.compute().shape == (38,)
+
+
+@pytest.mark.parametrize("engine", ["pandas", "dask", "numpy"])
+@pytest.mark.parametrize("method", ["whitespace", "fixed-widths"])
+def test_compact_dtypes(tmp_path, engine, method):
+    src = repo / "tests" / "aseg_examples" / "Example_Rad256_SeasameSt_2008"
+    for ext in (".dfn", ".dat"):
+        shutil.copy(str(src) + ext, tmp_path)
+    expected = aseg_gdf2.read(str(src), method=method).df()
+    gdf = aseg_gdf2.read(
+        str(tmp_path / "Example_Rad256_SeasameSt_2008"),
+        method=method,
+        engine=engine,
+        dtypes="compact",
+    )
+    df = gdf.df()
+    if engine == "dask":
+        df = df.compute()
+    assert df["FLTLINE"].dtype == "category"
+    assert df["FLIGHT"].dtype == np.int16
+    assert df["TEMP"].dtype == np.float32
+    assert df["EAST"].dtype == np.float64
+    assert list(df["DATE"].unique()) == ["20080113"]
+    assert (df["FIDUCIAL"] == expected["FIDUCIAL"].astype(float)).all()
+
+    if engine != "dask":
+        gdf.cache = True
+        assert gdf.df()["DATE"].dtype == "category"
+        pd.testing.assert_frame_equal(gdf.df(), df)
+
+
+@pytest.mark.parametrize("engine", ["pandas", "dask", "numpy"])
+@pytest.mark.parametrize("method", ["whitespace", "fixed-widths"])
+def test_to_gdf2(tmp_path, engine, method):
+    for src in (
+        repo / "tests" / "example_datasets" / "9a13704a" / "Mugrave_WB_MGA52",
+        repo / "tests" / "example_datasets" / "3bcfc711" / "GA1286_Waveforms",
+    ):
+        gdf = aseg_gdf2.read(str(src), method=method, engine=engine)
+        dfn, dat = gdf.to_gdf2(str(tmp_path / src.name), chunksize=10)
+        assert dfn.endswith(".dfn") and dat.endswith(".dat")
+        expected = aseg_gdf2.read(str(src), method=method).df()
+        df = aseg_gdf2.read(dat, method=method).df()
+        pd.testing.assert_frame_equal(df, expected)
+
+
+@pytest.mark.parametrize("method", ["whitespace", "fixed-widths"])
+def test_to_gdf2_record_types(tmp_path, method):
+    src = repo / "tests" / "aseg_examples" / "Example_Mag_Gondwana_200Ma"
+    shutil.copy(str(src) + ".dfn", tmp_path)
+    with open(str(src) + ".dat", "rb") as f:
+        lines = f.readlines()
+    with open(tmp_path / "Example_Mag_Gondwana_200Ma.dat", "wb") as f:
+        f.write(b"".join([b"COMM Survey flown 1995\n"] + lines))
+
+    gdf = aseg_gdf2.read(str(tmp_path / "Example_Mag_Gondwana_200Ma"), method=method)
+    gdf.to_gdf2(str(tmp_path / "copy"))
+    copy = aseg_gdf2.read(str(tmp_path / "copy"), method=method)
+    assert copy.tagged_record_types == ["COMM"]
+    frames = copy.read_record_types()
+    assert list(frames["COMM"]["COMMENTS"]) == ["Survey flown 1995"]
+    pd.testing.assert_frame_equal(frames[""], gdf.df())
+
+
+@pytest.mark.parametrize("method", ["whitespace", "fixed-widths"])
+def test_write(tmp_path, method):
+    df = pd.DataFrame(
+        {
+            "LINE": [1001, 1001, 1002],
+            "EAST": [412345.25, np.nan, 412360.5],
+            "STATION": ["A1", "B22", "C"],
+            "Con[0]": [1.5e-3, 2.25, 3e4],
+            "Con[1]": [4.0, 5.125e-7, 6.0],
+        }
+    )
+    dfn, dat = aseg_gdf2.write(str(tmp_path / "out.dat"), df)
+    gdf = aseg_gdf2.read(dfn, method=method, dtypes="compact")
+    assert gdf.field_names() == ["LINE", "EAST", "STATION", "Con"]
+    assert gdf.get_field_definition("Con")["cols"] == 2
+    result = gdf.df()
+    assert list(result["LINE"]) == [1001, 1001, 1002]
+    np.testing.assert_array_equal(result["EAST"], df["EAST"])
+    assert list(result["STATION"].astype(str)) == ["A1", "B22", "C"]
+    np.testing.assert_allclose(gdf.get_field_data("Con"), df[["Con[0]", "Con[1]"]])
+
+
+def test_write_null_outside_values(tmp_path):
+    df = pd.DataFrame({"MAG": [9.99, -9.99, np.nan, 0.5]})
+    dfn, dat = aseg_gdf2.write(str(tmp_path / "out.dat"), df)
+    gdf = aseg_gdf2.read(dfn)
+    assert gdf.get_field_definition("MAG")["null"] == "-99.99"
+    np.testing.assert_array_equal(gdf.df()["MAG"], df["MAG"])
+
+    with pytest.raises(ValueError, match="NULL"):
+        aseg_gdf2.writer.format_column(np.array([1.0, -9.994]), "F6.2", "-9.99")
+
+
+def _compress(data, compression, member_size=None):
+    import bz2, gzip
+
+    if compression == "zstd":
+        zstandard = pytest.importorskip("zstandard")
+        compress = zstandard.ZstdCompressor().compress
+    else:
+        compress = gzip.compress if compression == "gzip" else bz2.compress
+    if member_size is None:
+        return compress(data)
+    return b"".join(
+        compress(data[i : i + member_size]) for i in range(0, len(data), member_size)
+    )
+
+
+@pytest.mark.parametrize("engine", ["pandas", "dask", "numpy"])
+@pytest.mark.parametrize("method", ["whitespace", "fixed-widths"])
+@pytest.mark.parametrize(
+    "compression, ext, member_size",
+    [
+        ("gzip", ".gz", 20000),
+        ("gzip", ".gz", None),
+        ("bz2", ".bz2", 20000),
+        ("zstd", ".zst", 20000),
+    ],
+)
+def test_compressed_dat(tmp_path, engine, method, compression, ext, member_size):
+    src = repo / "tests" / "example_datasets" / "9a13704a" / "Mugrave_WB_MGA52"
+    shutil.copy(str(src) + ".dfn", tmp_path)
+    with open(str(src) + ".dat", "rb") as f:
+        data = f.read()
+    dat = tmp_path / ("Mugrave_WB_MGA52.dat" + ext)
+    with open(dat, "wb") as f:
+        f.write(_compress(data, compression, member_size))
+
+    plain = aseg_gdf2.read(str(src), method=method, engine=engine)
+    gdf = aseg_gdf2.read(str(tmp_path / "Mugrave_WB_MGA52"), method=method, engine=engine)
+    assert gdf.dat_filename.endswith(ext)
+    assert gdf.nrecords == plain.nrecords
+    if member_size is None:
+        assert len(gdf.record_index.blocks) == 1
+    else:
+        assert len(gdf.record_index.blocks) > 1
+    assert gdf.record_index.blocks.size == len(data)
+
+    expected = aseg_gdf2.read(str(src), method=method).df()
+    df = gdf.df()
+    rows = gdf.rows(30, 40)
+    expected_rows = plain.rows(30, 40)
+    if engine == "dask":
+        df = df.compute()
+        rows = rows.compute()
+        expected_rows = expected_rows.compute()
+    pd.testing.assert_frame_equal(df, expected)
+    pd.testing.assert_frame_equal(rows, expected_rows)
+    con = gdf.get_field_data("Con")
+    if hasattr(con, "compute"):
+        con = con.compute()
+    np.testing.assert_array_equal(con, expected.filter(like="Con[").to_numpy())
+
+    # The index sidecar is reused, and the .dat.gz path can be given directly.
+    reopened = aseg_gdf2.read(str(dat), method=method, engine=engine)
+    assert len(reopened.record_index.blocks) == len(gdf.record_index.blocks)
+    assert reopened.nrecords == plain.nrecords
+
+
+def test_compressed_read_ranges(tmp_path):
+    from aseg_gdf2 import compression
+
+    data = b"".join(b"%06d\n" % i for i in range(10000))
+    filename = str(tmp_path / "ranges.dat.gz")
+    with open(filename, "wb") as f:
+        f.write(_compress(data, "gzip", 7000))
+    members = []
+    assert b"".join(compression.iter_decompressed(filename, members=members)) == data
+    blocks = compression.BlockIndex.from_members(members)
+    assert len(blocks) == 10
+    assert blocks.size == len(data)
+    assert blocks.find(6999) == (0, 0)
+    assert blocks.find(7000)[1] == 7000
+
+    with open(str(tmp_path / "ranges.dat"), "wb") as f:
+        f.write(data)
+    ranges = [(5, 20), (6990, 7020), (30000, 30007), (100, 107), (69990, 70000)]
+    for name in (filename, str(tmp_path / "ranges.dat")):
+        for b in (None, blocks):
+            assert compression.read_range(name, 6990, 7020, b) == data[6990:7020]
+            assert list(compression.read_ranges(name, ranges, b)) == [
+                data[begin:end] for begin, end in ranges
+            ]
+
+    # Ranges past the end of the file are empty.
+    ranges = [(0, 2), (69995, 70010), (80000, 80010)]
+    for name in (filename, str(tmp_path / "ranges.dat")):
+        for b in (None, blocks):
+            assert list(compression.read_ranges(name, ranges, b)) == [
+                data[begin:end] for begin, end in ranges
+            ]
+
+
+@pytest.mark.parametrize("engine", ["pandas", "dask", "numpy"])
+@pytest.mark.parametrize("method", ["whitespace", "fixed-widths"])
+def test_to_arrow(tmp_path, engine, method):
+    pa = pytest.importorskip("pyarrow")
+    df = pd.DataFrame(
+        {
+            "LINE": [1001, 1001, 1002, 1002, 1003],
+            "EAST": [412345.25, np.nan, 412360.5, 412370.0, 412380.75],
+            "STATION": ["A1", "B22", "C", "D4", "E5"],
+            "Con[0]": [1.5e-3, 2.25, 3e4, np.nan, 7.0],
+            "Con[1]": [4.0, 5.125e-7, 6.0, 8.0, 9.5],
+        }
+    )
+    dfn, dat = aseg_gdf2.write(str(tmp_path / "out.dat"), df)
+    gdf = aseg_gdf2.read(dfn, method=method, engine=engine)
+    schema = gdf.to_arrow(fields=["LINE", "STATION", "Con"]).schema
+    assert schema.field("LINE").type == pa.int64()
+    assert schema.field("STATION").type == pa.string()
+    # E format codes are read as text unless dtypes="compact".
+    assert schema.field("Con").type == pa.list_(pa.string(), 2)
+
+    gdf = aseg_gdf2.read(dfn, method=method, engine=engine, dtypes="compact")
+    table = gdf.to_arrow(chunksize=2)
+    assert gdf.last_read_stats.operation == "to_arrow"
+    assert table.column_names == ["LINE", "EAST", "STATION", "Con"]
+    assert table.num_rows == 5
+    assert table.column("LINE").num_chunks == 3
+    assert table.schema.field("STATION").type == pa.dictionary(pa.int32(), pa.string())
+    assert table.schema.field("Con").type == pa.list_(pa.float64(), 2)
+    definition = gdf.get_field_definition("Con")
+    metadata = table.schema.field("Con").metadata
+    assert metadata[b"format"] == definition["format"].encode()
+    assert metadata[b"null"] == definition["null"].encode()
+    assert metadata[b"columns"] == b'["Con[0]", "Con[1]"]'
+
+    assert table.column("LINE").to_pylist() == list(df["LINE"])
+    assert table.column("EAST").null_count == 1
+    np.testing.assert_array_equal(
+        table.column("EAST").to_numpy(zero_copy_only=False), df["EAST"]
+    )
+    assert table.column("STATION").to_pylist() == list(df["STATION"])
+    con = table.column("Con").combine_chunks()
+    assert con.flatten().null_count == 1
+    np.testing.assert_allclose(
+        np.stack(con.to_numpy(zero_copy_only=False)), df[["Con[0]", "Con[1]"]]
+    )
+
+    batches = list(gdf.iter_batches(chunksize=4, fields=["STATION", "Con"]))
+    assert [b.num_rows for b in batches] == [4, 1]
+    assert batches[0].schema.names == ["STATION", "Con"]
+
+    arrow_df = gdf.df(dtype_backend="pyarrow")
+    if engine == "dask":
+        arrow_df = arrow_df.compute()
+    assert all(isinstance(dtype, pd.ArrowDtype) for dtype in arrow_df.dtypes)
+    assert arrow_df["EAST"].isna().sum() == 1
+    assert list(arrow_df["STATION"]) == list(df["STATION"])
+    assert list(gdf.df(rows=slice(3, 5), dtype_backend="pyarrow").index) == [3, 4]
+    with pytest.raises(ValueError):
+        gdf.df(dtype_backend="numpy_nullable")
+
+
+@pytest.mark.parametrize("engine", ["pandas", "dask", "numpy"])
+@pytest.mark.parametrize("method", ["whitespace", "fixed-widths"])
+def test_follow(tmp_path, engine, method):
+    from aseg_gdf2 import synthetic
+
+    dfn, dat = synthetic.make_survey(
+        str(tmp_path / "full"),
+        nrecords=1000,
+        channels=3,
+        comments=True,
+        records_per_line=200,
+    )
+    with open(dat, "rb") as f:
+        data = f.read()
+    expected = aseg_gdf2.read(dfn, method=method).read_record_types()
+    shutil.copy(dfn, tmp_path / "live.dfn")
+    live = str(tmp_path / "live.dat")
+    open(live, "wb").close()
+
+    gdf = aseg_gdf2.read(str(tmp_path / "live.dfn"), method=method, engine=engine)
+    follower = gdf.follow()
+    comments = gdf.follow("COMM", usecols=["COMMENTS"])
+    frames = []
+    comment_frames = []
+    # Cut the file in the middle of lines, and with nothing new in between.
+    cuts = [0, 1234, 1240, 1240, 30000, 30001, len(data) - 5, len(data)]
+    for begin, end in zip(cuts[:-1], cuts[1:]):
+        with open(live, "ab") as f:
+            f.write(data[begin:end])
+        df = follower.read()
+        comment_df = comments.read()
+        if engine == "dask":
+            df = df.compute()
+            comment_df = comment_df.compute()
+        assert follower.offset == data.rfind(b"\n", 0, end) + 1
+        frames.append(df)
+        comment_frames.append(comment_df)
+        partial = not data[:end].endswith(b"\n") and end > 0
+        assert gdf.nrecords == data[:end].count(b"\n") + partial
+    assert [len(df) for df in frames][2] == 0
+    pd.testing.assert_frame_equal(
+        pd.concat(frames), expected[""], check_index_type=False
+    )
+    assert follower.nrecords == 1000
+    comment_df = pd.concat(comment_frames)
+    assert list(comment_df["COMMENTS"]) == list(expected["COMM"]["COMMENTS"])
+    assert list(comment_df.index) == list(range(5))
+
+    tail = gdf.follow(start=None)
+    assert tail.nrecords == 1000
+    assert len(gdf.follow(start=998).read()) == 2
+    lines = data.splitlines(True)
+    with open(live, "ab") as f:
+        f.write(b"".join(lines[-2:]) + lines[-1][:10])
+    df = tail.read()
+    if engine == "dask":
+        df = df.compute()
+    assert list(df.index) == [1000, 1001]
+    assert tail.nrecords == 1002
+
+    # Blank lines are not records.
+    dfn, dat = synthetic.make_survey(
+        str(tmp_path / "blank"), nrecords=20, channels=3, comments=True
+    )
+    with open(dat, "rb") as f:
+        lines = f.readlines()
+    with open(dat, "wb") as f:
+        f.write(b"".join(lines[:5] + [b"\n", b"  \n"] + lines[5:]))
+    gdf = aseg_gdf2.read(dfn, method=method, engine=engine)
+    assert gdf.follow(start=None).nrecords == 20
+    assert len(gdf.follow(start=20).read()) == 0
+    df = gdf.follow(start=4).read()
+    if engine == "dask":
+        df = df.compute()
+    assert list(df.index) == list(range(4, 20))
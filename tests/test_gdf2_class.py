@@ -2,13 +2,20 @@
 Tests for the GDF2 class in aseg_gdf2
 """
 import os
+import shutil
+import subprocess
 import sys
 
 from pathlib import Path
 
+import numpy as np
+import pandas as pd
 import pytest
 
 import aseg_gdf2
+from aseg_gdf2 import fixed_width
+from aseg_gdf2.gdf2 import compact_dtype
+from aseg_gdf2.index import RecordIndex
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 repo = Path(__file__).parent.parent
@@ -18,7 +25,7 @@ data_src_1 = os.path.join(
 )
 
 
-@pytest.mark.parametrize("engine", ["pandas", "dask"])
+@pytest.mark.parametrize("engine", ["pandas", "dask", "numpy"])
 @pytest.mark.parametrize("method", ["whitespace", "fixed-widths"])
 class TestGDF2Class:
     def test_repr_1(self, engine, method):
@@ -44,3 +51,267 @@ class TestGDF2Class:
         assert len(res) == 5
         for item in res:
             assert "name" in item
+
+
+def test_record_index_fixed_length(tmp_path, monkeypatch):
+    for ext in (".dfn", ".dat"):
+        shutil.copy(data_src_1 + ext, tmp_path)
+    gdf = aseg_gdf2.read(str(tmp_path / os.path.basename(data_src_1)))
+    index = gdf.record_index
+    assert index.is_fixed
+    assert index.nrecords == 23040
+    assert index.offset(1) == 50
+
+    # The checked record length is saved, so the file is not read again.
+    def check(*args):
+        raise AssertionError("record boundaries checked again")
+
+    monkeypatch.setattr(fixed_width, "_is_terminated", check)
+    fixed_width._checked.clear()
+    loaded = RecordIndex.open(gdf.dat_filename)
+    assert loaded.record_length == 50
+    assert loaded.nrecords == 23040
+    assert gdf.memmap()[1]["Time"] == gdf.rows(1, 2)["Time"].iloc[0]
+
+
+def test_record_index_fixed_length_extend(tmp_path, monkeypatch):
+    dat = str(tmp_path / "test.dat")
+    with open(dat, "wb") as f:
+        f.write(b"".join("{:>19d}\n".format(i).encode() for i in range(1000)))
+    index = RecordIndex.open(dat)
+    assert index.nrecords == 1000
+
+    checked = []
+    is_terminated = fixed_width._is_terminated
+
+    def check(f, start, stop, *args):
+        checked.append((start, stop))
+        return is_terminated(f, start, stop, *args)
+
+    monkeypatch.setattr(fixed_width, "_is_terminated", check)
+    fixed_width._checked.clear()
+    with open(dat, "ab") as f:
+        f.write(b"".join("{:>19d}\n".format(i).encode() for i in range(1000, 1500)))
+    # Only the appended records are checked.
+    index = RecordIndex.open(dat)
+    assert index.is_fixed
+    assert index.nrecords == 1500
+    assert checked == [(1000, 1500)]
+    assert RecordIndex.load(dat).record_length == 20
+
+    with open(dat, "ab") as f:
+        # A record of another length.
+        f.write(b"1500\n")
+    index = RecordIndex.open(dat)
+    assert not index.is_fixed
+    assert index.nrecords == 1501
+
+
+def test_record_index_not_fixed_length(tmp_path):
+    # Every line is 20 bytes except two, whose boundary is not one of the
+    # sampled ones, so the file is the size of 1000 fixed-length records.
+    lines = ["{:>19d}\n".format(i).encode() for i in range(1000)]
+    lines[500] = lines[500][1:]
+    lines[501] = b" " + lines[501]
+    dat = str(tmp_path / "test.dat")
+    with open(dat, "wb") as f:
+        f.write(b"".join(lines))
+    assert fixed_width.detect_record_length(dat) == (None, b"\n")
+    assert fixed_width.detect_record_length(b"".join(lines)) == (None, b"\n")
+    index = RecordIndex.open(dat, sidecar=False)
+    assert not index.is_fixed
+    assert index.nrecords == 1000
+    with open(dat, "rb") as f:
+        assert index.seek(f, 501).readline() == lines[501]
+
+
+def test_record_index_sidecar(tmp_path):
+    src = os.path.join(repo, "tests", "aseg_examples", "Example_Gravity_Springfield_1989")
+    for ext in (".dfn", ".dat"):
+        shutil.copy(src + ext, tmp_path)
+    gdf = aseg_gdf2.read(str(tmp_path / "Example_Gravity_Springfield_1989"))
+    assert gdf.nrecords == 56
+    assert os.path.isfile(gdf.dat_filename + ".index.npz")
+
+    with open(gdf.dat_filename, "rb") as f:
+        lines = f.readlines()
+    index = RecordIndex.load(gdf.dat_filename)
+    assert index.nrecords == 56
+    with open(gdf.dat_filename, "rb") as f:
+        for n in (0, 1, 30, 55):
+            assert index.seek(f, n).readline() == lines[n]
+
+
+def test_record_index_extend(tmp_path):
+    src = os.path.join(repo, "tests", "aseg_examples", "Example_Gravity_Springfield_1989")
+    shutil.copy(src + ".dfn", tmp_path)
+    with open(src + ".dat", "rb") as f:
+        data = f.read()
+    dat = str(tmp_path / "Example_Gravity_Springfield_1989.dat")
+    # Stop in the middle of a line, as if the file is still being written.
+    cut = data.index(b"\n", len(data) // 3) + 10
+    with open(dat, "wb") as f:
+        f.write(data[:cut])
+    index = RecordIndex.open(dat, stride=4)
+    assert index.nrecords == data[:cut].count(b"\n") + 1
+
+    with open(dat, "ab") as f:
+        f.write(data[cut:])
+    assert RecordIndex.load(dat) is None
+    extended = index.extend()
+    expected = RecordIndex.build(dat, stride=4)
+    assert extended.nrecords == 56
+    assert extended.is_current()
+    np.testing.assert_array_equal(extended.offsets, expected.offsets)
+    # The out of date sidecar file is extended and saved.
+    assert RecordIndex.open(dat, stride=4).nrecords == 56
+    assert RecordIndex.load(dat).nrecords == 56
+
+    gdf = aseg_gdf2.read(dat)
+    assert gdf.nrecords == 56
+    with open(dat, "wb") as f:
+        f.write(data[:cut])
+    assert extended.extend() is None
+    assert gdf.nrecords == data[:cut].count(b"\n") + 1
+    with open(dat, "ab") as f:
+        f.write(data[cut:])
+    assert gdf.nrecords == 56
+
+
+def test_record_index_blank_lines(tmp_path):
+    src = os.path.join(repo, "tests", "aseg_examples", "Example_Gravity_Springfield_1989")
+    shutil.copy(src + ".dfn", tmp_path)
+    with open(src + ".dat", "rb") as f:
+        lines = [line for line in f if line.strip()]
+    dat = str(tmp_path / "Example_Gravity_Springfield_1989.dat")
+    with open(dat, "wb") as f:
+        f.write(b"".join(lines[:10] + [b"\n", b"   \r\n"] + lines[10:] + [b" "]))
+    for stride in (1, 4, 256):
+        index = RecordIndex.build(dat, stride=stride)
+        assert index.nrecords == 56
+        with open(dat, "rb") as f:
+            for n in (0, 9, 10, 11, 55):
+                assert index.seek(f, n).readline() == lines[n]
+        assert index.offset(56) == os.path.getsize(dat)
+
+    gdf = aseg_gdf2.read(dat)
+    df = gdf.df()
+    assert gdf.nrecords == len(df) == 56
+    rows = gdf.rows(9, 12)
+    assert list(rows.index) == [9, 10, 11]
+    pd.testing.assert_frame_equal(rows, df.iloc[9:12])
+
+
+def test_compact_dtype():
+    def field(format, null=None):
+        return {"format": format, "inferred_dtype": str, "null": null}
+
+    assert compact_dtype(field("F7.3")) is np.float32
+    assert compact_dtype(field("f7.3")) is np.float32
+    assert compact_dtype(field("F10.3")) is np.float64
+    assert compact_dtype(field("I4")) is np.int16
+    assert compact_dtype(field("I10")) is np.int64
+    assert compact_dtype(field("I4", null="-999")) is np.float32
+    assert compact_dtype(field("30E12.5")) is np.float32
+    assert compact_dtype(field("E15.6")) is np.float64
+    assert compact_dtype(field("A10")) == "category"
+
+
+def test_schema_cache(tmp_path):
+    for ext in (".dfn", ".dat"):
+        shutil.copy(data_src_1 + ext, tmp_path)
+    dfn = tmp_path / "GA1286_Waveforms.dfn"
+    dfn.write_text(dfn.read_text().replace("Flight:I6", "FLTNUM:I6"))
+    gdf = aseg_gdf2.read(str(dfn))
+    schema = gdf.schema()
+    assert gdf.schema() is schema
+    assert gdf._read_dat[""] is gdf._read_dat[""]
+    assert schema.widths == (10, 10, 6, 10, 13)
+    assert schema.offsets == (0, 10, 20, 26, 36)
+    assert schema.column_fields["Tx_Current"] == "Tx_Current"
+    assert gdf.column_names() == ["FLTNUM", "Rx_Voltage", "FLTNUM", "Time", "Tx_Current"]
+
+    gdf.fix_duplicate_field_names()
+    assert not gdf.schema() is schema
+    assert gdf.field_names()[:3] == ["FLTNUM__1", "Rx_Voltage", "FLTNUM__2"]
+    assert gdf.get_field_definition("FLTNUM__2")["format"] == "I6"
+    assert list(gdf.df().columns) == gdf.column_names()
+
+    gdf.clean_column_names = True
+    assert gdf.schema().column_names[0] == "FLTNUM__1"
+    gdf.dtypes = "compact"
+    assert gdf.column_dtypes()[2] is np.float32
+    assert gdf.df()["FLTNUM__2"].dtype == np.float32
+
+
+def test_lazy_open():
+    gdf = aseg_gdf2.read(data_src_1, lazy=True, engine="numpy")
+    assert gdf._record_types is None
+    assert gdf._engines == {}
+    assert gdf.dat_filename.endswith("GA1286_Waveforms.dat")
+    assert gdf.field_names() == ["FLTNUM", "Rx_Voltage", "Flight", "Time", "Tx_Current"]
+    assert gdf.nrecords == 23040
+    assert list(gdf._engines) == []
+    assert len(gdf.df(nrows=3)) == 3
+    assert list(gdf._engines) == ["numpy"]
+    assert "FLTNUM" in gdf.dfn_contents
+
+
+def test_import_without_dask():
+    code = "import sys, aseg_gdf2; aseg_gdf2.read({!r}).df(); sys.exit('dask' in sys.modules)"
+    subprocess.run(
+        [sys.executable, "-c", code.format(data_src_1)], check=True, cwd=str(repo)
+    )
+
+
+@pytest.mark.parametrize("engine", ["pandas", "dask", "numpy"])
+@pytest.mark.parametrize("method", ["whitespace", "fixed-widths"])
+def test_last_read_stats(engine, method):
+    gdf = aseg_gdf2.read(data_src_1, engine=engine, method=method)
+    assert gdf.last_read_stats is None
+    size = os.path.getsize(gdf.dat_filename)
+
+    gdf.get_fields_data(["Time", "Tx_Current"])
+    stats = gdf.last_read_stats
+    assert stats.operation == "get_fields_data"
+    assert (stats.engine, stats.method) == (engine, method)
+    assert "parse" in stats.stages
+    assert stats.seconds >= sum(r["seconds"] for r in stats.records) > 0
+
+    chunks = gdf.iterchunks(chunksize=5000)
+    stats = gdf.last_read_stats
+    assert sum(len(chunk["Time"]) for chunk in chunks) == 23040
+    assert stats.operation == "iterchunks"
+    parse = stats["parse"]
+    assert parse["rows"] >= 23040
+    assert parse["bytes"] >= size * 0.9
+    assert parse["bytes_per_second"] > 0
+
+    frame = stats.to_frame()
+    assert frame.loc["parse", "rows"] == parse["rows"]
+    assert list(stats.to_dict()["stages"]) == stats.stages
+
+
+def test_collect_read_stats():
+    from aseg_gdf2 import instrument
+
+    records = []
+    instrument.add_callback(records.append)
+    try:
+        with instrument.collect() as stats:
+            gdf = aseg_gdf2.read(data_src_1, method="fixed-widths", engine="numpy")
+            gdf.rows(100, 200)
+    finally:
+        instrument.remove_callback(records.append)
+    assert records == stats.records
+    assert stats.stages == ["dfn", "index", "schema", "read", "parse"]
+    assert stats["dfn"]["calls"] == 1
+    assert stats["read"]["bytes"] == 100 * 50
+    assert stats["parse"]["rows"] == 100
+    by_stage = {r["stage"]: r for r in records}
+    assert by_stage["dfn"]["operation"] is None
+    assert by_stage["parse"]["operation"] == "rows"
+    assert by_stage["parse"]["engine"] == "numpy"
+
+    gdf.df()
+    assert len(records) == len(stats.records)
@@ -0,0 +1,75 @@
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from pathlib import Path
+
+repo = Path(__file__).parent.parent
+
+import pytest
+import numpy as np
+
+import aseg_gdf2
+from aseg_gdf2 import synthetic
+
+
+@pytest.mark.parametrize("layout", ["fixed", "whitespace"])
+@pytest.mark.parametrize("comments", [False, True])
+def test_make_survey(tmp_path, layout, comments):
+    dfn, dat = synthetic.make_survey(
+        tmp_path / "survey",
+        nrecords=2500,
+        channels=40,
+        layout=layout,
+        comments=comments,
+        records_per_line=1000,
+        chunksize=1000,
+    )
+    expected = next(
+        synthetic.survey_chunks(2500, channels=40, records_per_line=1000, chunksize=2500)
+    )
+    methods = ["whitespace", "fixed-widths"] if layout == "fixed" else ["whitespace"]
+    for method in methods:
+        gdf = aseg_gdf2.read(dfn, method=method)
+        assert gdf.field_names() == [f["name"] for f in synthetic.survey_fields(40)]
+        line, mag, con = gdf.get_fields_data(["LINE", "MAG", "CON"])
+        np.testing.assert_array_equal(line, expected["LINE"])
+        assert list(np.unique(line)) == [1000, 1010, 1020]
+        assert np.isnan(mag).sum() == np.isnan(expected["MAG"]).sum() > 0
+        np.testing.assert_allclose(mag, expected["MAG"], atol=0.0005)
+        np.testing.assert_allclose(con, expected["CON"], atol=0.00005)
+        if comments:
+            comm = gdf.df(record_type="COMM")
+            assert list(comm["COMMENTS"]) == [
+                "Survey line 1000",
+                "Survey line 1010",
+                "Survey line 1020",
+            ]
+    lengths = {len(line) for line in open(dat, "rb") if not line.startswith(b"COMM")}
+    assert (len(lengths) == 1) == (layout == "fixed")
+
+
+def test_benchmarks(tmp_path, monkeypatch):
+    # Run each benchmark once on a tiny survey so that they keep working.
+    from benchmarks import benchmarks
+
+    monkeypatch.setattr(benchmarks, "DATA_DIR", str(tmp_path))
+    for cls in (
+        benchmarks.Read,
+        benchmarks.IterRows,
+        benchmarks.WideFields,
+        benchmarks.RecordTypes,
+    ):
+        for engine in benchmarks.ENGINES:
+            params = [
+                engine if name == "engine" else 1000 if name == "nrecords" else values[0]
+                for name, values in zip(cls.param_names, cls.params)
+            ]
+            bench = cls()
+            bench.setup(*params)
+            for name in dir(bench):
+                if name.startswith(("time_", "peakmem_")):
+                    getattr(bench, name)(*params)
+    with pytest.raises(NotImplementedError):
+        benchmarks.Read().setup(1000, "whitespace", "numpy", "fixed-widths")
+    assert (tmp_path / "survey_v1_1000x30_fixed_comm.dat").is_file()